@@ -4,7 +4,6 @@ import sys
 import glob
 import pandas
 import numpy
-import nipy.modalities.fmri.hrf
 import matplotlib.pyplot as plt
 from nipy import load_image
 from subprocess import call
@@ -15,6 +14,7 @@ from scipy.ndimage import convolve1d
 from scipy.sparse import spdiags
 from scipy.linalg import toeplitz
 
+from clpipe.postprocutils.utils import build_trial_design
 
 pandas.options.mode.chained_assignment = None
 parser = argparse.ArgumentParser(prog="betaSeriesReg")
@@ -450,14 +450,7 @@ for i in targets:
             # TODO: Add in code to remove particular types of stimuli from the analysis.
             TR = float(args.TR)
             ntp = len(targetConfounds)
-            time_res = TR / 16.0
-            timeCourse = numpy.arange(0, 32 + TR / 16.0, (TR / 16.0))
-            time_up = numpy.arange(0, TR * ntp, TR / 16.0)
-            n_up = len(time_up)
-            hrf = nipy.modalities.fmri.hrf.spm_hrf_compat(timeCourse)
-            eventArray = numpy.zeros((len(targetConfounds), len(onsetData)))
-            indexSample = numpy.arange(0, TR * ntp / (TR / 16.0), TR / (TR / 16.0))
-            indexSample = indexSample.astype("int")
+            eventArray, onsetData = build_trial_design(onsetData, TR, ntp)
 
             sigN2 = ((100 / TR) / (numpy.sqrt(2.0))) ** 2.0
             K = toeplitz(
@@ -477,17 +470,6 @@ for i in targets:
 
             F = numpy.eye(ntp) - H
 
-            for index, row in onsetData.iterrows():
-                ev_loop = numpy.zeros(n_up)
-                index1 = numpy.logical_and(
-                    (time_up >= row["onset"]),
-                    (time_up <= row["onset"] + row["duration"]),
-                )
-                ev_loop[index1] = 1
-                ev_loop = numpy.convolve(ev_loop, hrf)
-                ev_loop = ev_loop[: -(len(hrf) - 1)]
-                ev_loop = ev_loop[indexSample]
-                eventArray[:, index] = ev_loop
             image = load_image(i)
             data = image.get_data()
             orgImageShape = data.shape[:-1]
@@ -13,7 +13,8 @@ from .errors import (
     SubjectNotFoundError,
 )
 import json
-import warnings
+import sqlite3
+import tempfile
 import os
 
 from bids import BIDSLayout, BIDSLayoutIndexer
@@ -24,6 +25,10 @@ DESG = re.compile(r".*desg.*")
 HTML = re.compile(r".*html.*")
 SVG = re.compile(r".*svg.*")
 DEFAULT_IGNORE = [ANAT, FMAP, DESG, HTML, SVG]
+INDEX_MANIFEST_FILE_NAME = "clpipe_index_manifest.json"
+"""Records the state of each subject directory when the index was last updated."""
+INDEX_DATABASE_PATTERN = "*.sqlite"
+
 
 def get_bids(
     bids_dir: os.PathLike,
@@ -32,53 +37,66 @@ def get_bids(
     fmriprep_dir: os.PathLike = None,
     index_metadata=False,
     refresh=False,
+    update=False,
     ignore=DEFAULT_IGNORE,
     logger=None,
 ) -> BIDSLayout:
+    """Load a pybids layout, indexing the BIDS directory if needed.
+
+    Args:
+        refresh (bool, optional): Re-index everything from scratch.
+            Defaults to False.
+        update (bool, optional): Index only subjects which are new or changed since
+            the existing database was last indexed. Defaults to False.
+    """
     try:
         database_path = Path(database_path)
 
         # Use an existing pybids database,
         #   and user did not request an index refresh
         if database_path.exists() and not refresh:
+            if update:
+                updated = update_bids_index(
+                    bids_dir,
+                    database_path,
+                    validate=validate,
+                    fmriprep_dir=fmriprep_dir,
+                    index_metadata=index_metadata,
+                    ignore=ignore,
+                    logger=logger,
+                )
+                if not updated:
+                    return get_bids(
+                        bids_dir,
+                        validate=validate,
+                        database_path=database_path,
+                        fmriprep_dir=fmriprep_dir,
+                        index_metadata=index_metadata,
+                        refresh=True,
+                        ignore=ignore,
+                        logger=logger,
+                    )
             if logger:
                 logger.debug(f"Using existing BIDS index: {database_path}")
             return BIDSLayout(database_path=database_path)
         # Index from scratch (slow)
         else:
-            indexer = BIDSLayoutIndexer(
-                validate=validate, index_metadata=index_metadata, ignore=ignore
-            )
             if logger:
                 logger.info(f"Indexing BIDS directory: {bids_dir}")
                 logger.info("This can take a few minutes...")
 
-            if fmriprep_dir:
-                # When setting derivative dir in this version of pybids, don't use
-                #   the BIDSLayoutIndexer, pass through Layout instead - indexer
-                #   ignores derivatives due to bug.
-                # Ignore user warning about not using BIDSLayoutIndexer
-                with warnings.catch_warnings():
-                    warnings.filterwarnings("ignore", category=UserWarning)
-
-                    layout = BIDSLayout(
-                        bids_dir,
-                        database_path=database_path,
-                        derivatives=fmriprep_dir,
-                        reset_database=refresh,
-                        indexer=indexer,
-                        index_metadata=index_metadata,
-                        ignore=ignore,
-                    )
-            else:
-                layout = BIDSLayout(
-                    bids_dir,
-                    database_path=database_path,
-                    reset_database=refresh,
-                    indexer=indexer,
-                    index_metadata=index_metadata,
-                    ignore=ignore,
-                )
+            layout = _index_bids(
+                bids_dir,
+                database_path,
+                validate=validate,
+                fmriprep_dir=fmriprep_dir,
+                index_metadata=index_metadata,
+                refresh=refresh,
+                ignore=ignore,
+            )
+            _write_index_manifest(
+                database_path, _get_index_signatures(bids_dir, fmriprep_dir)
+            )
             return layout
 
     except FileNotFoundError as fne:
@@ -87,6 +105,209 @@ def get_bids(
         raise fne
 
 
+def update_bids_index(
+    bids_dir: os.PathLike,
+    database_path: os.PathLike,
+    validate=False,
+    fmriprep_dir: os.PathLike = None,
+    index_metadata=False,
+    ignore=DEFAULT_IGNORE,
+    logger=None,
+) -> bool:
+    """Index new or changed subjects into an existing pybids database.
+
+    Subjects are compared against the manifest written alongside the database
+    the last time it was indexed. A subject is considered changed when any
+    directory within it was modified, which covers added, removed and renamed
+    files. Only directory mtimes are compared, so files rewritten in place are
+    not detected - use refresh to re-index those. Changed subjects are indexed into a temporary database which is then
+    merged into the existing one, and removed subjects are dropped from it.
+
+    Returns:
+        bool: False if the database has no manifest to compare against, meaning
+            a full re-index is needed. True otherwise.
+    """
+    database_path = Path(database_path)
+    manifest = _read_index_manifest(database_path)
+    if manifest is None:
+        if logger:
+            logger.info("No index manifest found - the index must be rebuilt.")
+        return False
+
+    signatures = _get_index_signatures(bids_dir, fmriprep_dir)
+    changed_subjects = set()
+    removed_subjects = set()
+    for root, subject_signatures in signatures.items():
+        previous_signatures = manifest.get(root, {})
+        changed_subjects.update(
+            subject
+            for subject, signature in subject_signatures.items()
+            if previous_signatures.get(subject) != signature
+        )
+        removed_subjects.update(set(previous_signatures) - set(subject_signatures))
+    removed_subjects -= changed_subjects
+
+    if not changed_subjects and not removed_subjects:
+        if logger:
+            logger.info("BIDS index is up to date.")
+        return True
+
+    if logger:
+        logger.info(
+            f"Updating BIDS index with {len(changed_subjects)} new or changed "
+            f"subject(s), removing {len(removed_subjects)} subject(s)"
+        )
+
+    index_databases = sorted(database_path.rglob(INDEX_DATABASE_PATTERN))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if changed_subjects:
+            # Index only the changed subjects by ignoring every other subject
+            subject_filter = re.compile(
+                r"^/(?!(?:"
+                + "|".join(re.escape(subject) for subject in changed_subjects)
+                + r")(?:/|$))sub-[^/]*"
+            )
+            temp_database_path = Path(temp_dir) / "index"
+            _index_bids(
+                bids_dir,
+                temp_database_path,
+                validate=validate,
+                fmriprep_dir=fmriprep_dir,
+                index_metadata=index_metadata,
+                refresh=True,
+                ignore=list(ignore or []) + [subject_filter],
+            )
+        for index_database in index_databases:
+            incoming_database = None
+            if changed_subjects:
+                incoming_database = temp_database_path / index_database.relative_to(
+                    database_path
+                )
+            _merge_index_database(
+                index_database,
+                incoming_database,
+                changed_subjects | removed_subjects,
+            )
+
+    _write_index_manifest(database_path, signatures)
+    return True
+
+
+def _index_bids(
+    bids_dir: os.PathLike,
+    database_path: os.PathLike,
+    validate=False,
+    fmriprep_dir: os.PathLike = None,
+    index_metadata=False,
+    refresh=False,
+    ignore=DEFAULT_IGNORE,
+) -> BIDSLayout:
+    # The indexer carries the indexing options, and is also passed on to the
+    #   derivatives layout. Newer pybids versions reject indexing options passed
+    #   to BIDSLayout directly.
+    indexer = BIDSLayoutIndexer(
+        validate=validate, index_metadata=index_metadata, ignore=ignore
+    )
+
+    if fmriprep_dir:
+        layout = BIDSLayout(
+            bids_dir,
+            database_path=database_path,
+            derivatives=fmriprep_dir,
+            reset_database=refresh,
+            indexer=indexer,
+        )
+    else:
+        layout = BIDSLayout(
+            bids_dir,
+            database_path=database_path,
+            reset_database=refresh,
+            indexer=indexer,
+        )
+    return layout
+
+
+def _get_subject_signatures(root: os.PathLike) -> dict:
+    """Fingerprint each sub-* directory of root by its latest directory mtime.
+
+    Only directories are stat'd, which keeps this cheap on large datasets.
+    Adding, removing or renaming a file updates its directory's mtime, but
+    rewriting an existing file in place does not, so such edits are missed.
+    """
+    signatures = {}
+    for subject_dir in Path(root).glob("sub-*"):
+        if not subject_dir.is_dir():
+            continue
+        latest_mtime = max(
+            os.stat(dir_path).st_mtime for dir_path, _, _ in os.walk(subject_dir)
+        )
+        signatures[subject_dir.name] = latest_mtime
+    return signatures
+
+
+def _get_index_signatures(
+    bids_dir: os.PathLike, fmriprep_dir: os.PathLike = None
+) -> dict:
+    roots = [bids_dir] + ([fmriprep_dir] if fmriprep_dir else [])
+    return {str(Path(root).resolve()): _get_subject_signatures(root) for root in roots}
+
+
+def _read_index_manifest(database_path: os.PathLike):
+    manifest_path = Path(database_path) / INDEX_MANIFEST_FILE_NAME
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def _write_index_manifest(database_path: os.PathLike, signatures: dict):
+    manifest_path = Path(database_path) / INDEX_MANIFEST_FILE_NAME
+    if not manifest_path.parent.exists():
+        return
+    with open(manifest_path, "w") as manifest_file:
+        json.dump(signatures, manifest_file, indent=4)
+
+
+def _merge_index_database(
+    database: os.PathLike, incoming_database: os.PathLike, subjects: set
+):
+    """Replace the given subjects' records in a pybids database with those from
+    another database, or just remove them if no other database is given."""
+    connection = sqlite3.connect(str(database))
+    try:
+        roots = [row[0] for row in connection.execute("SELECT root FROM layout_info")]
+        for root in roots:
+            for subject in subjects:
+                subject_prefix = str(Path(root) / subject) + os.sep
+                prefix_args = (len(subject_prefix), subject_prefix)
+                connection.execute(
+                    "DELETE FROM associations WHERE substr(src, 1, ?) = ? "
+                    "OR substr(dst, 1, ?) = ?",
+                    prefix_args + prefix_args,
+                )
+                connection.execute(
+                    "DELETE FROM tags WHERE substr(file_path, 1, ?) = ?", prefix_args
+                )
+                connection.execute(
+                    "DELETE FROM files WHERE substr(path, 1, ?) = ?", prefix_args
+                )
+
+        if incoming_database is not None and Path(incoming_database).exists():
+            connection.execute(
+                "ATTACH DATABASE ? AS incoming", (str(incoming_database),)
+            )
+            for table in ("files", "tags", "associations"):
+                connection.execute(
+                    f"INSERT OR REPLACE INTO main.{table} SELECT * FROM incoming.{table}"
+                )
+            connection.execute(
+                "INSERT OR IGNORE INTO main.entities SELECT * FROM incoming.entities"
+            )
+        connection.commit()
+    finally:
+        connection.close()
+
+
 def get_subjects(bids_dir: BIDSLayout, subjects):
     # If no subjects were provided, use all subjects in the fmriprep directory
     if subjects is None or len(subjects) == 0:
@@ -150,8 +371,8 @@ def validate_subject_exists(bids, subject_id):
     if len(bids.get(subject=subject_id, scope="derivatives")) == 0:
         snfe = (
             f"Subject {subject_id} was not found in fmriprep output. "
-            "You may need to add the option '-refresh_index' if this "
-            "is a new subject."
+            "You may need to add the option '-update_index' or '-refresh_index' "
+            "if this is a new subject."
         )
         raise SubjectNotFoundError(snfe)
 
@@ -266,3 +487,70 @@ def get_confounds(bids, query_params, logger):
         return confounds
     except IndexError:
         logger.warn(f"Confound file for query {query_params} not found.")
+
+
+def get_events(bids, query_params, logger):
+    # Find the image's events file in the raw dataset
+    logger.info("Searching for events file")
+    try:
+        events = bids.get(
+            **query_params,
+            suffix="events",
+            extension=".tsv",
+            return_type="filename",
+            scope="raw",
+        )[0]
+        logger.info(f"Events file found: {events}")
+
+        return events
+    except IndexError:
+        logger.warn(f"Events file for query {query_params} not found.")
+
+
+def get_image_query_params(bids_image) -> dict:
+    """Get the entities of an image needed to query for its related files."""
+    image_entities = bids_image.get_entities()
+    return {
+        k: image_entities[k]
+        for k in image_entities.keys()
+        & {"session", "subject", "task", "run", "acquisition", "space"}
+    }
+
+
+def resolve_image_inputs(bids, bids_image, logger, aroma=False, events=False) -> dict:
+    """Resolve every input needed to postprocess an image with a single pass over
+    the layout, so the result can be saved and used without pybids.
+
+    Raises:
+        MixingFileNotFoundError: If aroma is set and the mixing file is missing.
+        NoiseFileNotFoundError: If aroma is set and the noise file is missing.
+
+    Returns:
+        dict: The image's path, query entities, mask, TR, confounds file, if aroma
+            is set, its AROMA mixing and noise files, and if events is set, its
+            events file.
+    """
+    query_params = get_image_query_params(bids_image)
+    # Create a specific dict for searching non-image files
+    non_image_query_params = query_params.copy()
+    non_image_query_params.pop("space", None)
+
+    mixing_file, noise_file = None, None
+    if aroma:
+        mixing_file = get_mixing_file(bids, non_image_query_params, logger)
+        noise_file = get_noise_file(bids, non_image_query_params, logger)
+
+    events_file = None
+    if events:
+        events_file = get_events(bids, non_image_query_params, logger)
+
+    return {
+        "image": bids_image.path,
+        "entities": query_params,
+        "mask": get_mask(bids, query_params, logger),
+        "tr": get_tr(bids, query_params, logger),
+        "confounds": get_confounds(bids, non_image_query_params, logger),
+        "mixing": mixing_file,
+        "noise": noise_file,
+        "events": events_file,
+    }
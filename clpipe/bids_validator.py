@@ -49,7 +49,8 @@ def bids_validate(
         batch_config=config.batch_config_path,
         output_directory=config.bids_validation.log_directory,
         debug=debug,
-        mem_use=DEFAULT_MEMORY_USAGE
+        mem_use=DEFAULT_MEMORY_USAGE,
+        max_workers=config.max_workers
     )
 
     singularity_string = SINGULARITY_CMD_TEMPLATE
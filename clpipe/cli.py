@@ -167,6 +167,7 @@ def _add_commands():
 
     roi_cli.add_command(get_available_atlases_cli, help_priority=1)
     roi_cli.add_command(fmri_roi_extraction_cli, help_priority=2)
+    roi_cli.add_command(consolidate_roi_timeseries_cli, help_priority=3)
 
     reports_cli.add_command(get_fmriprep_reports_cli)
 
@@ -495,6 +496,14 @@ def get_fmri_process_check_cli(config_file, output_file=None, debug=False):
     required=False,
     help=REFRESH_INDEX_HELP,
 )
+@click.option(
+    "-update_index",
+    "-u",
+    is_flag=True,
+    default=False,
+    required=False,
+    help=UPDATE_INDEX_HELP,
+)
 @click.option("-batch/-no-batch", is_flag=True, default=True, help=BATCH_HELP)
 @click.option("-cache/-no-cache", is_flag=True, default=True)
 @click.option("-submit", "-s", is_flag=True, default=False, help=SUBMIT_HELP)
@@ -510,6 +519,7 @@ def postprocess_cli(
     log_dir,
     index_dir,
     refresh_index,
+    update_index,
     debug,
     cache,
 ):
@@ -533,6 +543,7 @@ def postprocess_cli(
         log_dir=log_dir,
         pybids_db_path=index_dir,
         refresh_index=refresh_index,
+        update_index=update_index,
         debug=debug,
         cache=cache,
     )
@@ -544,6 +555,9 @@ def postprocess_cli(
 @click.argument("subject_out_dir", type=CLICK_DIR_TYPE)
 @click.argument("subject_working_dir", type=CLICK_DIR_TYPE)
 @click.argument("subject_log_dir", type=CLICK_DIR_TYPE)
+@click.option(
+    "-inputs_file", type=CLICK_FILE_TYPE, default=None, help=IMAGE_INPUTS_FILE_HELP
+)
 @click.option("-debug", is_flag=True, default=False, help=DEBUG_HELP)
 def postprocess_image_cli(
     run_config_file,
@@ -551,6 +565,7 @@ def postprocess_image_cli(
     subject_out_dir,
     subject_working_dir,
     subject_log_dir,
+    inputs_file,
     debug,
 ):
     """Used to distribute postprocessing jobs for individual images.
@@ -565,6 +580,7 @@ def postprocess_image_cli(
         subject_working_dir,
         subject_log_dir,
         debug=debug,
+        inputs_file=inputs_file,
     )
 
 
@@ -717,8 +733,21 @@ def glm_apply_mumford_workaround_cli(
 )
 @click.option("-test_one", is_flag=True, help=TEST_ONE_HELP)
 @click.option("-submit", "-s", is_flag=True, help=SUBMIT_HELP)
+@click.option("-array_job", is_flag=True, help=ARRAY_JOB_HELP)
+@click.option("-max_concurrent", type=int, default=None, help=MAX_CONCURRENT_HELP)
+@click.option("-rerun_completed", is_flag=True, help=RERUN_COMPLETED_HELP)
 @click.option("-debug", "-d", is_flag=True, help=DEBUG_HELP)
-def glm_launch_cli(level, model, glm_config_file, test_one, submit, debug):
+def glm_launch_cli(
+    level,
+    model,
+    glm_config_file,
+    test_one,
+    submit,
+    array_job,
+    max_concurrent,
+    rerun_completed,
+    debug,
+):
     """Launch all prepared .fsf files for L1 or L2 GLM analysis.
 
     LEVEL is the level of anlaysis, L1 or L2
@@ -733,6 +762,9 @@ def glm_launch_cli(level, model, glm_config_file, test_one, submit, debug):
         model=model,
         test_one=test_one,
         submit=submit,
+        array_job=array_job,
+        max_concurrent=max_concurrent,
+        rerun_completed=rerun_completed,
         debug=debug,
     )
 
@@ -748,8 +780,20 @@ def glm_launch_cli(level, model, glm_config_file, test_one, submit, debug):
 @click.option("-l1_name", required=True, help=L1_MODEL_HELP)
 @click.option("-test_one", is_flag=True, help=TEST_ONE_HELP)
 @click.option("-submit", "-s", is_flag=True, help=SUBMIT_HELP)
+@click.option("-array_job", is_flag=True, help=ARRAY_JOB_HELP)
+@click.option("-max_concurrent", type=int, default=None, help=MAX_CONCURRENT_HELP)
+@click.option("-rerun_completed", is_flag=True, help=RERUN_COMPLETED_HELP)
 @click.option("-debug", "-d", is_flag=True, help=DEBUG_HELP)
-def glm_l1_launch_cli(glm_config_file, l1_name, test_one, submit, debug):
+def glm_l1_launch_cli(
+    glm_config_file,
+    l1_name,
+    test_one,
+    submit,
+    array_job,
+    max_concurrent,
+    rerun_completed,
+    debug,
+):
     """Launch all prepared .fsf files for L1 GLM analysis."""
     from .glm_launch import glm_launch
 
@@ -759,6 +803,9 @@ def glm_l1_launch_cli(glm_config_file, l1_name, test_one, submit, debug):
         model=l1_name,
         test_one=test_one,
         submit=submit,
+        array_job=array_job,
+        max_concurrent=max_concurrent,
+        rerun_completed=rerun_completed,
         debug=debug,
     )
 
@@ -774,8 +821,20 @@ def glm_l1_launch_cli(glm_config_file, l1_name, test_one, submit, debug):
 @click.option("-l2_name", required=True, help=L2_MODEL_HELP)
 @click.option("-test_one", is_flag=True, help=TEST_ONE_HELP)
 @click.option("-submit", "-s", is_flag=True, help=SUBMIT_HELP)
+@click.option("-array_job", is_flag=True, help=ARRAY_JOB_HELP)
+@click.option("-max_concurrent", type=int, default=None, help=MAX_CONCURRENT_HELP)
+@click.option("-rerun_completed", is_flag=True, help=RERUN_COMPLETED_HELP)
 @click.option("-debug", "-d", is_flag=True, help=DEBUG_HELP)
-def glm_l2_launch_cli(glm_config_file, l2_name, test_one, submit, debug):
+def glm_l2_launch_cli(
+    glm_config_file,
+    l2_name,
+    test_one,
+    submit,
+    array_job,
+    max_concurrent,
+    rerun_completed,
+    debug,
+):
     """Launch all prepared .fsf files for L2 GLM analysis."""
     from .glm_launch import glm_launch
 
@@ -785,6 +844,9 @@ def glm_l2_launch_cli(glm_config_file, l2_name, test_one, submit, debug):
         model=l2_name,
         test_one=test_one,
         submit=submit,
+        array_job=array_job,
+        max_concurrent=max_concurrent,
+        rerun_completed=rerun_completed,
         debug=debug,
     )
 
@@ -876,6 +938,11 @@ def fsl_onset_extract_cli(config_file, glm_config_file, debug):
 @click.option(
     "-overwrite", is_flag=True, default=False, help="Overwrite existing ROI timeseries?"
 )
+@click.option(
+    "-multi_atlas/-no-multi_atlas",
+    default=None,
+    help="Extract all atlases in one job per subject, loading each image only once. Defaults to the MultiAtlas configuration setting.",
+)
 @click.option(
     "-log_output_dir",
     type=click.Path(dir_okay=True, file_okay=False),
@@ -918,6 +985,7 @@ def fmri_roi_extraction_cli(
     overlap_ok,
     debug,
     overwrite,
+    multi_atlas,
 ):
     """Extract ROIs with a given atlas."""
     from .roi_extractor import fmri_roi_extraction
@@ -940,6 +1008,53 @@ def fmri_roi_extraction_cli(
         overlap_ok=overlap_ok,
         debug=debug,
         overwrite=overwrite,
+        multi_atlas=multi_atlas,
+    )
+
+
+@click.command("consolidate", no_args_is_help=True)
+@click.option(
+    "-config_file",
+    "-c",
+    type=click.Path(exists=True, dir_okay=False, file_okay=True),
+    required=True,
+    help="Use a given configuration file.",
+)
+@click.option(
+    "-output_dir",
+    "-o",
+    type=click.Path(dir_okay=True, file_okay=False),
+    help="The ROI extraction output directory. If a configuration file is provided with a output directory, this argument is not necessary.",
+)
+@click.option(
+    "-atlas_name",
+    help="Which atlas to consolidate. If none, all atlases in the configuration file are consolidated.",
+)
+@click.option(
+    "-output_format",
+    type=click.Choice(["csv", "npz", "parquet"]),
+    default=None,
+    help="Format of the consolidated files. Defaults to the OutputFormat of ROI extraction.",
+)
+@click.option(
+    "-debug",
+    "-d",
+    is_flag=True,
+    help="Flag to enable detailed error messages and traceback",
+)
+def consolidate_roi_timeseries_cli(
+    config_file, output_dir, atlas_name, output_format, debug
+):
+    """Combine all runs' ROI timeseries into one dataset per atlas, partitioned
+    by subject."""
+    from .roi_extractor import consolidate_roi_timeseries
+
+    consolidate_roi_timeseries(
+        config_file=config_file,
+        output_dir=output_dir,
+        atlas_name=atlas_name,
+        output_format=output_format,
+        debug=debug,
     )
 
 
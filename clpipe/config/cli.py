@@ -94,6 +94,13 @@ INDEX_HELP = "Give the path to an existing pybids index database."
 REFRESH_INDEX_HELP = (
     "Refresh the pybids index database to reflect new fmriprep artifacts."
 )
+UPDATE_INDEX_HELP = (
+    "Update the pybids index database by re-indexing only new or changed subjects."
+)
+IMAGE_INPUTS_FILE_HELP = (
+    "A file of the image's inputs, resolved by the postprocess command. "
+    "If not given, inputs are looked up in the pybids index."
+)
 
 
 # GLM Help
@@ -113,6 +120,11 @@ L2_MODEL_HELP = "Name of your L2 model"
 LEVEL_HELP = "Level of your model, L1 or L2"
 MODEL_HELP = "Name of your model"
 TEST_ONE_HELP = "Only submit one job for testing purposes."
+ARRAY_JOB_HELP = "Submit all .fsf files as a single array job."
+MAX_CONCURRENT_HELP = (
+    "Maximum number of FEAT jobs to run at once. Applies to array jobs and local runs."
+)
+RERUN_COMPLETED_HELP = "Also launch .fsf files whose FEAT output is already complete."
 
 # Other Help
 STATUS_COMMAND_NAME = "status"
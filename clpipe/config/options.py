@@ -252,6 +252,46 @@ class BatchManagerConfig(Option):
     )
     """Paths made available to the singularity container."""
 
+    array_job_active: bool = field(default=False, metadata={"required": False})
+    """A boolean indicating whether queued jobs are submitted together as a single
+    array job, rather than as one submission per job."""
+
+    array_command: str = field(
+        default="--array={first_index}-{last_index}", metadata={"required": False}
+    )
+    """The command used to request an array job's range of task indexes."""
+
+    array_throttle: int = field(default=0, metadata={"required": False})
+    """The maximum number of array tasks allowed to run at once. Set to 0 for
+    no limit."""
+
+    array_throttle_command: str = field(
+        default="%{throttle}", metadata={"required": False}
+    )
+    """Appended to the array command to limit concurrently running tasks."""
+
+    array_index_variable: str = field(
+        default="SLURM_ARRAY_TASK_ID", metadata={"required": False}
+    )
+    """The environment variable holding the index of a running array task."""
+
+    array_first_index: int = field(default=0, metadata={"required": False})
+    """The index of the first array task."""
+
+    dependency_command: str = field(
+        default="--dependency=afterany:{job_ids}", metadata={"required": False}
+    )
+    """The command used to hold a job until its parent jobs have finished."""
+
+    dependency_separator: str = field(default=":", metadata={"required": False})
+    """The separator between parent job IDs in the dependency command."""
+
+    job_id_regex: str = field(
+        default=r"Submitted batch job (\d+)", metadata={"required": False}
+    )
+    """Pattern matching a job's scheduler ID in the submission command's output.
+    The ID is captured by the first group."""
+
     @classmethod
     def from_default(cls, config_type="unc"):
         defaults = {
@@ -276,7 +316,7 @@ class BatchManagerConfig(Option):
                 "submission_head": "qsub",
                 "submission_options": [],
                 "n_threads_command": "",
-                "n_threads": "",
+                "n_threads_default": "",
                 "memory_command": "-l h_vmem={mem}G,vf={mem}G",
                 "memory_default": "8",
                 "time_command": "",
@@ -285,6 +325,13 @@ class BatchManagerConfig(Option):
                 "output_command": "-o {output}",
                 "command_wrapper": '-b y "{cmdwrap}"',
                 "email_command": "-M {email}",
+                "array_command": "-t {first_index}-{last_index}",
+                "array_throttle_command": " -tc {throttle}",
+                "array_index_variable": "SGE_TASK_ID",
+                "array_first_index": 1,
+                "dependency_command": "-hold_jid {job_ids}",
+                "dependency_separator": ",",
+                "job_id_regex": r"Your job(?:-array)? (\d+)",
                 "fmri_prep_batch_commands": "-e",
                 "time_command_active": False,
                 "thread_command_active": False,
@@ -468,6 +515,12 @@ class TemporalFiltering(Option):
     filtering_order: int = field(default=2, metadata={"required": True})
     """Order of the filter. Defaults to 2."""
 
+    restrict_to_mask: bool = field(default=False, metadata={"required": False})
+    """Only filter voxels inside the image's brain mask. Requires a mask.
+    Butterworth passes voxels outside the mask through unchanged, while
+    afni_3dTproject replaces them with their mean over time. Not supported by
+    fslmaths."""
+
 
 @dataclass
 class IntensityNormalization(Option):
@@ -476,7 +529,7 @@ class IntensityNormalization(Option):
     implementation: str = field(
         default="10000_GlobalMedian", metadata={"required": True}
     )
-    """Currently limited to '10000_GlobalMedian'"""
+    """Available implementations: 10000_GlobalMedian, 100_voxelmean"""
 
 
 @dataclass
@@ -498,6 +551,7 @@ class AROMARegression(Option):
     using AROMA. Also applied to confounds."""
 
     implementation: str = field(default="fsl_regfilt", metadata={"required": True})
+    """Available implementations: fsl_regfilt, fsl_regfilt_R, native_regfilt"""
 
 
 @dataclass
@@ -531,6 +585,23 @@ class ScrubTimepoints(Option):
     insert_na: bool = field(default=True, metadata={"required": True})
     """Set true to replace scrubbed timepoints with NA. False removes the timepoints completely."""
 
+    interpolation: str = field(default="none", metadata={"required": False})
+    """Set to "spectral" to replace scrubbed timepoints with a spectral
+    interpolation of the remaining timepoints, rather than inserting NA or
+    removing them. Requires the image's TR. Available: none, spectral"""
+
+    oversampling_freq: int = field(default=8, metadata={"required": False})
+    """Oversampling frequency of the spectral interpolation."""
+
+    percent_freq_sample: float = field(default=1, metadata={"required": False})
+    """Highest frequency sampled by the spectral interpolation, as a fraction of
+    the Nyquist frequency."""
+
+    spectral_interpolation_bin_size: int = field(
+        default=5000, metadata={"required": False}
+    )
+    """Number of voxels interpolated at once. Lower this to reduce memory usage."""
+
     scrub_columns: List[ScrubColumn] = field(
         default_factory=lambda: [
             ScrubColumn(
@@ -590,7 +661,24 @@ class ConfoundRegression(Option):
     they will be applied first."""
 
     implementation: str = field(default="afni_3dTproject", metadata={"required": True})
-    """Currently limited to "afni_3dTproject"""
+    """Available implementations: afni_3dTproject, native_qr. Outside the mask,
+    afni_3dTproject keeps each voxel's mean over time and native_qr writes 0."""
+
+
+@dataclass
+class BetaSeries(Option):
+    """Estimate a least squares - separate (LSS) beta series from the image,
+    using its BIDS events file. The output has one volume per trial instead of a
+    timeseries, so this must be the last processing step. The image's postprocessed
+    confounds are included in every trial's model."""
+
+    implementation: str = field(default="native_lss", metadata={"required": False})
+    """Available implementations: native_lss"""
+
+    exclude_trial_types: List[str] = field(
+        default_factory=list, metadata={"required": False}
+    )
+    """Trial types to leave out of the beta series."""
 
 
 @dataclass
@@ -621,6 +709,9 @@ class ProcessingStepOptions(Option):
     trim_timepoints: TrimTimepoints = field(
         default_factory=TrimTimepoints, metadata={"required": True}
     )
+    beta_series: BetaSeries = field(
+        default_factory=BetaSeries, metadata={"required": False}
+    )
 
 
 @dataclass
@@ -753,6 +844,11 @@ class PostProcessingOptions(Option):
     )
     """Options for cluster resource usage."""
 
+    engine: str = field(default="nipype", metadata={"required": False})
+    """Which engine runs the processing steps. 'nipype' runs each step as a
+    workflow node. 'fused' loads each image once and runs every step in memory,
+    falling back to 'nipype' if any step lacks a fused implementation."""
+
     log_directory: str = field(default="", metadata={"required": True})
     """Log output location. Not normally changed from default."""
 
@@ -795,6 +891,8 @@ class PostProcessingRunConfig(ClpipeData):
 
     batch_config_file: str = ""
 
+    max_workers: int = 0
+
     email_address: str = ""
 
     stream_working_directory: str = ""
@@ -880,6 +978,19 @@ class ROIExtractOptions(Option):
     overlap_ok: bool = field(default=False, metadata={"required": True})
     """Are overlapping ROIs allowed?"""
 
+    multi_atlas: bool = field(default=False, metadata={"required": False})
+    """Extract all atlases in one job per subject, loading each image only once,
+    instead of submitting a job per subject and atlas."""
+
+    atlas_cache: bool = field(default=True, metadata={"required": False})
+    """Cache label atlases resampled to each image grid in the output directory,
+    so they are only resampled once per space and resolution."""
+
+    output_format: str = field(default="csv", metadata={"required": False})
+    """Format of the ROI timeseries files: csv, npz or parquet. The npz and parquet
+    formats also store ROI labels and the image's BIDS entities. Parquet requires
+    pyarrow, installed with the clpipe[parquet] extra."""
+
     memory_usage: str = field(default="20G", metadata={"required": True})
     time_usage: str = field(default="2:0:0", metadata={"required": True})
     n_threads: str = field(default="1", metadata={"required": True})
@@ -976,6 +1087,10 @@ class ProjectOptions(Option):
     batch_config_path: str = field(
         default="slurmUNCConfig.json", metadata={"required": True}
     )
+    max_workers: int = field(default=0, metadata={"required": False})
+    """Maximum number of jobs to run at once when running without a batch config.
+    Set to 0 to fit as many jobs as each job's thread request allows on this
+    machine's CPUs."""
     clpipe_version: str = field(default=VERSION, metadata={"required": True})
 
     def get_logs_dir(self) -> str:
@@ -1140,6 +1255,7 @@ KEY_MAP = {
     "filtering_high_pass": "FilteringHighPass",
     "filtering_low_pass": "FilteringLowPass",
     "filtering_order": "FilteringOrder",
+    "restrict_to_mask": "RestrictToMask",
     "intensity_normalization": "IntensityNormalization",
     "spatial_smoothing": "SpatialSmoothing",
     "fwhm": "FWHM",
@@ -1150,6 +1266,7 @@ KEY_MAP = {
     "from_end": "FromEnd",
     "from_beginning": "FromBeginning",
     "confound_regression": "ConfoundRegression",
+    "beta_series": "BetaSeries",
     "confound_options": "ConfoundOptions",
     "columns": "Columns",
     "motion_outliers": "MotionOutliers",
@@ -1160,6 +1277,7 @@ KEY_MAP = {
     "scrub_behind": "ScrubBehind",
     "scrub_contiguous": "ScrubContiguous",
     "batch_options": "BatchOptions",
+    "engine": "Engine",
     "memory_usage": "MemoryUsage",
     "target_suffix": "TargetSuffix",
     "output_suffix": "OutputSuffix",
@@ -1179,6 +1297,9 @@ KEY_MAP = {
     "require_mask": "RequireMask",
     "prop_voxels": "PropVoxels",
     "overlap_ok": "OverlapOk",
+    "multi_atlas": "MultiAtlas",
+    "atlas_cache": "AtlasCache",
+    "output_format": "OutputFormat",
     "reho_extraction": "ReHoExtraction",
     "exclusion_file": "ExclusionFile",
     "mask_directory": "MaskDirectory",
@@ -1187,8 +1308,13 @@ KEY_MAP = {
     "neighborhood": "Neighborhood",
     "t2_star_extraction": "T2StarExtraction",
     "batch_config_path": "BatchConfig",
+    "max_workers": "MaxWorkers",
     "target_variable": "TargetVariable",
     "insert_na": "InsertNA",
+    "interpolation": "Interpolation",
+    "oversampling_freq": "OversamplingFreq",
+    "percent_freq_sample": "PercentFreqSample",
+    "spectral_interpolation_bin_size": "SpectralInterpolationBinSize",
     "scrub_columns": "scrub_columns",
     "stream_name": "ProcessingStream",
     "processing_stream_options": "ProcessingStreamOptions",
@@ -40,6 +40,11 @@ INSTALL_REQUIRES = [
       "PyYAML==6.0"
 ],
 
+# Optional dependency groups, installed with e.g. pip install clpipe[parquet]
+EXTRAS_REQUIRE = {
+      "parquet": ["pyarrow>=8.0.0,<16"]
+}
+
 PACKAGE_DATA = {"clpipe": ["R_scripts/*.R"]}
 
 # These entries register bash aliases to click commands. The aliases are available for
@@ -66,6 +66,7 @@ def convert2bids(
         mem_use=config.convert2bids.mem_usage,
         time=config.convert2bids.time_usage,
         threads=config.convert2bids.core_usage,
+        max_workers=config.max_workers,
     )
 
     logger.info(
@@ -427,7 +428,10 @@ def dicom_to_nifti_to_bids_converter_setup(
         )
 
     batch_manager = JobManagerFactory.get(
-        batch_config=config.batch_config_path, time="1:0:0", mem_use="3000"
+        batch_config=config.batch_config_path,
+        time="1:0:0",
+        mem_use="3000",
+        max_workers=config.max_workers,
     )
 
     if session:
@@ -49,3 +49,7 @@ class FSFFileNotFoundError(FileNotFoundError):
 
 class ModelNotFoundError(ValueError):
     pass
+
+
+class FSFTemplateError(ValueError):
+    pass
@@ -153,7 +153,8 @@ def fmriprep_process(
         mem_use=config.fmriprep.fmriprep_memory_usage,
         time=config.fmriprep.fmriprep_time_usage,
         threads=config.fmriprep.n_threads,
-        email=config.email_address
+        email=config.email_address,
+        max_workers=config.max_workers
     )
 
     thread_command_active = batch_manager.config.thread_command_active
@@ -3,7 +3,8 @@ import sys
 from pathlib import Path
 
 from .config.glm import *
-from .job_manager import JobManagerFactory, DEFAULT_BATCH_CONFIG_PATH
+from .job_manager import JobManagerFactory, BatchJobManager, DEFAULT_BATCH_CONFIG_PATH
+from .glm_prepare import FSFTemplate, FSF_OUTPUT_DIR
 from .utils import get_logger
 
 DEFAULT_L1_MEMORY_USAGE = "10G"
@@ -21,6 +22,10 @@ STEP_NAME = "glm-launch"
 SUBMISSION_STRING_TEMPLATE = "unset PYTHONPATH; feat {fsf_file}"
 DEPRECATION_MSG = "Using deprecated GLM setup file."
 
+# FEAT appends these to an output directory lacking them
+L1_FEAT_SUFFIX = ".feat"
+L2_FEAT_SUFFIX = ".gfeat"
+
 
 def glm_launch(
     glm_config_file: str = None,
@@ -28,6 +33,9 @@ def glm_launch(
     model: str = None,
     test_one: bool = False,
     submit: bool = False,
+    array_job: bool = False,
+    max_concurrent: int = None,
+    rerun_completed: bool = False,
     debug: bool = False,
 ):
     glm_config = GLMOptions(glm_config_file)
@@ -94,15 +102,31 @@ def glm_launch(
         mem_use=memory_usage,
         time=time_usage,
         threads=n_threads,
-        email=email
+        email=email,
+        max_workers=max_concurrent or glm_config.parent_options.max_workers
     )
 
-    submission_strings = _create_submission_strings(fsf_dir, test_one=test_one)
+    fsf_files = _find_fsf_files(fsf_dir, level, logger, rerun_completed=rerun_completed)
+    submission_strings = _create_submission_strings(fsf_files, test_one=test_one)
 
     num_jobs = len(submission_strings)
 
     for key in submission_strings.keys():
-        batch_manager.addjob(key, submission_strings[key])
+        batch_manager.add_job(key, submission_strings[key])
+
+    if isinstance(batch_manager, BatchJobManager):
+        if array_job:
+            batch_manager.config.array_job_active = True
+            logger.info(
+                f"Jobs will be submitted as one array job of {num_jobs} task(s)"
+            )
+        if max_concurrent:
+            batch_manager.config.array_throttle = int(max_concurrent)
+            if not batch_manager.config.array_job_active:
+                logger.warning(
+                    "A concurrency limit only applies to array jobs - "
+                    "use the array job option to enable it."
+                )
 
     if submit:
         logger.info(f"Running {num_jobs} job(s) in batch mode")
@@ -111,10 +135,50 @@ def glm_launch(
         batch_manager.print_jobs()
     sys.exit(0)
 
-def _create_submission_strings(fsf_files: os.PathLike, test_one: bool = False):
+
+def _find_fsf_files(fsf_dir: os.PathLike, level, logger, rerun_completed=False):
+    """List the .fsf files to launch, in name order.
+
+    Unless rerun_completed is set, fsfs whose FEAT output directory already holds
+    completed results are skipped.
+    """
+    fsf_files = sorted(Path(fsf_dir).glob("*.fsf"))
+    if rerun_completed:
+        return fsf_files
+
+    feat_suffix = L1_FEAT_SUFFIX if level == L1 else L2_FEAT_SUFFIX
+    pending = []
+    for fsf in fsf_files:
+        out_dir = FSFTemplate.from_file(fsf).get(FSF_OUTPUT_DIR)
+        if out_dir and not out_dir.endswith(feat_suffix):
+            out_dir += feat_suffix
+        if out_dir and _is_feat_complete(Path(out_dir)):
+            logger.debug(f"Skipping completed FEAT output: {out_dir}")
+            continue
+        pending.append(fsf)
+
+    skipped_count = len(fsf_files) - len(pending)
+    if skipped_count:
+        logger.info(
+            f"Skipping {skipped_count} .fsf file(s) with completed FEAT output."
+        )
+    return pending
+
+
+def _is_feat_complete(feat_dir: Path):
+    """Check whether a FEAT output directory holds a report and statistics maps,
+    either its own (L1) or those of its cope folders (L2)."""
+    if not (feat_dir / "report.html").exists():
+        return False
+    return any(feat_dir.glob("stats/zstat*")) or any(
+        feat_dir.glob("cope*.feat/stats/zstat*")
+    )
+
+
+def _create_submission_strings(fsf_files: list, test_one: bool = False):
     submission_strings = {}
 
-    for fsf in Path(fsf_files).iterdir():
+    for fsf in fsf_files:
         key = f"{str(fsf.stem)}"
 
         submission_string = SUBMISSION_STRING_TEMPLATE.format(fsf_file=fsf)
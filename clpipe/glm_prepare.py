@@ -9,12 +9,13 @@ Step 4: Launch a feat job for each fsf
 """
 
 import os
-import glob
+import re
 import sys
 import nibabel as nib
 import pandas as pd
 import shutil
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 from .config.glm import *
 from .utils import get_logger
@@ -25,6 +26,100 @@ APPLY_MUMFORD_STEP_NAME = "apply_mumford"
 DEPRECATION_MSG = "WARNING: Using deprecated GLM setup file."
 L2_SUBLIST_CSV_FILE_NAME = "l2_sublist.csv"
 L2_SUBLIST_CSV_PATH = f"data/{L2_SUBLIST_CSV_FILE_NAME}"
+MUMFORD_MARKER_FILE_NAME = ".clpipe_mumford_applied"
+
+
+FSF_OUTPUT_DIR = "fmri(outputdir)"
+FSF_NPTS = "fmri(npts)"
+FSF_REG_STANDARD = "fmri(regstandard)"
+FSF_CONFOUND_FILE = "confoundev_files(1)"
+
+
+def feat_files_key(number: int) -> str:
+    """The fsf setting holding the number-th input image or FEAT folder."""
+    return f"feat_files({number})"
+
+
+def custom_ev_key(number: int) -> str:
+    """The fsf setting holding the number-th custom EV file."""
+    return f"fmri(custom{number})"
+
+
+class FSFTemplate:
+    """A prototype fsf file, parsed once into a map of each setting to its line.
+
+    Rendering copies the prototype lines and swaps in a new line for each setting
+    given, so per-run fsfs can be produced without rescanning the prototype. The
+    template is never modified and is safe to render from several threads.
+    """
+
+    SETTING_PATTERN = re.compile(r"^set\s+(\S+)\s")
+
+    def __init__(self, lines, required_settings=()):
+        """
+        Args:
+            lines (Iterable[str]): The lines of the prototype fsf file.
+            required_settings (Iterable[str], optional): Settings which must be
+                present in the prototype, such as "fmri(outputdir)" or
+                "feat_files(2)". Defaults to none.
+
+        Raises:
+            FSFTemplateError: If a required setting is missing from the prototype.
+        """
+        self.lines = tuple(lines)
+        self.setting_index = {}
+        for i, line in enumerate(self.lines):
+            match = self.SETTING_PATTERN.match(line)
+            if match:
+                self.setting_index.setdefault(match.group(1), i)
+
+        missing = [key for key in required_settings if key not in self.setting_index]
+        if missing:
+            raise FSFTemplateError(
+                f"Prototype fsf file is missing required settings: {missing}"
+            )
+
+    @classmethod
+    def from_file(cls, fsf_file: os.PathLike, required_settings=()):
+        """Parse a prototype fsf file from disk."""
+        with open(fsf_file) as f:
+            return cls(f.readlines(), required_settings)
+
+    def render(self, settings: dict) -> list:
+        """Produce the lines of an fsf file with the given settings replaced.
+
+        String values are written quoted, as fsf paths are, and other values are
+        written as-is.
+
+        Raises:
+            FSFTemplateError: If a setting is not present in the prototype.
+        """
+        new_fsf = list(self.lines)
+        for key, value in settings.items():
+            try:
+                i = self.setting_index[key]
+            except KeyError:
+                raise FSFTemplateError(f"Setting not found in prototype: {key}")
+            if isinstance(value, str):
+                value = f'"{value}"'
+            new_fsf[i] = f"set {key} {value}\n"
+        return new_fsf
+
+    def get(self, key: str) -> str:
+        """Read a setting's value from the prototype, with any quotes removed.
+
+        Returns:
+            str: The setting's value, or None if the setting is not present.
+        """
+        if key not in self.setting_index:
+            return None
+        line = self.lines[self.setting_index[key]]
+        return line.split(None, 2)[2].strip().strip('"')
+
+    def write(self, out_fsf: os.PathLike, settings: dict):
+        """Render the given settings and save them as an fsf file."""
+        with open(out_fsf, "w") as fsf_file:
+            fsf_file.writelines(self.render(settings))
 
 
 def glm_prepare(
@@ -77,37 +172,32 @@ def glm_prepare(
             )
             sys.exit(1)
 
-        _glm_l1_propagate(model_options, task_name, reference_image, logger)
-        sys.exit(0)
+        try:
+            _glm_l1_propagate(model_options, task_name, reference_image, logger)
+            sys.exit(0)
+        except FSFTemplateError as fte:
+            logger.error(fte)
+            sys.exit(1)
     elif level == L2:
         try:
             _glm_l2_propagate(model_options, reference_image, logger)
             sys.exit(0)
-        except ModelNotFoundError as mnfe:
-            logger.error(mnfe)
+        except (ModelNotFoundError, FSFTemplateError) as err:
+            logger.error(err)
             sys.exit(1)
 
 
-def _glm_l1_propagate(l1_block, task_name, reference_image, logger):
-    with open(l1_block["FSFPrototype"]) as f:
-        fsf_file_template = f.readlines()
-
-    output_ind = [
-        i for i, e in enumerate(fsf_file_template) if "set fmri(outputdir)" in e
-    ]
-    image_files_ind = [
-        i for i, e in enumerate(fsf_file_template) if "set feat_files" in e
-    ]
-    ev_file_inds = [
-        i for i, e in enumerate(fsf_file_template) if "set fmri(custom" in e
-    ]
-    confound_file_ind = [
-        i for i, e in enumerate(fsf_file_template) if "set confoundev_files(1)" in e
+def _glm_l1_propagate(l1_block, task_name, reference_image, logger, max_workers=None):
+    required_settings = [FSF_OUTPUT_DIR, FSF_NPTS, feat_files_key(1)]
+    required_settings += [
+        custom_ev_key(i + 1) for i in range(len(l1_block["EVFileSuffices"]))
     ]
-    regstandard_ind = [
-        i for i, e in enumerate(fsf_file_template) if "set fmri(regstandard)" in e
-    ]
-    tps_inds = [i for i, e in enumerate(fsf_file_template) if "set fmri(npts)" in e]
+    if l1_block["ConfoundSuffix"] is not "":
+        required_settings.append(FSF_CONFOUND_FILE)
+    if reference_image is not "":
+        required_settings.append(FSF_REG_STANDARD)
+    fsf_template = FSFTemplate.from_file(l1_block["FSFPrototype"], required_settings)
+
     if (
         l1_block["ImageIncludeList"] is not ""
         and l1_block["ImageExcludeList"] is not ""
@@ -116,9 +206,8 @@ def _glm_l1_propagate(l1_block, task_name, reference_image, logger):
             "Only one of ImageIncludeList and ImageExcludeList should be non-empty"
         )
 
-    image_files = glob.glob(
-        os.path.join(l1_block["TargetDirectory"], "**", "*" + l1_block["TargetSuffix"]),
-        recursive=True,
+    image_files = _find_target_images(
+        l1_block["TargetDirectory"], l1_block["TargetSuffix"]
     )
 
     if l1_block["ImageIncludeList"] is not "":
@@ -153,74 +242,120 @@ def _glm_l1_propagate(l1_block, task_name, reference_image, logger):
         )
     else:
         logger.info("Propogating fsf files...")
-        for file in image_files:
-            try:
-                file_name = os.path.basename(file)
-
-                logger.info("Creating FSF File for image: " + file_name)
-                img_data = nib.load(file)
-                total_tps = img_data.shape[3]
-                ev_conf = _get_ev_confound_mat(file, l1_block, logger)
-                out_dir = os.path.join(
-                    l1_block["OutputDir"],
-                    file_name.replace("_" + l1_block["TargetSuffix"], ".feat"),
-                )
-                out_fsf = os.path.join(
-                    l1_block["FSFDir"],
-                    file_name.replace("_" + l1_block["TargetSuffix"], ".fsf"),
-                )
-                new_fsf = fsf_file_template
 
-                new_fsf[tps_inds[0]] = "set fmri(npts) " + str(total_tps) + "\n"
-                new_fsf[output_ind[0]] = (
-                    'set fmri(outputdir) "' + os.path.abspath(out_dir) + '"\n'
-                )
-                new_fsf[image_files_ind[0]] = (
-                    'set feat_files(1) "' + os.path.abspath(file) + '"\n'
-                )
-
-                if reference_image is not "":
-                    new_fsf[regstandard_ind[0]] = (
-                        'set fmri(regstandard) "'
-                        + os.path.abspath(reference_image)
-                        + '"\n'
-                    )
-                if l1_block["ConfoundSuffix"] is not "":
-                    new_fsf[confound_file_ind[0]] = (
-                        'set confoundev_files(1) "'
-                        + os.path.abspath(ev_conf["Confounds"])
-                        + '"\n'
-                    )
-
-                for i, e in enumerate(ev_conf["EVs"]):
-                    new_fsf[ev_file_inds[i]] = (
-                        "set fmri(custom"
-                        + str(i + 1)
-                        + ') "'
-                        + os.path.abspath(e)
-                        + '"\n'
-                    )
-
-                with open(out_fsf, "w") as fsf_file:
-                    fsf_file.writelines(new_fsf)
+        # Walk the EV and confound directories once up front rather than
+        #   searching them again for every image
+        ev_index = _build_file_index(l1_block["EVDirectory"])
+        confound_index = {}
+        if l1_block["ConfoundSuffix"] is not "":
+            confound_index = _build_file_index(l1_block["ConfoundDirectory"])
 
+        def prepare_image(file):
+            try:
+                logger.info("Creating FSF File for image: " + os.path.basename(file))
+                ev_conf = _get_ev_confound_mat(
+                    file,
+                    l1_block,
+                    logger,
+                    ev_index=ev_index,
+                    confound_index=confound_index,
+                )
+                ev_conf["Image"] = file
+                ev_conf["Timepoints"] = _read_timepoint_count(file)
+                _write_l1_fsf(fsf_template, ev_conf, l1_block, reference_image)
             except (EVFileNotFoundError, ConfoundsNotFoundError) as nfe:
                 logger.warn(nfe)
 
+        # Header reads and fsf writes are I/O bound, so images are handled by
+        #   a pool of threads
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(prepare_image, image_files))
+
         logger.info("Propogation completed.")
 
 
-def _get_ev_confound_mat(file, l1_block, logger):
+def _find_target_images(target_dir, target_suffix):
+    """Collect every image in the target directory ending in the target suffix."""
+    target_index = _build_file_index(target_dir)
+    return sorted(
+        path
+        for file_name, paths in target_index.items()
+        if file_name.endswith(target_suffix)
+        for path in paths
+    )
+
+
+def _read_timepoint_count(image_file):
+    """Read an image's timepoint count from its header, leaving the data unread."""
+    return nib.load(image_file).header.get_data_shape()[3]
+
+
+def _write_l1_fsf(fsf_template, ev_conf, l1_block, reference_image):
+    """Render and save the fsf file of one image from the prototype."""
+    file = ev_conf["Image"]
+    file_name = os.path.basename(file)
+    out_dir = os.path.join(
+        l1_block["OutputDir"],
+        file_name.replace("_" + l1_block["TargetSuffix"], ".feat"),
+    )
+    out_fsf = os.path.join(
+        l1_block["FSFDir"],
+        file_name.replace("_" + l1_block["TargetSuffix"], ".fsf"),
+    )
+
+    settings = {
+        FSF_NPTS: ev_conf["Timepoints"],
+        FSF_OUTPUT_DIR: os.path.abspath(out_dir),
+        feat_files_key(1): os.path.abspath(file),
+    }
+    if reference_image is not "":
+        settings[FSF_REG_STANDARD] = os.path.abspath(reference_image)
+    if l1_block["ConfoundSuffix"] is not "":
+        settings[FSF_CONFOUND_FILE] = os.path.abspath(ev_conf["Confounds"])
+    for i, e in enumerate(ev_conf["EVs"]):
+        settings[custom_ev_key(i + 1)] = os.path.abspath(e)
+
+    fsf_template.write(out_fsf, settings)
+
+    return out_fsf
+
+
+def _build_file_index(directory):
+    """Walk a directory tree once with os.scandir, mapping each file name to every
+    path it is found at. Hidden files and directories are skipped, as with glob."""
+    index = {}
+    pending = [directory]
+    while pending:
+        try:
+            with os.scandir(pending.pop()) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir():
+                        pending.append(entry.path)
+                    else:
+                        index.setdefault(entry.name, []).append(entry.path)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+    return index
+
+
+def _get_ev_confound_mat(
+    file, l1_block, logger, ev_index: dict = None, confound_index: dict = None
+):
     file_name = os.path.basename(file)
 
     file_prefix = os.path.basename(file).replace(l1_block["TargetSuffix"], "")
 
+    if ev_index is None:
+        ev_index = _build_file_index(l1_block["EVDirectory"])
+
     EV_files = []
     for EV in l1_block["EVFileSuffices"]:
         try:
             search_path = os.path.join(l1_block["EVDirectory"], "**", file_prefix + EV)
             logger.debug(f"EV search path: {search_path}")
-            search_results = glob.glob((search_path), recursive=True)
+            search_results = ev_index.get(file_prefix + EV, [])
             if len(search_results) < 1:
                 raise EVFileNotFoundError(f"EV file not found: {EV}")
             elif len(search_results) > 1:
@@ -241,13 +376,18 @@ def _get_ev_confound_mat(file, l1_block, logger):
         )
 
     if l1_block["ConfoundSuffix"] is not "":
+        if confound_index is None:
+            confound_index = _build_file_index(l1_block["ConfoundDirectory"])
+
         search_path = os.path.join(
             l1_block["ConfoundDirectory"],
             "**",
             file_prefix + l1_block["ConfoundSuffix"],
         )
         logger.debug(f"Confound search path: {search_path}")
-        search_results = glob.glob((search_path), recursive=True)
+        search_results = confound_index.get(
+            file_prefix + l1_block["ConfoundSuffix"], []
+        )
         if len(search_results) < 1:
             raise ConfoundsNotFoundError(
                 f"Did not find a confound file for image: {file_name}"
@@ -261,7 +401,7 @@ def _get_ev_confound_mat(file, l1_block, logger):
     return {"EVs": EV_files}
 
 
-def _glm_l2_propagate(l2_block, reference_image, logger):
+def _glm_l2_propagate(l2_block, reference_image, logger, max_workers=None):
     subject_file = l2_block["SubjectFile"]
     prototype_file = l2_block["FSFPrototype"]
 
@@ -278,71 +418,68 @@ def _glm_l2_propagate(l2_block, reference_image, logger):
         )
 
     logger.info(f"Opening prototype file: {prototype_file}")
-    with open(prototype_file) as f:
-        fsf_file_template = f.readlines()
-
-    output_ind = [
-        i for i, e in enumerate(fsf_file_template) if "set fmri(outputdir)" in e
-    ]
-    image_files_ind = [
-        i for i, e in enumerate(fsf_file_template) if "set feat_files" in e
-    ]
-    regstandard_ind = [
-        i for i, e in enumerate(fsf_file_template) if "set fmri(regstandard)" in e
-    ]
+    max_feat_folders = sub_tab.groupby("fsf_name").size().max()
+    required_settings = [FSF_OUTPUT_DIR]
+    required_settings += [feat_files_key(i + 1) for i in range(max_feat_folders)]
+    if reference_image is not "":
+        required_settings.append(FSF_REG_STANDARD)
+    fsf_template = FSFTemplate.from_file(prototype_file, required_settings)
 
     if not os.path.exists(l2_block["FSFDir"]):
         os.mkdir(l2_block["FSFDir"])
 
-    error_count = 0
-
-    logger.info("Propogating fsf files...")
-    for fsf in fsf_names:
-        try:
-            new_fsf = fsf_file_template
-            target_dirs = sub_tab.loc[sub_tab["fsf_name"] == fsf].feat_folders
-            counter = 1
-            logger.info("Creating L2 fsf file: " + fsf)
-            for feat in target_dirs:
-                if not os.path.exists(feat):
-                    error_count += 1
-                    raise FileNotFoundError(
-                        "ERROR: Could not find L1 FEAT directory:  " + feat
-                    )
-                else:
-                    _apply_mumford_workaround(feat, logger, remove_reg_standard=True)
-                    new_fsf[image_files_ind[counter - 1]] = (
-                        "set feat_files("
-                        + str(counter)
-                        + ') "'
-                        + os.path.abspath(feat)
-                        + '"\n'
-                    )
-                    counter = counter + 1
-
-            out_dir = os.path.join(l2_block["OutputDir"], fsf + ".gfeat")
-            new_fsf[output_ind[0]] = (
-                'set fmri(outputdir) "' + os.path.abspath(out_dir) + '"\n'
+    # Apply the Mumford workaround once per L1 FEAT folder, even when several
+    #   L2 fsfs share it
+    feat_folders = sub_tab.feat_folders.unique()
+    missing_folders = {feat for feat in feat_folders if not os.path.exists(feat)}
+    logger.info("Applying Mumford workaround to L1 FEAT folders...")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(
+            executor.map(
+                lambda feat: _apply_mumford_workaround(
+                    feat, logger, remove_reg_standard=True, force=False
+                ),
+                [feat for feat in feat_folders if feat not in missing_folders],
             )
-            out_fsf = os.path.join(l2_block["FSFDir"], fsf + ".fsf")
+        )
 
-            if reference_image is not "":
-                new_fsf[regstandard_ind[0]] = (
-                    'set fmri(regstandard) "' + os.path.abspath(reference_image) + '"\n'
-                )
+    def render_fsf(fsf):
+        target_dirs = list(sub_tab.loc[sub_tab["fsf_name"] == fsf].feat_folders)
+        missing = [feat for feat in target_dirs if feat in missing_folders]
+        if missing:
+            for feat in missing:
+                logger.warning("ERROR: Could not find L1 FEAT directory:  " + feat)
+            return {"fsf_name": fsf, "status": "missing", "missing_folders": missing}
+
+        logger.info("Creating L2 fsf file: " + fsf)
+        settings = {
+            feat_files_key(counter): os.path.abspath(feat)
+            for counter, feat in enumerate(target_dirs, start=1)
+        }
+        out_dir = os.path.join(l2_block["OutputDir"], fsf + ".gfeat")
+        settings[FSF_OUTPUT_DIR] = os.path.abspath(out_dir)
+        if reference_image is not "":
+            settings[FSF_REG_STANDARD] = os.path.abspath(reference_image)
+
+        fsf_template.write(os.path.join(l2_block["FSFDir"], fsf + ".fsf"), settings)
 
-            with open(out_fsf, "w") as fsf_file:
-                fsf_file.writelines(new_fsf)
+        return {"fsf_name": fsf, "status": "created", "missing_folders": []}
 
-        except FileNotFoundError as err:
-            logger.warn(err)
+    logger.info("Propogating fsf files...")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        summary = pd.DataFrame(list(executor.map(render_fsf, fsf_names)))
+
+    logger.info("L2 fsf summary:\n" + summary.to_string(index=False))
 
+    error_count = len(missing_folders)
     error_msg = ""
     if error_count > 0:
         error_msg = f" with {error_count} error(s)"
 
     logger.info(f"Job completed{error_msg}")
 
+    return summary
+
 
 def glm_apply_mumford_workaround(
     glm_config_file=None,
@@ -366,16 +503,28 @@ def glm_apply_mumford_workaround(
     logger.info(f"Finished applying Mumford workaround.")
 
 
-def _apply_mumford_workaround(l1_feat_folder, logger, remove_reg_standard=False):
+def _apply_mumford_workaround(
+    l1_feat_folder, logger, remove_reg_standard=False, force=True
+):
     """
     When using an image registration other than FSL's, such as fMRIPrep's,
     this work-around is necessary to run FEAT L2 analysis in FSL.
 
+    A marker file is left in the reg folder once the workaround succeeds. Unless
+    force is set, a marked folder only has its reg_standard folder removed.
+
     See: https://mumfordbrainstats.tumblr.com/post/166054797696/
         feat-registration-workaround
     """
     l1_feat_folder = Path(l1_feat_folder)
     l1_feat_reg_folder = l1_feat_folder / "reg"
+    marker_path = l1_feat_reg_folder / MUMFORD_MARKER_FILE_NAME
+
+    if not force and marker_path.exists():
+        logger.debug(f"Mumford workaround already applied: {l1_feat_folder}")
+        if remove_reg_standard:
+            _remove_reg_standard(l1_feat_folder, logger)
+        return
 
     # Create the reg directory if it doesn't exist
     # This happens if FEAT's preprocessing was not used
@@ -388,11 +537,7 @@ def _apply_mumford_workaround(l1_feat_folder, logger, remove_reg_standard=False)
             os.remove(mat)
 
     if remove_reg_standard:
-        # Delete the reg_standard folder if it exists
-        reg_standard_path = l1_feat_folder / "reg_standard"
-        if reg_standard_path.exists():
-            logger.debug(f"Removing: {reg_standard_path}")
-            shutil.rmtree(reg_standard_path)
+        _remove_reg_standard(l1_feat_folder, logger)
 
     try:
         # Grab the FSLDIR environment var to get path to standard matrices
@@ -415,10 +560,20 @@ def _apply_mumford_workaround(l1_feat_folder, logger, remove_reg_standard=False)
         # imitating multiplication with the identity matrix.
         logger.debug(f"Copying mean func image {mean_func_path} to {standard_path}")
         shutil.copyfile(mean_func_path, standard_path)
+
+        marker_path.touch()
     except FileNotFoundError as e:
         print(e, "- skipping")
 
 
+def _remove_reg_standard(l1_feat_folder: Path, logger):
+    """Delete an L1 FEAT folder's reg_standard folder if it exists."""
+    reg_standard_path = l1_feat_folder / "reg_standard"
+    if reg_standard_path.exists():
+        logger.debug(f"Removing: {reg_standard_path}")
+        shutil.rmtree(reg_standard_path)
+
+
 def setup_dirs(glm_config: GLMOptions):
     """Populates the GLM config file with resource paths based on project root dir."""
     from pkg_resources import resource_filename
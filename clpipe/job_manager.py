@@ -1,8 +1,12 @@
 import json
 from pkg_resources import resource_stream
 import os
+import re
 import subprocess
 import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from .utils import get_logger
 from clpipe.config.options import BatchManagerConfig
@@ -12,9 +16,20 @@ from clpipe.config.options import BatchManagerConfig
 # for example, BIAC doesn't have time or number of cores as options.
 
 LOGGER_NAME = "batch-manager"
+DEFAULT_BATCH_CONFIG_PATH = "slurmUNCConfig.json"
 OUTPUT_FORMAT_STR = "Output-{jobid}-jobid-%j.out"
 JOB_ID_FORMAT_STR = "{jobid}"
 MAX_JOB_DISPLAY = 5
+LOCAL_STDOUT_FORMAT_STR = "{jobid}.out"
+LOCAL_STDERR_FORMAT_STR = "{jobid}.err"
+ARRAY_JOB_PREFIX = "job_array_"
+ARRAY_MANIFEST_SUFFIX = "_manifest.txt"
+ARRAY_TASK_SCRIPT_TEMPLATE = """#!/bin/bash
+TASK_LINE=$(( ${{{index_variable}}} - {first_index} + 1 ))
+JOB_COMMAND=$(sed -n "${{TASK_LINE}}p" "{manifest}")
+echo "Running array task ${{{index_variable}}}: ${{JOB_COMMAND}}"
+eval "${{JOB_COMMAND}}"
+"""
 
 
 class JobManager:
@@ -60,6 +75,42 @@ class JobManager:
     def submit_jobs(self):
         ...
 
+    def get_dependency_levels(self):
+        """Group the queued jobs into levels for submission in dependency order.
+
+        Jobs in a level only depend on jobs in earlier levels, or on jobs outside
+        the queue which were already submitted.
+
+        Raises:
+            ValueError: If the queued jobs have a circular dependency.
+
+        Returns:
+            List[List[Job]]: The queued jobs, grouped by level.
+        """
+        queued_jobs = set(self.job_queue)
+        placed_jobs = set()
+        remaining_jobs = list(self.job_queue)
+        levels = []
+
+        while remaining_jobs:
+            level = [
+                job
+                for job in remaining_jobs
+                if all(
+                    parent in placed_jobs or parent not in queued_jobs
+                    for parent in job.parent_jobs
+                )
+            ]
+            if not level:
+                job_names = ", ".join(str(job.job_name) for job in remaining_jobs)
+                raise ValueError(f"Circular dependency between jobs: {job_names}")
+
+            levels.append(level)
+            placed_jobs.update(level)
+            remaining_jobs = [job for job in remaining_jobs if job not in placed_jobs]
+
+        return levels
+
 
 class BatchJobManager(JobManager):
     def __init__(
@@ -82,8 +133,10 @@ class BatchJobManager(JobManager):
 
         self.header = self.create_submission_head()
 
-    def create_submission_head(self):
+    def create_submission_head(self, extra_options: list = None):
         head = [self.config.submission_head]
+        if extra_options:
+            head.extend(extra_options)
         for e in self.config.submission_options:
             temp = e["command"] + " " + e["args"]
             head.append(temp)
@@ -120,9 +173,54 @@ class BatchJobManager(JobManager):
 
         return " ".join(head)
 
-    def add_job(self, job_name, job_string):
-        job_string = self.header.format(jobid=job_name, cmdwrap=job_string)
-        self.job_queue.append(Job(job_name, job_string))
+    def add_job(self, job_name, job_string, parent_jobs=None):
+        command = job_string
+        job_string = self.header.format(jobid=job_name, cmdwrap=command)
+        job = Job(job_name, job_string, command=command, parent_jobs=parent_jobs)
+        self.job_queue.append(job)
+        return job
+
+    def create_array_job(self):
+        """Combine the queued jobs into a single array job.
+
+        The queued commands are written to a manifest file, one per line, alongside
+        a task script which runs the manifest line matching its array task index.
+
+        Returns:
+            Job: A job which submits every queued command as one array job.
+        """
+        manifest_fd, manifest_path = tempfile.mkstemp(
+            prefix=ARRAY_JOB_PREFIX, suffix=ARRAY_MANIFEST_SUFFIX, dir=self.output_dir
+        )
+        with os.fdopen(manifest_fd, "w") as manifest_file:
+            for job in self.job_queue:
+                manifest_file.write(" ".join(job.command.splitlines()) + "\n")
+
+        array_name = os.path.basename(manifest_path)[: -len(ARRAY_MANIFEST_SUFFIX)]
+        task_script_path = os.path.join(self.output_dir, array_name + ".sh")
+        with open(task_script_path, "w") as task_script:
+            task_script.write(
+                ARRAY_TASK_SCRIPT_TEMPLATE.format(
+                    index_variable=self.config.array_index_variable,
+                    first_index=self.config.array_first_index,
+                    manifest=manifest_path,
+                )
+            )
+
+        first_index = self.config.array_first_index
+        array_option = self.config.array_command.format(
+            first_index=first_index,
+            last_index=first_index + len(self.job_queue) - 1,
+        )
+        if self.config.array_throttle > 0:
+            array_option += self.config.array_throttle_command.format(
+                throttle=self.config.array_throttle
+            )
+
+        job_string = self.create_submission_head([array_option]).format(
+            jobid=array_name, cmdwrap=f"bash {task_script_path}"
+        )
+        return Job(array_name, job_string, command=f"bash {task_script_path}")
 
     def submit_jobs(self):
         self.logger.info(f"Submitting {len(self.job_queue)} job(s) in batch.")
@@ -130,28 +228,164 @@ class BatchJobManager(JobManager):
         self.logger.debug(f"Time usage: {self.config.time}")
         self.logger.debug(f"Number of threads: {self.config.threads}")
         self.logger.debug(f"Email: {self.config.email}")
-        for job in self.job_queue:
-            # os.system(job.job_string)
-            subprocess.run(job.job_string, shell=True)
+        has_dependencies = any(job.parent_jobs for job in self.job_queue)
+        if self.config.array_job_active and len(self.job_queue) > 1:
+            if has_dependencies:
+                self.logger.info(
+                    "Queued jobs have dependencies - submitting them individually."
+                )
+            else:
+                array_job = self.create_array_job()
+                self.logger.info(f"Submitting jobs as array job: {array_job.job_name}")
+                self.submit_job(array_job)
+                self.job_queue.clear()
+                return
+
+        for level in self.get_dependency_levels():
+            for job in level:
+                self.submit_job(job)
         self.job_queue.clear()
 
+    def submit_job(self, job):
+        """Submit a single job, holding it until its parent jobs finish.
+
+        Returns:
+            str: The scheduler's ID for the job, or None if it could not be found in
+                the submission output.
+        """
+        if job.parent_jobs:
+            parent_ids = [parent.scheduler_id for parent in job.parent_jobs]
+            if None in parent_ids:
+                self.logger.error(
+                    f"Skipping job {job.job_name}: a parent job has no scheduler ID."
+                )
+                return None
+
+            dependency_option = self.config.dependency_command.format(
+                job_ids=self.config.dependency_separator.join(
+                    str(parent_id) for parent_id in parent_ids
+                )
+            )
+            job.job_string = self.create_submission_head([dependency_option]).format(
+                jobid=job.job_name, cmdwrap=job.command
+            )
+
+        process = subprocess.run(
+            job.job_string, shell=True, capture_output=True, text=True
+        )
+        if process.stdout:
+            self.logger.info(process.stdout.strip())
+        if process.stderr:
+            self.logger.warning(process.stderr.strip())
+
+        match = re.search(self.config.job_id_regex, process.stdout)
+        if match:
+            job.scheduler_id = match.group(1)
+        return job.scheduler_id
+
 
 class LocalJobManager(JobManager):
-    def __init__(self, output_directory=None, debug=False):
+    def __init__(
+        self, output_directory=None, debug=False, max_workers=None, threads=None
+    ):
         super().__init__(output_directory, debug)
 
-    def add_job(self, job_name, job_string):
-        job = Job(job_name, job_string)
+        # By default, fill the machine's cores given each job's thread request
+        threads = int(threads) if threads else 1
+        if not max_workers:
+            max_workers = max(1, (os.cpu_count() or 1) // threads)
+        self.max_workers = int(max_workers)
+
+    def add_job(self, job_name, job_string, parent_jobs=None):
+        job = Job(job_name, job_string, parent_jobs=parent_jobs)
         self.job_queue.append(job)
+        return job
 
     def submit_jobs(self):
-        self.logger.info(f"Submitting {len(self.job_queue)} job(s) locally.")
-        processes = []
-        for job in self.job_queue:
-            process = subprocess.run(job.job_string, shell=True, capture_output=True)
-            processes.append(process)
+        """Run the queued jobs concurrently on this machine.
+
+        Each job's stdout and stderr are written to log files in the output
+        directory as the job runs. Jobs start once their parent jobs have finished.
+
+        Returns:
+            List[LocalJobResult]: The result of each job, in queue order.
+        """
+        self.logger.info(
+            f"Submitting {len(self.job_queue)} job(s) locally "
+            f"with up to {self.max_workers} running at once."
+        )
+        results_by_job = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for level in self.get_dependency_levels():
+                results_by_job.update(zip(level, executor.map(self._run_job, level)))
+        results = [results_by_job[job] for job in self.job_queue]
         self.job_queue.clear()
-        return processes
+
+        self._report_results(results)
+        return results
+
+    def _run_job(self, job):
+        stdout_path = os.path.join(
+            self.output_dir, LOCAL_STDOUT_FORMAT_STR.format(jobid=job.job_name)
+        )
+        stderr_path = os.path.join(
+            self.output_dir, LOCAL_STDERR_FORMAT_STR.format(jobid=job.job_name)
+        )
+
+        self.logger.debug(f"Running job {job.job_name}: {job.job_string}")
+        start_time = time.monotonic()
+        with open(stdout_path, "wb") as stdout_file, open(
+            stderr_path, "wb"
+        ) as stderr_file:
+            process = subprocess.run(
+                job.job_string, shell=True, stdout=stdout_file, stderr=stderr_file
+            )
+        duration = time.monotonic() - start_time
+
+        return LocalJobResult(
+            job.job_name, process.returncode, duration, stdout_path, stderr_path
+        )
+
+    def _report_results(self, results):
+        if not results:
+            return
+
+        report = "Local job results:\n"
+        for result in results:
+            report += (
+                f"\t{result.job_name}: exit code {result.returncode} "
+                f"in {result.duration:.1f}s\n"
+            )
+        self.logger.info(report)
+
+        failed_count = sum(1 for result in results if result.returncode != 0)
+        if failed_count:
+            self.logger.warning(
+                f"{failed_count} job(s) failed. See the job logs in: {self.output_dir}"
+            )
+
+
+class LocalJobResult:
+    """The outcome of a job run by the LocalJobManager."""
+
+    def __init__(self, job_name, returncode, duration, stdout_path, stderr_path):
+        self.job_name = job_name
+        self.returncode = returncode
+        self.duration = duration
+        self.stdout_path = stdout_path
+        self.stderr_path = stderr_path
+
+    @property
+    def stdout(self) -> bytes:
+        """The job's stdout, read from its log file."""
+        with open(self.stdout_path, "rb") as stdout_file:
+            return stdout_file.read()
+
+    @property
+    def stderr(self) -> bytes:
+        """The job's stderr, read from its log file."""
+        with open(self.stderr_path, "rb") as stderr_file:
+            return stderr_file.read()
 
 
 class JobManagerFactory:
@@ -165,6 +399,7 @@ class JobManagerFactory:
         time=None,
         threads=None,
         email=None,
+        max_workers=None,
     ) -> JobManager:
         """
         Initializes a JobManager object.
@@ -172,6 +407,8 @@ class JobManagerFactory:
         Args:
             method (str): "batch / Local"
             The method to be used for running the job.
+            max_workers (int): The maximum number of jobs to run at once when
+                running locally. Defaults from the CPU count and threads.
         """
         if batch_config:    # Instantiate Batch Manager
             if not isinstance(batch_config, BatchManagerConfig):
@@ -190,10 +427,18 @@ class JobManagerFactory:
                 batch_config, output_directory, debug, mem_use, time, threads, email
             )
         else:   # Instantiate Local Manager
-            return LocalJobManager()
+            return LocalJobManager(
+                output_directory, debug, max_workers=max_workers, threads=threads
+            )
 
 
 class Job:
-    def __init__(self, job_name, job_string):
+    def __init__(self, job_name, job_string, command=None, parent_jobs=None):
         self.job_name = job_name
-        self.job_string = job_string
\ No newline at end of file
+        self.job_string = job_string
+        # The job's command before being wrapped in a submission string
+        self.command = command if command is not None else job_string
+        # Jobs which must finish before this job starts
+        self.parent_jobs = list(parent_jobs) if parent_jobs else []
+        # The ID assigned to this job by the scheduler, once submitted
+        self.scheduler_id = None
\ No newline at end of file
@@ -18,6 +18,7 @@ from .postprocutils.utils import (
     regress,
     scrub_data,
     notch_filter,
+    build_trial_design,
 )
 from .postprocutils.spec_interpolate import spec_inter
 from .job_manager import BatchManager, Job
@@ -467,34 +468,14 @@ def _find_image_task(filename):
 
 def _ev_mat_prep(event_file, filt, TR, ntp, config_block, logger):
     events = pandas.read_table(event_file)
-    # Change back to 'trial_type' once testing is complete
-    trial_types = events.loc[:, "trial_type"].tolist()
-    logger.debug(trial_types)
-    logger.debug(config_block["ExcludeTrialTypes"])
-    valid_trials = [
-        ind
-        for ind, x in enumerate(trial_types)
-        if x not in [config_block["ExcludeTrialTypes"]]
-    ]
-    valid_events = events.iloc[valid_trials, :]
-
-    timeCourse = numpy.arange(0, 32 + TR / 16.0, (TR / 16.0))
-    time_up = numpy.arange(0, TR * ntp, TR / 16.0)
-    n_up = len(time_up)
-    hrf = 0
-    indexSample = numpy.arange(0, TR * ntp / (TR / 16.0), TR / (TR / 16.0))
-    indexSample = indexSample.astype("int")
-    eventArray = numpy.zeros((ntp, len(valid_trials)))
-    for index, row in valid_events.iterrows():
-        ev_loop = numpy.zeros(n_up)
-        index1 = numpy.logical_and(
-            (time_up >= row["onset"]), (time_up <= row["onset"] + row["duration"])
-        )
-        ev_loop[index1] = 1
-        ev_loop = numpy.convolve(ev_loop, hrf)
-        ev_loop = ev_loop[: -(len(hrf) - 1)]
-        ev_loop = ev_loop[indexSample]
-        eventArray[:, index] = ev_loop
+    exclude_trial_types = config_block["ExcludeTrialTypes"]
+    if isinstance(exclude_trial_types, str):
+        exclude_trial_types = [exclude_trial_types]
+    logger.debug(events.loc[:, "trial_type"].tolist())
+    logger.debug(exclude_trial_types)
+    eventArray, valid_events = build_trial_design(
+        events, TR, ntp, exclude_trial_types=exclude_trial_types
+    )
     if filt is not None:
         filt_event_array = apply_filter(filt, eventArray)
     else:
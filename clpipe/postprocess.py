@@ -13,13 +13,9 @@ from pathlib import Path
 
 from .bids import (
     get_bids,
-    get_confounds,
     get_images_to_process,
-    get_mask,
-    get_mixing_file,
-    get_noise_file,
     get_subjects,
-    get_tr,
+    resolve_image_inputs,
     validate_subject_exists,
 )
 import nipype.pipeline.engine as pe
@@ -38,6 +34,11 @@ from .config.options import (
 from .config.options import DEFAULT_PROCESSING_STREAM
 from .job_manager import JobManagerFactory
 from .postprocutils.global_workflows import build_postprocessing_wf
+from .postprocutils.fused_engine import (
+    ENGINE_FUSED,
+    is_fusable,
+    run_fused_postprocessing,
+)
 from .postprocutils.utils import draw_graph
 from .utils import get_logger, resolve_fmriprep_dir
 from .errors import *
@@ -48,7 +49,7 @@ IMAGE_TIME_DIMENSION_INDEX = 3
 IMAGE_SUBMISSION_STRING_TEMPLATE = (
     "postprocess_image {run_config_file} "
     "{image_file} {subject_out_dir} {subject_working_dir} {subject_log_dir} "
-    "{debug}"
+    "-inputs_file {inputs_file} {debug}"
 )
 BIDS_INDEX_NAME = "bids_index"
 """This is the location of the pybids-generated index"""
@@ -56,6 +57,8 @@ BIDS_INDEX_NAME = "bids_index"
 SUBJECT_LOG_DIR = "distributor"
 """Where to save batch files, within the postprocessing log folder, for subject-level batch logs"""
 RUN_CONFIG_FILE_NAME = "run_config.json"
+IMAGE_INPUTS_FILE_SUFFIX = "_inputs.json"
+"""Suffix of the per-image file of inputs resolved by the distributor"""
 
 
 def postprocess_subjects(
@@ -70,6 +73,7 @@ def postprocess_subjects(
     log_dir=None,
     pybids_db_path=None,
     refresh_index=False,
+    update_index=False,
     debug=False,
     cache=True,
 ):
@@ -100,6 +104,7 @@ def postprocess_subjects(
         target_directory=options.postprocessing.target_directory,
         bids_directory=options.fmriprep.bids_directory,
         batch_config_file=options.batch_config_path,
+        max_workers=options.max_workers,
         email_address=options.email_address,
         stream_working_directory=options.postprocessing.get_stream_working_dir(
             processing_stream
@@ -158,6 +163,7 @@ def postprocess_subjects(
             logger=logger,
             fmriprep_dir=options.postprocessing.target_directory,
             refresh=refresh_index,
+            update=update_index,
         )
 
         subjects_to_process = get_subjects(bids, subjects)
@@ -241,7 +247,8 @@ def postprocess_subject(
             mem_use=2000,
             threads=1,
             time="0:30:0",
-            email=run_config.email_address
+            email=run_config.email_address,
+            max_workers=run_config.max_workers
         )
 
     try:
@@ -289,6 +296,16 @@ def postprocess_subject(
             logger.info(f"Creating subject working directory: {subject_working_dir}")
             subject_working_dir.mkdir(parents=True, exist_ok=False)
 
+        # Resolve each image's inputs once here, so image jobs don't need pybids
+        images_to_process = _write_image_inputs_files(
+            bids,
+            images_to_process,
+            subject_working_dir,
+            "AROMARegression" in run_config.options.processing_steps,
+            logger,
+            events="BetaSeries" in run_config.options.processing_steps,
+        )
+
         submission_strings = _create_image_submission_strings(
             run_config_path,
             images_to_process,
@@ -334,9 +351,13 @@ def postprocess_image(
     subject_log_dir: os.PathLike,
     confounds_only=False,
     debug=False,
+    inputs_file: os.PathLike = None,
 ):
     """
     Setup the workflows specified in the postprocessing configuration.
+
+    The image's inputs are read from the inputs file written by the distributor
+    when given. Otherwise, they are looked up in the pybids index.
     """
     image_path = Path(image_path)
     image_short_name = f"{str(Path(image_path).stem)}"
@@ -361,43 +382,37 @@ def postprocess_image(
     # Remove hyphens to allow use as a pipeline name
     pipeline_name = file_name_no_modality.replace("-", "_")
 
-    bids: BIDSLayout = get_bids(
-        run_config.bids_directory,
-        database_path=run_config.pybids_db_path,
-        fmriprep_dir=run_config.target_directory,
-    )
-    # Lookup the BIDSFile with the image path
-    bids_image: BIDSFile = bids.get_file(image_path)
-    # Fetch the image's entities
-    image_entities = bids_image.get_entities()
-    # Create a sub dict of the entities we will need to query on
-    query_params = {
-        k: image_entities[k]
-        for k in image_entities.keys()
-        & {"session", "subject", "task", "run", "acquisition", "space"}
-    }
-    # Create a specific dict for searching non-image files
-    non_image_query_params = query_params.copy()
-    non_image_query_params.pop("space")
-
-    mixing_file, noise_file = None, None
-    if "AROMARegression" in run_config.options.processing_steps:
+    if inputs_file:
+        logger.info(f"Reading image inputs from: {inputs_file}")
+        with open(inputs_file) as inputs_file_data:
+            image_inputs = json.load(inputs_file_data)
+    else:
+        bids: BIDSLayout = get_bids(
+            run_config.bids_directory,
+            database_path=run_config.pybids_db_path,
+            fmriprep_dir=run_config.target_directory,
+        )
         try:
-            # TODO: update these for image entities
-            mixing_file = get_mixing_file(bids, non_image_query_params, logger)
-            noise_file = get_noise_file(bids, non_image_query_params, logger)
-        except MixingFileNotFoundError as mfnfe:
-            logger.error(mfnfe)
+            image_inputs = resolve_image_inputs(
+                bids,
+                bids.get_file(image_path),
+                logger,
+                aroma="AROMARegression" in run_config.options.processing_steps,
+                events="BetaSeries" in run_config.options.processing_steps,
+            )
+        except (MixingFileNotFoundError, NoiseFileNotFoundError) as aroma_error:
+            logger.error(aroma_error)
             # TODO: this should raise the error for the controller to handle
             sys.exit(1)
-        except NoiseFileNotFoundError as nfnfe:
-            logger.error(nfnfe)
-            sys.exit(1)
 
-    # Search for this subject's files necessary for processing
-    mask_image = get_mask(bids, query_params, logger)
-    tr = get_tr(bids, query_params, logger)
-    confounds_path = get_confounds(bids, non_image_query_params, logger)
+    query_params = image_inputs["entities"]
+    mixing_file = image_inputs["mixing"]
+    noise_file = image_inputs["noise"]
+    mask_image = image_inputs["mask"]
+    tr = image_inputs["tr"]
+    confounds_path = image_inputs["confounds"]
+    # Inputs files written before events were resolved don't have them
+    events_file = image_inputs.get("events")
 
     # Try and build an export path for postprocess confounds if the subject has
     #   confounds to work with
@@ -424,12 +439,32 @@ def postprocess_image(
             subject_out_dir,
         )
 
+    if run_config.options.engine == ENGINE_FUSED:
+        if is_fusable(run_config.options):
+            logger.info("Using the fused postprocessing engine")
+            run_fused_postprocessing(
+                run_config.options,
+                tr,
+                image_file=image_path if not confounds_only else None,
+                image_export_path=image_export_path,
+                confounds_file=confounds_path,
+                confounds_export_path=confounds_export_path,
+                mask_file=mask_image,
+                mixing_file=mixing_file,
+                noise_file=noise_file,
+            )
+            sys.exit(0)
+        logger.warning(
+            "Not all processing steps have a fused implementation - "
+            "falling back to the nipype engine"
+        )
+
     # Build the global postprocessing workflow
     postproc_wf: pe.Workflow = build_postprocessing_wf(
         run_config.options,
         tr,
         name=pipeline_name,
-        image_file=bids_image,
+        image_file=str(image_path),
         image_export_path=image_export_path,
         confounds_file=confounds_path,
         confounds_export_path=confounds_export_path,
@@ -437,6 +472,7 @@ def postprocess_image(
         mask_file=mask_image,
         mixing_file=mixing_file,
         noise_file=noise_file,
+        events_file=events_file,
         base_dir=subject_working_dir,
         crashdump_dir=subject_working_dir,
     )
@@ -528,7 +564,7 @@ def _create_image_submission_strings(
         debug_flag = "-debug"
 
     logger.info("Creating submission string(s)")
-    for image in images_to_process:
+    for image, inputs_file in images_to_process:
         key = f"{Path(image.path).stem}"
 
         submission_strings[key] = IMAGE_SUBMISSION_STRING_TEMPLATE.format(
@@ -537,7 +573,47 @@ def _create_image_submission_strings(
             subject_out_dir=str(subject_out_dir),
             subject_working_dir=str(subject_working_dir),
             subject_log_dir=str(subject_log_dir),
+            inputs_file=str(inputs_file),
             debug=debug_flag,
         )
         logger.debug(submission_strings[key])
     return submission_strings
+
+
+def _write_image_inputs_files(
+    bids: BIDSLayout,
+    images_to_process,
+    subject_working_dir: os.PathLike,
+    aroma: bool,
+    logger,
+    events: bool = False,
+):
+    """Resolve and save the inputs of each image.
+
+    Images whose AROMA files are missing are skipped.
+
+    Returns:
+        List: (image, inputs file) pairs for each image to submit.
+    """
+    logger.info("Resolving image inputs")
+    images_with_inputs = []
+    for image in images_to_process:
+        try:
+            image_inputs = resolve_image_inputs(
+                bids, image, logger, aroma=aroma, events=events
+            )
+        except (MixingFileNotFoundError, NoiseFileNotFoundError) as aroma_error:
+            logger.error(aroma_error)
+            logger.error(f"Skipping image: {image.path}")
+            continue
+
+        inputs_file = (
+            Path(subject_working_dir)
+            / f"{Path(image.path).stem}{IMAGE_INPUTS_FILE_SUFFIX}"
+        )
+        with open(inputs_file, "w") as inputs_file_data:
+            json.dump(image_inputs, inputs_file_data, indent=4)
+        logger.debug(f"Image inputs saved to: {inputs_file}")
+
+        images_with_inputs.append((image, inputs_file))
+    return images_with_inputs
@@ -6,14 +6,39 @@ confound file processing.
 
 import os
 import copy
+from pathlib import Path
 from typing import List
 
+import numpy as np
+import pandas as pd
 from nipype.interfaces.utility import Function, IdentityInterface
 from nipype.interfaces.io import ExportFile
 import nipype.pipeline.engine as pe
 
-from .image_workflows import build_image_postprocessing_workflow
-from .utils import get_scrub_vector_node, expand_columns
+from .image_workflows import (
+    build_image_postprocessing_workflow,
+    get_timeline_steps,
+    STEP_TEMPORAL_FILTERING,
+    IMPLEMENTATION_BUTTERWORTH,
+    STEP_AROMA_REGRESSION,
+    STEP_TRIM_TIMEPOINTS,
+    STEP_SCRUB_TIMEPOINTS,
+    INTERPOLATION_SPECTRAL,
+)
+from .spec_interpolate import spec_inter
+from .utils import (
+    get_scrub_vector_node,
+    expand_columns,
+    expand_column_names,
+    calc_filter,
+    apply_filter_chunked,
+    regress_aroma_chunked,
+    get_scrub_vector,
+    get_scrub_targets,
+    get_remaining_timepoints,
+    construct_motion_outliers,
+)
+from ..errors import ImplementationNotFoundError
 from ..config.options import PostProcessingOptions
 
 # A list of the temporal-based processing steps applicable to confounds
@@ -67,10 +92,10 @@ def build_confounds_processing_workflow(
     if column_names is None:
         column_names = processing_options.confound_options.columns
 
-    # Force use of the R variant of fsl_regfilt for confounds
+    # Force use of the native variant of fsl_regfilt for confounds
     if "AROMARegression" in processing_steps:
         processing_options.processing_step_options.aroma_regression.implementation = (
-            "fsl_regfilt_R"
+            "native_regfilt"
         )
 
     # Gather motion outlier details if present
@@ -159,9 +184,16 @@ def build_confounds_processing_workflow(
 
     # Provide motion outlier columns if requested
     if motion_outliers:
+        # Outliers only get a column if their timepoint is still in the confounds
+        timeline_steps = get_timeline_steps(processing_options, processing_steps)
+        trim_options = processing_options.processing_step_options.trim_timepoints
+
         prev_wf = current_wf
         current_wf = build_confounds_add_motion_outliers_workflow(
             threshold,
+            timeline_steps=timeline_steps,
+            trim_from_beginning=trim_options.from_beginning,
+            trim_from_end=trim_options.from_end,
             base_dir=base_dir,
             crashdump_dir=crashdump_dir,
         )
@@ -174,6 +206,13 @@ def build_confounds_processing_workflow(
         confounds_wf.connect(
             prev_wf, "outputnode.out_file", current_wf, "inputnode.in_file"
         )
+        if STEP_SCRUB_TIMEPOINTS in timeline_steps:
+            confounds_wf.connect(
+                input_node,
+                "scrub_vector",
+                current_wf,
+                "inputnode.removal_scrub_vector",
+            )
 
     confounds_wf.connect(current_wf, "outputnode.out_file", output_node, "out_file")
 
@@ -415,6 +454,9 @@ def build_confounds_add_motion_outliers_workflow(
     confounds_file: os.PathLike = None,
     scrub_vector: list = None,
     out_file: os.PathLike = None,
+    timeline_steps: list = None,
+    trim_from_beginning: int = 0,
+    trim_from_end: int = 0,
     base_dir: os.PathLike = None,
     crashdump_dir: os.PathLike = None,
 ):
@@ -425,6 +467,12 @@ def build_confounds_add_motion_outliers_workflow(
             flowing through the confounds pipeline. Defaults to None.
         out_file (os.PathLike, optional): The confounds file with outlier
             spike regressors appended. Defaults to None.
+        timeline_steps (list, optional): The steps that removed timepoints from
+            the confounds, in order. Outliers at removed timepoints get no column.
+            The scrub vector of any ScrubTimepoints removal is given to the
+            removal_scrub_vector input. Defaults to None.
+        trim_from_beginning (int, optional): Timepoints trimmed from the beginning.
+        trim_from_end (int, optional): Timepoints trimmed from the end.
 
     Returns:
         pe.Workflow: A workflow which attaches spike regressors to a confounds file.
@@ -436,7 +484,8 @@ def build_confounds_add_motion_outliers_workflow(
 
     input_node = pe.Node(
         IdentityInterface(
-            fields=["in_file", "out_file", "scrub_vector"], mandatory_inputs=False
+            fields=["in_file", "out_file", "scrub_vector", "removal_scrub_vector"],
+            mandatory_inputs=False,
         ),
         name="inputnode",
     )
@@ -453,12 +502,22 @@ def build_confounds_add_motion_outliers_workflow(
 
     construct_motion_outliers_node = pe.Node(
         Function(
-            input_names=["scrub_vector"],
+            input_names=[
+                "scrub_vector",
+                "timeline_steps",
+                "trim_from_beginning",
+                "trim_from_end",
+                "removal_scrub_vector",
+            ],
             output_names=["out_file"],
             function=_construct_motion_outliers,
         ),
         name="get_motion_outliers",
     )
+    if timeline_steps:
+        construct_motion_outliers_node.inputs.timeline_steps = list(timeline_steps)
+        construct_motion_outliers_node.inputs.trim_from_beginning = trim_from_beginning
+        construct_motion_outliers_node.inputs.trim_from_end = trim_from_end
 
     combine_confounds_node = pe.Node(
         Function(
@@ -473,6 +532,13 @@ def build_confounds_add_motion_outliers_workflow(
     workflow.connect(
         input_node, "scrub_vector", construct_motion_outliers_node, "scrub_vector"
     )
+    if timeline_steps and STEP_SCRUB_TIMEPOINTS in timeline_steps:
+        workflow.connect(
+            input_node,
+            "removal_scrub_vector",
+            construct_motion_outliers_node,
+            "removal_scrub_vector",
+        )
     # Concat the motion outliers and scrub targets
     workflow.connect(
         input_node, "in_file", combine_confounds_node, "base_confounds_file"
@@ -489,9 +555,293 @@ def build_confounds_add_motion_outliers_workflow(
     return workflow
 
 
-def _construct_motion_outliers(scrub_vector: list):
+def can_process_confounds_natively(
+    processing_options: PostProcessingOptions, processing_steps: List[str] = None
+) -> bool:
+    """Check whether every confounds processing step can run in process_confounds()."""
+    if processing_steps is None:
+        processing_steps = processing_options.processing_steps
+
+    step_options = processing_options.processing_step_options
+    if (
+        STEP_TEMPORAL_FILTERING in processing_steps
+        and step_options.temporal_filtering.implementation != IMPLEMENTATION_BUTTERWORTH
+    ):
+        return False
+    return True
+
+
+def build_confounds_processor_workflow(
+    processing_options: PostProcessingOptions,
+    confounds_file: os.PathLike = None,
+    scrub_vector: list = None,
+    export_file: os.PathLike = None,
+    mixing_file: os.PathLike = None,
+    noise_file: os.PathLike = None,
+    tr: float = None,
+    name: str = "Confounds_Processor",
+    processing_steps: list = None,
+    column_names: list = None,
+    base_dir: os.PathLike = None,
+    crashdump_dir: os.PathLike = None,
+):
+    """Single node counterpart of build_confounds_processing_workflow(), running
+    process_confounds() as one Function node. Takes the same arguments and exposes
+    the same inputnode.scrub_vector and outputnode.out_file fields.
+
+    Returns:
+        pe.Workflow: A confound processing workflow.
+    """
+    workflow = pe.Workflow(name=name, base_dir=base_dir)
+    if crashdump_dir is not None:
+        workflow.config["execution"]["crashdump_dir"] = crashdump_dir
+
+    input_node = pe.Node(
+        IdentityInterface(
+            fields=["in_file", "export_file", "scrub_vector"],
+            mandatory_inputs=False,
+        ),
+        name="inputnode",
+    )
+    output_node = pe.Node(
+        IdentityInterface(fields=["out_file"], mandatory_inputs=True), name="outputnode"
+    )
+
+    processor_node = pe.Node(
+        Function(
+            input_names=[
+                "processing_options",
+                "confounds_file",
+                "export_file",
+                "tr",
+                "mixing_file",
+                "noise_file",
+                "scrub_vector",
+                "processing_steps",
+                "column_names",
+            ],
+            output_names=["out_file"],
+            function=_process_confounds_node,
+        ),
+        name="process_confounds",
+    )
+    # Pass the options as a plain dictionary so the node's inputs can be hashed
+    processor_node.inputs.processing_options = processing_options.to_dict()
+    processor_node.inputs.tr = tr
+    processor_node.inputs.mixing_file = mixing_file
+    processor_node.inputs.noise_file = noise_file
+    processor_node.inputs.processing_steps = processing_steps
+    processor_node.inputs.column_names = column_names
+
+    # Set WF inputs and outputs
+    if confounds_file:
+        input_node.inputs.in_file = confounds_file
+    if export_file:
+        input_node.inputs.export_file = export_file
+    if scrub_vector:
+        input_node.inputs.scrub_vector = scrub_vector
+
+    workflow.connect(input_node, "in_file", processor_node, "confounds_file")
+    workflow.connect(input_node, "export_file", processor_node, "export_file")
+    workflow.connect(input_node, "scrub_vector", processor_node, "scrub_vector")
+    workflow.connect(processor_node, "out_file", output_node, "out_file")
+
+    return workflow
+
+
+def process_confounds(
+    processing_options: PostProcessingOptions,
+    confounds_file: os.PathLike,
+    export_file: os.PathLike = None,
+    tr: float = None,
+    mixing_file: os.PathLike = None,
+    noise_file: os.PathLike = None,
+    scrub_vector: list = None,
+    processing_steps: list = None,
+    column_names: list = None,
+):
+    """Process a confounds file in memory, writing only the result.
+
+    Applies the same column selection, n/a replacement, temporal steps and motion
+    outlier columns as build_confounds_processing_workflow(), without converting
+    the confounds to a .nii file or writing intermediate files. Check a
+    configuration with can_process_confounds_natively() first.
+
+    Args:
+        processing_options (PostProcessingOptions): The instructions for
+            postprocessing.
+        confounds_file (os.PathLike): The input confounds file.
+        export_file (os.PathLike, optional): Where to save the processed confounds.
+            Defaults to the working directory.
+        tr (float, optional): The repetition time. Defaults to None.
+        mixing_file (os.PathLike, optional): The AROMA mixing file.
+            Defaults to None.
+        noise_file (os.PathLike, optional): The AROMA noise file. Defaults to None.
+        scrub_vector (list, optional): The timepoints to scrub. Defaults to None.
+        processing_steps (list, optional): List of processing steps.
+            Defaults to None.
+        column_names (list, optional): List of confounds column names to keep.
+            Defaults to None.
+
+    Raises:
+        ImplementationNotFoundError: If a step cannot be run natively.
+
+    Returns:
+        os.PathLike: The path of the processed confounds file.
+    """
+    if processing_steps is None:
+        processing_steps = processing_options.processing_steps
+    if column_names is None:
+        column_names = processing_options.confound_options.columns
+    if not can_process_confounds_natively(processing_options, processing_steps):
+        raise ImplementationNotFoundError(
+            f"{STEP_TEMPORAL_FILTERING} has no native confounds implementation: "
+            f"{processing_options.processing_step_options.temporal_filtering.implementation}"
+        )
+    step_options = processing_options.processing_step_options
+    if not tr and (
+        STEP_TEMPORAL_FILTERING in processing_steps
+        or (
+            STEP_SCRUB_TIMEPOINTS in processing_steps
+            and step_options.scrub_timepoints.interpolation == INTERPOLATION_SPECTRAL
+        )
+    ):
+        raise ValueError("Missing TR for confounds processing.")
+
+    confounds_df = pd.read_csv(confounds_file, sep="\t")
+
+    # Select the desired columns and replace n/a values with the column mean
+    columns = expand_column_names(confounds_df.columns, column_names)
+    selected_df = confounds_df[columns]
+    selected_df = selected_df.fillna(selected_df.mean())
+
+    # Hold the confounds like an image, as a columns x time matrix, and track which
+    #   of the original timepoints remain so motion outliers can follow them
+    data = selected_df.to_numpy(dtype=np.float64).T.copy()
+    timepoints = np.arange(len(confounds_df))
+
+    for step in processing_steps:
+        if step == STEP_TEMPORAL_FILTERING:
+            filter_options = step_options.temporal_filtering
+            sos = calc_filter(
+                filter_options.filtering_high_pass,
+                filter_options.filtering_low_pass,
+                tr,
+                filter_options.filtering_order,
+            )
+            data = apply_filter_chunked(sos, data)
+        elif step == STEP_AROMA_REGRESSION:
+            mixing = np.loadtxt(mixing_file, ndmin=2)
+            noise_ics = np.loadtxt(noise_file, delimiter=",", dtype=np.int64, ndmin=1)
+            data = regress_aroma_chunked(data, mixing, noise_ics)
+        elif step == STEP_TRIM_TIMEPOINTS:
+            trim_options = step_options.trim_timepoints
+            end_index = data.shape[1] - trim_options.from_end
+            data = data[:, trim_options.from_beginning : end_index]
+            timepoints = timepoints[trim_options.from_beginning : end_index]
+        elif step == STEP_SCRUB_TIMEPOINTS:
+            scrub_options = step_options.scrub_timepoints
+            if scrub_options.interpolation == INTERPOLATION_SPECTRAL:
+                data = spec_inter(
+                    data.T,
+                    tr,
+                    scrub_options.oversampling_freq,
+                    scrub_vector,
+                    scrub_options.percent_freq_sample,
+                    scrub_options.spectral_interpolation_bin_size,
+                ).T
+                continue
+
+            scrub_targets = get_scrub_targets(scrub_vector)
+            if scrub_options.insert_na:
+                data[:, scrub_targets] = np.nan
+            else:
+                data = np.delete(data, scrub_targets, axis=1)
+                timepoints = np.delete(timepoints, scrub_targets)
+
+    processed_df = pd.DataFrame(data.T, columns=columns)
+
+    motion_outliers = processing_options.confound_options.motion_outliers
+    if motion_outliers.include:
+        outlier_vector = get_scrub_vector(
+            confounds_df[motion_outliers.scrub_var],
+            motion_outliers.threshold,
+            motion_outliers.scrub_behind,
+            motion_outliers.scrub_ahead,
+            motion_outliers.scrub_contiguous,
+        )
+        # Only spikes at remaining timepoints get a column
+        outliers_df = construct_motion_outliers(
+            np.asarray(outlier_vector)[timepoints]
+        ).astype(int)
+        outliers_df.columns = [
+            f"motion_outlier_{i}" for i in range(1, len(outliers_df.columns) + 1)
+        ]
+        processed_df = pd.concat([processed_df, outliers_df], axis=1)
+
+    if export_file is None:
+        export_file = Path(Path(confounds_file).stem + "_processed.tsv").absolute()
+
+    processed_df.fillna("n/a").to_csv(export_file, sep="\t", index=False)
+
+    return str(export_file)
+
+
+def _process_confounds_node(
+    processing_options,
+    confounds_file,
+    export_file=None,
+    tr=None,
+    mixing_file=None,
+    noise_file=None,
+    scrub_vector=None,
+    processing_steps=None,
+    column_names=None,
+):
+    # Imports must be in function for running as node
+    import marshmallow_dataclass
+    from clpipe.config.options import PostProcessingOptions
+    from clpipe.postprocutils.confounds_workflows import process_confounds
+
+    options_schema = marshmallow_dataclass.class_schema(PostProcessingOptions)()
+
+    return process_confounds(
+        options_schema.load(processing_options),
+        confounds_file,
+        export_file=export_file,
+        tr=tr,
+        mixing_file=mixing_file,
+        noise_file=noise_file,
+        scrub_vector=scrub_vector,
+        processing_steps=processing_steps,
+        column_names=column_names,
+    )
+
+
+def _construct_motion_outliers(
+    scrub_vector: list,
+    timeline_steps: list = None,
+    trim_from_beginning: int = 0,
+    trim_from_end: int = 0,
+    removal_scrub_vector: list = None,
+):
     from pathlib import Path
-    from clpipe.postprocutils.utils import construct_motion_outliers
+    import numpy as np
+    from clpipe.postprocutils.utils import (
+        construct_motion_outliers,
+        get_remaining_timepoints,
+    )
+
+    # Only spikes at remaining timepoints get a column
+    if timeline_steps:
+        timepoints = get_remaining_timepoints(
+            len(scrub_vector),
+            timeline_steps,
+            trim_from_beginning=trim_from_beginning,
+            trim_from_end=trim_from_end,
+            scrub_vector=removal_scrub_vector,
+        )
+        scrub_vector = np.asarray(scrub_vector)[timepoints]
 
     # Create outlier columns
     mot_outliers = construct_motion_outliers(scrub_vector)
@@ -0,0 +1,369 @@
+"""Fused Postprocessing Engine.
+
+An alternative to the nipype image workflow. Rather than saving a full 4D image to
+the working directory after every processing step, the fused engine loads an image
+once as a voxels-by-time float32 matrix, applies each processing step to the matrix
+in memory, and writes only the final output.
+
+Only processing steps with a native implementation can be fused. Use is_fusable()
+to check a configuration before running it with this engine.
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Callable, List
+
+import numpy as np
+
+from .image_workflows import (
+    STEP_TEMPORAL_FILTERING,
+    IMPLEMENTATION_BUTTERWORTH,
+    STEP_INTENSITY_NORMALIZATION,
+    IMPLEMENTATION_10000_GLOBAL_MEDIAN,
+    IMPLEMENTATION_100_VOXEL_MEAN,
+    STEP_APPLY_MASK,
+    STEP_TRIM_TIMEPOINTS,
+    STEP_SCRUB_TIMEPOINTS,
+    INTERPOLATION_SPECTRAL,
+    STEP_CONFOUND_REGRESSION,
+    IMPLEMENTATION_NATIVE_QR,
+    STEP_AROMA_REGRESSION,
+    IMPLEMENTATION_NATIVE_REGFILT,
+)
+from .confounds_workflows import process_confounds
+from .spec_interpolate import spec_inter
+from .utils import (
+    apply_filter_chunked,
+    calc_filter,
+    get_scrub_targets,
+    get_combined_scrub_vector,
+    load_confounds_matrix,
+    load_image_matrix,
+    load_mask_vector,
+    save_image_matrix,
+    regress_confounds_chunked,
+    regress_aroma_chunked,
+    split_spike_regressors,
+)
+from ..errors import ImplementationNotFoundError
+from ..config.options import PostProcessingOptions
+from ..utils import get_logger
+
+ENGINE_NIPYPE = "nipype"
+ENGINE_FUSED = "fused"
+
+FUSED_DTYPE = np.float32
+
+
+@dataclass
+class FusedContext:
+    """Per-image inputs available to each fused processing step."""
+
+    processing_options: PostProcessingOptions
+    tr: float = None
+    mask: np.ndarray = None
+    """Flattened boolean brain mask, aligned with the rows of the data matrix."""
+    confounds_file: os.PathLike = None
+    scrub_vector: list = None
+    mixing_file: os.PathLike = None
+    noise_file: os.PathLike = None
+
+
+def is_fusable(
+    processing_options: PostProcessingOptions, processing_steps: List[str] = None
+) -> bool:
+    """Check whether every processing step has a native, fusable implementation."""
+    if processing_steps is None:
+        processing_steps = processing_options.processing_steps
+
+    try:
+        for step in processing_steps:
+            _get_fused_step_implementation(step, processing_options)
+    except ImplementationNotFoundError:
+        return False
+    return True
+
+
+def run_fused_postprocessing(
+    processing_options: PostProcessingOptions,
+    tr: float,
+    image_file: os.PathLike = None,
+    image_export_path: os.PathLike = None,
+    confounds_file: os.PathLike = None,
+    confounds_export_path: os.PathLike = None,
+    mask_file: os.PathLike = None,
+    mixing_file: os.PathLike = None,
+    noise_file: os.PathLike = None,
+):
+    """Fused counterpart of build_postprocessing_wf().
+
+    Calculates the scrub vector and processes the confounds file, then runs the
+    image through the fused engine.
+
+    Args:
+        processing_options (PostProcessingOptions): The instructions for
+            postprocessing.
+        tr (float): The repetition time of the image.
+        image_file (os.PathLike, optional): The image to process. Defaults to None.
+        image_export_path (os.PathLike, optional): Where to save the processed image.
+            Defaults to None.
+        confounds_file (os.PathLike, optional): The image's confounds file.
+            Defaults to None.
+        confounds_export_path (os.PathLike, optional): Where to save the processed
+            confounds. Defaults to None.
+        mask_file (os.PathLike, optional): The image's brain mask. Defaults to None.
+        mixing_file (os.PathLike, optional): The AROMA mixing file. Defaults to None.
+        noise_file (os.PathLike, optional): The AROMA noise file. Defaults to None.
+
+    Returns:
+        os.PathLike: The path of the processed image, or None if no image was given.
+    """
+    logger = get_logger("fused_engine")
+    processing_steps = processing_options.processing_steps
+
+    scrub_vector = None
+    if STEP_SCRUB_TIMEPOINTS in processing_steps and confounds_file:
+        scrub_columns = (
+            processing_options.processing_step_options.scrub_timepoints.scrub_columns
+        )
+        scrub_vector = get_combined_scrub_vector(
+            confounds_file,
+            [scrub_column.to_dict() for scrub_column in scrub_columns],
+        )
+
+    processed_confounds_file = None
+    if confounds_file:
+        processed_confounds_file = process_confounds(
+            processing_options,
+            confounds_file,
+            export_file=confounds_export_path,
+            tr=tr,
+            mixing_file=mixing_file,
+            noise_file=noise_file,
+            scrub_vector=scrub_vector,
+        )
+
+    if not image_file:
+        return None
+
+    logger.info(f"Running fused postprocessing for: {image_file}")
+    return run_fused_image_postprocessing(
+        processing_options,
+        in_file=image_file,
+        export_path=image_export_path,
+        tr=tr,
+        mask_file=mask_file,
+        confounds_file=processed_confounds_file,
+        scrub_vector=scrub_vector,
+        mixing_file=mixing_file,
+        noise_file=noise_file,
+    )
+
+
+def run_fused_image_postprocessing(
+    processing_options: PostProcessingOptions,
+    in_file: os.PathLike,
+    export_path: os.PathLike,
+    tr: float = None,
+    mask_file: os.PathLike = None,
+    confounds_file: os.PathLike = None,
+    scrub_vector: list = None,
+    mixing_file: os.PathLike = None,
+    noise_file: os.PathLike = None,
+    processing_steps: List[str] = None,
+):
+    """Apply the processing steps to an image in memory, saving only the result.
+
+    Raises:
+        ImplementationNotFoundError: If a step has no fused implementation.
+
+    Returns:
+        os.PathLike: The export path of the processed image.
+    """
+    if processing_steps is None:
+        processing_steps = processing_options.processing_steps
+    if len(processing_steps) < 1:
+        raise ValueError(
+            "The PostProcess workflow requires at least 1 processing step."
+        )
+
+    # Resolve every step up front so an unsupported step fails before any work
+    step_functions = [
+        _get_fused_step_implementation(step, processing_options)
+        for step in processing_steps
+    ]
+
+    data, spatial_shape, affine, header = load_image_matrix(in_file)
+
+    mask = None
+    if mask_file:
+        mask = load_mask_vector(mask_file, spatial_shape)
+
+    context = FusedContext(
+        processing_options=processing_options,
+        tr=tr,
+        mask=mask,
+        confounds_file=confounds_file,
+        scrub_vector=scrub_vector,
+        mixing_file=mixing_file,
+        noise_file=noise_file,
+    )
+
+    for step_function in step_functions:
+        data = step_function(data, context)
+
+    save_image_matrix(data, spatial_shape, affine, header, export_path)
+
+    return export_path
+
+
+def _get_fused_step_implementation(
+    step: str, processing_options: PostProcessingOptions
+) -> Callable:
+    step_options = processing_options.processing_step_options
+
+    if step == STEP_TEMPORAL_FILTERING:
+        implementation_name = step_options.temporal_filtering.implementation
+        if implementation_name == IMPLEMENTATION_BUTTERWORTH:
+            return _fused_butterworth_filter
+    elif step == STEP_INTENSITY_NORMALIZATION:
+        implementation_name = step_options.intensity_normalization.implementation
+        if implementation_name == IMPLEMENTATION_10000_GLOBAL_MEDIAN:
+            return _fused_10000_global_median
+        elif implementation_name == IMPLEMENTATION_100_VOXEL_MEAN:
+            return _fused_100_voxel_mean
+    elif step == STEP_APPLY_MASK:
+        return _fused_apply_mask
+    elif step == STEP_TRIM_TIMEPOINTS:
+        return _fused_trim_timepoints
+    elif step == STEP_SCRUB_TIMEPOINTS:
+        return _fused_scrub_timepoints
+    elif step == STEP_CONFOUND_REGRESSION:
+        implementation_name = step_options.confound_regression.implementation
+        if implementation_name == IMPLEMENTATION_NATIVE_QR:
+            return _fused_confound_regression
+    elif step == STEP_AROMA_REGRESSION:
+        implementation_name = step_options.aroma_regression.implementation
+        if implementation_name == IMPLEMENTATION_NATIVE_REGFILT:
+            return _fused_aroma_regression
+    else:
+        implementation_name = None
+
+    raise ImplementationNotFoundError(
+        f"{step} has no fused implementation"
+        + (f": {implementation_name}" if implementation_name else "")
+    )
+
+
+def _fused_butterworth_filter(data: np.ndarray, context: FusedContext) -> np.ndarray:
+    if not context.tr:
+        raise ValueError(f"{STEP_TEMPORAL_FILTERING}: Missing TR for fused filtering.")
+    filter_options = (
+        context.processing_options.processing_step_options.temporal_filtering
+    )
+
+    voxel_index = None
+    if filter_options.restrict_to_mask:
+        if context.mask is None:
+            raise ValueError(f"{STEP_TEMPORAL_FILTERING}: No mask file provided.")
+        voxel_index = np.flatnonzero(context.mask)
+
+    sos = calc_filter(
+        filter_options.filtering_high_pass,
+        filter_options.filtering_low_pass,
+        context.tr,
+        filter_options.filtering_order,
+    )
+
+    return apply_filter_chunked(sos, data, voxel_index)
+
+
+def _fused_10000_global_median(data: np.ndarray, context: FusedContext) -> np.ndarray:
+    # Matches fslstats -p 50, which only considers nonzero voxels
+    values = data[context.mask] if context.mask is not None else data
+    values = values[values != 0]
+    if values.size == 0:
+        raise ValueError(f"{STEP_INTENSITY_NORMALIZATION}: Image contains no data.")
+
+    data *= FUSED_DTYPE(10000 / np.median(values))
+    return data
+
+
+def _fused_100_voxel_mean(data: np.ndarray, context: FusedContext) -> np.ndarray:
+    voxel_mean = data.mean(axis=1, keepdims=True)
+    # Like fslmaths, division by a zero mean gives zero
+    np.divide(data * 100, voxel_mean, out=data, where=voxel_mean != 0)
+    data[(voxel_mean == 0).ravel()] = 0
+    return data
+
+
+def _fused_apply_mask(data: np.ndarray, context: FusedContext) -> np.ndarray:
+    if context.mask is None:
+        raise ValueError(f"{STEP_APPLY_MASK}: No mask file provided.")
+    data[~context.mask] = 0
+    return data
+
+
+def _fused_trim_timepoints(data: np.ndarray, context: FusedContext) -> np.ndarray:
+    trim_options = context.processing_options.processing_step_options.trim_timepoints
+    end_index = data.shape[1] - trim_options.from_end
+
+    return data[:, trim_options.from_beginning : end_index]
+
+
+def _fused_scrub_timepoints(data: np.ndarray, context: FusedContext) -> np.ndarray:
+    if context.scrub_vector is None:
+        raise ValueError(f"{STEP_SCRUB_TIMEPOINTS}: No scrub vector provided.")
+    scrub_options = context.processing_options.processing_step_options.scrub_timepoints
+
+    if scrub_options.interpolation == INTERPOLATION_SPECTRAL:
+        if not context.tr:
+            raise ValueError(
+                f"{STEP_SCRUB_TIMEPOINTS}: Missing TR for spectral interpolation."
+            )
+        # spec_inter expects time on the first axis, so work on the transpose
+        interpolated = spec_inter(
+            data.T,
+            context.tr,
+            scrub_options.oversampling_freq,
+            context.scrub_vector,
+            scrub_options.percent_freq_sample,
+            scrub_options.spectral_interpolation_bin_size,
+        )
+        return np.ascontiguousarray(interpolated.T, dtype=FUSED_DTYPE)
+
+    scrub_targets = get_scrub_targets(context.scrub_vector)
+    if scrub_options.insert_na:
+        data[:, scrub_targets] = np.nan
+        return data
+    return np.delete(data, scrub_targets, axis=1)
+
+
+def _fused_confound_regression(data: np.ndarray, context: FusedContext) -> np.ndarray:
+    if not context.confounds_file:
+        raise ValueError(f"{STEP_CONFOUND_REGRESSION}: No confounds file provided.")
+
+    voxel_index = None
+    if context.mask is not None:
+        data[~context.mask] = 0
+        voxel_index = np.flatnonzero(context.mask)
+
+    confounds, spike_index = split_spike_regressors(
+        load_confounds_matrix(context.confounds_file)
+    )
+    return regress_confounds_chunked(
+        data, confounds, voxel_index, spike_index=spike_index
+    )
+
+
+def _fused_aroma_regression(data: np.ndarray, context: FusedContext) -> np.ndarray:
+    if not (context.mixing_file and context.noise_file):
+        raise ValueError(f"{STEP_AROMA_REGRESSION}: Missing AROMA mixing/noise file.")
+
+    voxel_index = None
+    if context.mask is not None:
+        voxel_index = np.flatnonzero(context.mask)
+
+    mixing = np.loadtxt(context.mixing_file, ndmin=2)
+    noise_ics = np.loadtxt(context.noise_file, delimiter=",", dtype=np.int64, ndmin=1)
+    return regress_aroma_chunked(data, mixing, noise_ics, voxel_index)
@@ -3,13 +3,18 @@ import os
 from nipype.interfaces.utility import Function, IdentityInterface
 import nipype.pipeline.engine as pe
 
-from .utils import get_scrub_vector_node, logical_or_across_lists, expand_scrub_dict
+from .utils import get_combined_scrub_vector
 from .image_workflows import (
     build_image_postprocessing_workflow,
     STEP_CONFOUND_REGRESSION,
     STEP_SCRUB_TIMEPOINTS,
+    STEP_BETA_SERIES,
+)
+from .confounds_workflows import (
+    build_confounds_processing_workflow,
+    build_confounds_processor_workflow,
+    can_process_confounds_natively,
 )
-from .confounds_workflows import build_confounds_processing_workflow
 from ..utils import get_logger
 from ..config.options import PostProcessingOptions
 
@@ -25,6 +30,7 @@ def build_postprocessing_wf(
     mask_file: os.PathLike = None,
     mixing_file: os.PathLike = None,
     noise_file: os.PathLike = None,
+    events_file: os.PathLike = None,
     working_dir: os.PathLike = None,
     base_dir: os.PathLike = None,
     crashdump_dir: os.PathLike = None,
@@ -66,7 +72,12 @@ def build_postprocessing_wf(
     # Create the confounds workflow, if confounds path given
     confounds_wf = None
     if confounds_file:
-        confounds_wf = build_confounds_processing_workflow(
+        # Prefer the single node processor, which avoids the .nii round trip
+        if can_process_confounds_natively(processing_options):
+            build_confounds_wf = build_confounds_processor_workflow
+        else:
+            build_confounds_wf = build_confounds_processing_workflow
+        confounds_wf = build_confounds_wf(
             processing_options,
             confounds_file=confounds_file,
             export_file=confounds_export_path,
@@ -92,12 +103,16 @@ def build_postprocessing_wf(
             mixing_file=mixing_file,
             noise_file=noise_file,
             tr=tr,
+            events_file=events_file,
             base_dir=base_dir,
             crashdump_dir=crashdump_dir,
         )
 
         # Connect postprocessed confound file to image_wf if needed
-        if STEP_CONFOUND_REGRESSION in processing_steps:
+        if confounds_wf and (
+            STEP_CONFOUND_REGRESSION in processing_steps
+            or STEP_BETA_SERIES in processing_steps
+        ):
             postproc_wf.connect(
                 confounds_wf,
                 "outputnode.out_file",
@@ -162,39 +177,17 @@ def build_multiple_scrubbing_workflow(
     # Convert list of ScrubColumns to list of dicts
     scrub_configs = [scrub_config.to_dict() for scrub_config in scrub_configs]
 
-    # Feed the scrub config list of dicts into the mapper via the workflow inputnode
+    # Feed the scrub config list of dicts into the scrub node via the workflow inputnode
     input_node.inputs.scrub_configs = scrub_configs
-    input_node.inputs.tsv_file = confounds_file
 
-    # Expanding Dict using Wildcard node
-    expand_node = pe.Node(
-        Function(
-            input_names=["tsv_file", "scrub_configs"],
-            output_names=["scrub_configs"],
-            function=expand_scrub_dict,
-        ),
-        name="expand_node",
-    )
-
-    # Define the function node
-    scrub_target_node = pe.MapNode(
+    # Compute and combine the scrub vectors of all columns in a single node
+    scrub_target_node = pe.Node(
         Function(
             input_names=["confounds_file", "scrub_configs"],
             output_names=["scrub_vector"],
-            function=get_scrub_vector_node,
+            function=get_combined_scrub_vector,
         ),
-        iterfield=["scrub_configs"],
-        name="get_scrub_vector_map_node",
-    )
-
-    # Create the logical_or_node
-    reduce_node = pe.Node(
-        Function(
-            input_names=["list_of_lists"],
-            output_names=["or_result"],
-            function=logical_or_across_lists,
-        ),
-        name="reduce_node",
+        name="get_combined_scrub_vector",
     )
 
     # Create a new workflow to hold only the scrub_target_node
@@ -202,22 +195,14 @@ def build_multiple_scrubbing_workflow(
     if crashdump_dir is not None:
         mult_scrub_wf.config["execution"]["crashdump_dir"] = crashdump_dir
 
-    mult_scrub_wf.add_nodes(
-        [input_node, expand_node, scrub_target_node, reduce_node, output_node]
-    )
+    mult_scrub_wf.add_nodes([input_node, scrub_target_node, output_node])
 
-    mult_scrub_wf.connect(input_node, "tsv_file", expand_node, "tsv_file")
-    mult_scrub_wf.connect(input_node, "scrub_configs", expand_node, "scrub_configs")
     mult_scrub_wf.connect(
-        expand_node, "scrub_configs", scrub_target_node, "scrub_configs"
+        input_node, "scrub_configs", scrub_target_node, "scrub_configs"
     )
     mult_scrub_wf.connect(
         input_node, "confounds_file", scrub_target_node, "confounds_file"
     )
-
-    mult_scrub_wf.connect(
-        scrub_target_node, "scrub_vector", reduce_node, "list_of_lists"
-    )
-    mult_scrub_wf.connect(reduce_node, "or_result", output_node, "out_file")
+    mult_scrub_wf.connect(scrub_target_node, "scrub_vector", output_node, "out_file")
 
     return mult_scrub_wf
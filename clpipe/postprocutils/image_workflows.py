@@ -31,11 +31,15 @@ from .nodes import (
     build_input_node,
     build_output_node,
     ButterworthFilter,
+    ConfoundRegression,
     RegressAromaR,
+    RegressAroma,
+    BetaSeriesLSS,
     ImageSlice,
 )
 from .utils import (
     scrub_image,
+    interpolate_image,
     get_scrub_vector_node,
     vector_to_txt,
     logical_or_across_lists,
@@ -59,10 +63,12 @@ IMPLEMENTATION_SUSAN = "SUSAN"
 STEP_AROMA_REGRESSION = "AROMARegression"
 IMPLEMENTATION_FSL_REGFILT = "fsl_regfilt"
 IMPLEMENTATION_FSL_REGFILT_R = "fsl_regfilt_R"
+IMPLEMENTATION_NATIVE_REGFILT = "native_regfilt"
 
 STEP_CONFOUND_REGRESSION = "ConfoundRegression"
 IMPLEMENTATION_FSL_GLM = "fsl_glm"
 IMPLEMENTATION_AFNI_3DTPROJECT = "afni_3dTproject"
+IMPLEMENTATION_NATIVE_QR = "native_qr"
 
 STEP_APPLY_MASK = "ApplyMask"
 STEP_TRIM_TIMEPOINTS = "TrimTimepoints"
@@ -70,6 +76,11 @@ STEP_RESAMPLE = "Resample"
 
 STEP_SCRUB_TIMEPOINTS = "ScrubTimepoints"
 
+STEP_BETA_SERIES = "BetaSeries"
+IMPLEMENTATION_NATIVE_LSS = "native_lss"
+INTERPOLATION_NONE = "none"
+INTERPOLATION_SPECTRAL = "spectral"
+
 
 def build_image_postprocessing_workflow(
     processing_options: PostProcessingOptions,
@@ -83,6 +94,7 @@ def build_image_postprocessing_workflow(
     confounds_file: os.PathLike = None,
     tr: float = None,
     scrub_vector: list = None,
+    events_file: os.PathLike = None,
     base_dir: os.PathLike = None,
     crashdump_dir: os.PathLike = None,
 ):
@@ -111,6 +123,7 @@ def build_image_postprocessing_workflow(
                 "mixing_file",
                 "noise_file",
                 "tr",
+                "events_file",
             ],
             mandatory_inputs=False,
         ),
@@ -137,6 +150,8 @@ def build_image_postprocessing_workflow(
         input_node.inputs.noise_file = noise_file
     if tr:
         input_node.inputs.tr = tr
+    if events_file:
+        input_node.inputs.events_file = events_file
 
     current_wf = None
     prev_wf = None
@@ -159,6 +174,16 @@ def build_image_postprocessing_workflow(
             implementation_name = (
                 processing_options.processing_step_options.temporal_filtering.implementation
             )
+            filter_mask_file = None
+            filter_options = (
+                processing_options.processing_step_options.temporal_filtering
+            )
+            if filter_options.restrict_to_mask:
+                if mask_file is None:
+                    raise ValueError(
+                        f"{STEP_TEMPORAL_FILTERING}: No mask file provided."
+                    )
+                filter_mask_file = mask_file
 
             current_wf = build_temporal_filter_workflow(
                 implementation_name,
@@ -167,6 +192,7 @@ def build_image_postprocessing_workflow(
                 tr=tr,
                 order=order,
                 scrub_targets=None,
+                mask_file=filter_mask_file,
                 base_dir=postproc_wf.base_dir,
                 crashdump_dir=crashdump_dir,
             )
@@ -279,12 +305,15 @@ def build_image_postprocessing_workflow(
             )
 
         elif step == STEP_SCRUB_TIMEPOINTS:
-            insert_na = (
-                processing_options.processing_step_options.scrub_timepoints.insert_na
-            )
+            scrub_options = processing_options.processing_step_options.scrub_timepoints
 
             current_wf = build_scrubbing_workflow(
-                insert_na=insert_na,
+                insert_na=scrub_options.insert_na,
+                interpolation=scrub_options.interpolation,
+                tr=tr,
+                oversampling_freq=scrub_options.oversampling_freq,
+                percent_freq_sample=scrub_options.percent_freq_sample,
+                bin_size=scrub_options.spectral_interpolation_bin_size,
                 base_dir=postproc_wf.base_dir,
                 crashdump_dir=crashdump_dir,
             )
@@ -292,6 +321,53 @@ def build_image_postprocessing_workflow(
                 input_node, "scrub_vector", current_wf, "inputnode.scrub_vector"
             )
 
+        elif step == STEP_BETA_SERIES:
+            # The output holds one volume per trial, not a timeseries
+            if index != step_count - 1:
+                raise ValueError(
+                    f"{STEP_BETA_SERIES} must be the last processing step."
+                )
+            if not tr:
+                raise ValueError(f"Missing TR corresponding to image: {in_file}")
+            if not events_file:
+                raise ValueError(f"{STEP_BETA_SERIES}: No events file provided.")
+            beta_series_options = processing_options.processing_step_options.beta_series
+
+            beta_series_implementation = _getBetaSeriesImplementation(
+                beta_series_options.implementation
+            )
+
+            # The trial design must go through the same steps as the image
+            timeline_steps = get_timeline_steps(
+                processing_options, processing_steps[:index], include_filtering=True
+            )
+            step_options = processing_options.processing_step_options
+
+            current_wf = beta_series_implementation(
+                tr=tr,
+                exclude_trial_types=beta_series_options.exclude_trial_types,
+                mask_file=mask_file,
+                timeline_steps=timeline_steps,
+                trim_from_beginning=step_options.trim_timepoints.from_beginning,
+                trim_from_end=step_options.trim_timepoints.from_end,
+                filtering_high_pass=step_options.temporal_filtering.filtering_high_pass,
+                filtering_low_pass=step_options.temporal_filtering.filtering_low_pass,
+                filtering_order=step_options.temporal_filtering.filtering_order,
+                base_dir=postproc_wf.base_dir,
+                crashdump_dir=crashdump_dir,
+            )
+
+            postproc_wf.connect(
+                input_node, "events_file", current_wf, "inputnode.events_file"
+            )
+            postproc_wf.connect(
+                input_node, "confounds_file", current_wf, "inputnode.confounds_file"
+            )
+            if STEP_SCRUB_TIMEPOINTS in timeline_steps:
+                postproc_wf.connect(
+                    input_node, "scrub_vector", current_wf, "inputnode.scrub_vector"
+                )
+
         # Send input of postproc workflow to first workflow
         if index == 0:
             postproc_wf.connect(input_node, "in_file", current_wf, "inputnode.in_file")
@@ -336,10 +412,16 @@ def build_temporal_filter_workflow(
             lp=lp,
             tr=tr,
             order=order,
+            mask_file=mask_file,
             base_dir=base_dir,
             crashdump_dir=crashdump_dir,
         )
     elif implementationName == IMPLEMENTATION_FSLMATHS:
+        if mask_file:
+            raise ValueError(
+                f"{STEP_TEMPORAL_FILTERING}: The {IMPLEMENTATION_FSLMATHS} "
+                "implementation can't be restricted to a mask."
+            )
         return build_fslmath_temporal_filter(
             hp=hp,
             lp=lp,
@@ -368,6 +450,8 @@ def build_temporal_filter_workflow(
 def _getIntensityNormalizationImplementation(implementationName: str):
     if implementationName == IMPLEMENTATION_10000_GLOBAL_MEDIAN:
         return build_10000_global_median_workflow
+    elif implementationName == IMPLEMENTATION_100_VOXEL_MEAN:
+        return build_100_voxel_mean_workflow
     else:
         raise ImplementationNotFoundError(
             f"{STEP_INTENSITY_NORMALIZATION} implementation not found: {implementationName}"
@@ -388,6 +472,8 @@ def _getAROMARegressionImplementation(implementationName: str):
         return build_aroma_workflow_fsl_regfilt
     if implementationName == IMPLEMENTATION_FSL_REGFILT_R:
         return build_aroma_workflow_fsl_regfilt_R
+    if implementationName == IMPLEMENTATION_NATIVE_REGFILT:
+        return build_aroma_workflow_native_regfilt
     else:
         raise ImplementationNotFoundError(
             f"{STEP_AROMA_REGRESSION} implementation not found: {implementationName}"
@@ -399,12 +485,65 @@ def _getConfoundRegressionImplementation(implementationName: str):
         return build_confound_regression_fsl_glm_workflow
     elif implementationName == IMPLEMENTATION_AFNI_3DTPROJECT:
         return build_confound_regression_afni_3dTproject
+    elif implementationName == IMPLEMENTATION_NATIVE_QR:
+        return build_confound_regression_native_qr_workflow
     else:
         raise ImplementationNotFoundError(
             f"{STEP_CONFOUND_REGRESSION} implementation not found: {implementationName}"
         )
 
 
+def get_timeline_steps(
+    processing_options: PostProcessingOptions,
+    processing_steps: list,
+    include_filtering: bool = False,
+):
+    """Find the processing steps that change an image's timeline, in order, so
+    they can be replayed on data which must stay aligned with the image.
+
+    Args:
+        include_filtering (bool, optional): Also include temporal filtering, which
+            changes every timepoint without removing any. Defaults to False.
+
+    Raises:
+        ValueError: If filtering is included and its implementation cannot be
+            replayed on other data.
+    """
+    step_options = processing_options.processing_step_options
+    timeline_steps = []
+    for step in processing_steps:
+        if step == STEP_TRIM_TIMEPOINTS:
+            timeline_steps.append(step)
+        elif step == STEP_SCRUB_TIMEPOINTS:
+            scrub_options = step_options.scrub_timepoints
+            # NA insertion and interpolation keep every timepoint in place
+            if not scrub_options.insert_na and scrub_options.interpolation in (
+                None,
+                INTERPOLATION_NONE,
+            ):
+                timeline_steps.append(step)
+        elif step == STEP_TEMPORAL_FILTERING and include_filtering:
+            implementation_name = step_options.temporal_filtering.implementation
+            if implementation_name != IMPLEMENTATION_BUTTERWORTH:
+                raise ValueError(
+                    f"Only the {IMPLEMENTATION_BUTTERWORTH} implementation of "
+                    f"{STEP_TEMPORAL_FILTERING} can be replayed on other data, "
+                    f"such as a {STEP_BETA_SERIES} trial design: {implementation_name}"
+                )
+            timeline_steps.append(step)
+
+    return timeline_steps
+
+
+def _getBetaSeriesImplementation(implementationName: str):
+    if implementationName == IMPLEMENTATION_NATIVE_LSS:
+        return build_beta_series_native_lss_workflow
+    else:
+        raise ImplementationNotFoundError(
+            f"{STEP_BETA_SERIES} implementation not found: {implementationName}"
+        )
+
+
 def build_10000_global_median_workflow(
     in_file: os.PathLike = None,
     out_file: os.PathLike = None,
@@ -460,6 +599,7 @@ def build_10000_global_median_workflow(
 def build_100_voxel_mean_workflow(
     in_file: os.PathLike = None,
     out_file: os.PathLike = None,
+    mask_file: os.PathLike = None,
     base_dir: os.PathLike = None,
     crashdump_dir: os.PathLike = None,
 ):
@@ -468,26 +608,27 @@ def build_100_voxel_mean_workflow(
     Args:
         in_path (str): A path to an input .nii to normalize.
         out_path (str): A path to save the normalized image.
+        mask_file (os.PathLike, optional): Unused - each voxel is scaled by its own
+            mean. Accepted so every normalization implementation is built the
+            same way.
 
     Returns:
         pe.Workflow: A 100 voxel mean workflow.
     """
 
-    if in_file != None:
-        mean_image = MeanImage(in_file=in_file)
-        mul_math = BinaryMaths(operation="mul", operand_value=100, in_file=in_file)
-    else:
-        mean_image = MeanImage()
-        mul_math = BinaryMaths(operation="mul", operand_value=100)
-
-    mean_node = pe.Node(mean_image, name="mean")
-    mul100_node = pe.Node(mul_math, name="mul100")
+    input_node = build_input_node()
+    output_node = build_output_node()
+    mean_node = pe.Node(MeanImage(), name="mean")
+    mul100_node = pe.Node(
+        BinaryMaths(operation="mul", operand_value=100), name="mul100"
+    )
+    div_mean_node = pe.Node(BinaryMaths(operation="div"), name="div_mean")
 
-    if out_file != None:
-        div_math = BinaryMaths(operation="div", out_file=out_file)
-    else:
-        div_math = BinaryMaths(operation="div")
-    div_mean_node = pe.Node(div_math, name="div_mean")  # operand_file=mean_path
+    # Set WF inputs and outputs
+    if in_file:
+        input_node.inputs.in_file = in_file
+    if out_file:
+        input_node.inputs.out_file = out_file
 
     workflow = pe.Workflow(
         name=f"{STEP_INTENSITY_NORMALIZATION}_{IMPLEMENTATION_100_VOXEL_MEAN}",
@@ -496,8 +637,13 @@ def build_100_voxel_mean_workflow(
     if crashdump_dir is not None:
         workflow.config["execution"]["crashdump_dir"] = crashdump_dir
 
+    workflow.connect(input_node, "in_file", mean_node, "in_file")
+    workflow.connect(input_node, "in_file", mul100_node, "in_file")
+    workflow.connect(input_node, "out_file", div_mean_node, "out_file")
+
     workflow.connect(mul100_node, "out_file", div_mean_node, "in_file")
     workflow.connect(mean_node, "out_file", div_mean_node, "operand_file")
+    workflow.connect(div_mean_node, "out_file", output_node, "out_file")
 
     return workflow
 
@@ -651,6 +797,7 @@ def build_butterworth_filter_workflow(
     order: float = None,
     in_file: os.PathLike = None,
     out_file: os.PathLike = None,
+    mask_file: os.PathLike = None,
     base_dir: os.PathLike = None,
     crashdump_dir: os.PathLike = None,
 ):
@@ -668,6 +815,8 @@ def build_butterworth_filter_workflow(
     butterworth_node = pe.Node(
         ButterworthFilter(hp=hp, lp=lp, order=order, tr=tr), name="butterworth_filter"
     )
+    if mask_file:
+        butterworth_node.inputs.mask_file = mask_file
 
     # Set WF inputs and outputs
     if in_file:
@@ -930,6 +1079,169 @@ def build_confound_regression_afni_3dTproject(
     return workflow
 
 
+def build_confound_regression_native_qr_workflow(
+    in_file: os.PathLike = None,
+    out_file: os.PathLike = None,
+    confounds_file: os.PathLike = None,
+    mask_file: os.PathLike = None,
+    base_dir: os.PathLike = None,
+    crashdump_dir: os.PathLike = None,
+):
+    """Builds a workflow to regress confounds out of an image in Python.
+
+    Fits the same model as the 3dTproject implementation (an intercept plus the
+    confounds, with the voxel mean added back) but needs no AFNI or FSL and writes
+    no intermediate images. Scrubbed (NaN) timepoints are left out of the fit.
+
+    Unlike the 3dTproject implementation, which sets voxels outside the mask to
+    their mean over time, this implementation sets them to 0.
+
+    Returns:
+        pe.Workflow: A confound regression workflow.
+    """
+    workflow = pe.Workflow(
+        name=f"{STEP_CONFOUND_REGRESSION}_{IMPLEMENTATION_NATIVE_QR}",
+        base_dir=base_dir,
+    )
+    if crashdump_dir is not None:
+        workflow.config["execution"]["crashdump_dir"] = crashdump_dir
+
+    input_node = pe.Node(
+        IdentityInterface(
+            fields=["in_file", "out_file", "confounds_file", "mask_file"],
+            mandatory_inputs=False,
+        ),
+        name="inputnode",
+    )
+    output_node = pe.Node(
+        IdentityInterface(fields=["out_file"], mandatory_inputs=True), name="outputnode"
+    )
+
+    # Set WF inputs and outputs
+    if in_file:
+        input_node.inputs.in_file = in_file
+    if out_file:
+        input_node.inputs.out_file = out_file
+    if confounds_file:
+        input_node.inputs.confounds_file = confounds_file
+
+    regressor_node = pe.Node(ConfoundRegression(), name="confound_regression")
+
+    workflow.connect(input_node, "in_file", regressor_node, "in_file")
+    workflow.connect(input_node, "out_file", regressor_node, "out_file")
+    workflow.connect(input_node, "confounds_file", regressor_node, "confounds_file")
+    workflow.connect(regressor_node, "out_file", output_node, "out_file")
+
+    if mask_file:
+        input_node.inputs.mask_file = mask_file
+        workflow.connect(input_node, "mask_file", regressor_node, "mask_file")
+
+    return workflow
+
+
+def build_beta_series_native_lss_workflow(
+    in_file: os.PathLike = None,
+    out_file: os.PathLike = None,
+    events_file: os.PathLike = None,
+    confounds_file: os.PathLike = None,
+    tr: float = None,
+    exclude_trial_types: list = None,
+    mask_file: os.PathLike = None,
+    timeline_steps: list = None,
+    trim_from_beginning: int = 0,
+    trim_from_end: int = 0,
+    scrub_vector: list = None,
+    filtering_high_pass: float = -1,
+    filtering_low_pass: float = -1,
+    filtering_order: float = 2,
+    base_dir: os.PathLike = None,
+    crashdump_dir: os.PathLike = None,
+):
+    """Builds a workflow to estimate a least squares - separate beta series.
+
+    The output image has one volume per trial of the events file, holding that
+    trial's betas. Each trial is modelled against the sum of the other trials and
+    the confounds, with all trials solved together.
+
+    The trial design is built on the image's original timeline. Any trimming,
+    volume removal or Butterworth filtering already applied to the image is listed
+    in timeline_steps, in order, and applied to the design the same way.
+
+    Returns:
+        pe.Workflow: A beta series workflow.
+    """
+    workflow = pe.Workflow(
+        name=f"{STEP_BETA_SERIES}_{IMPLEMENTATION_NATIVE_LSS}",
+        base_dir=base_dir,
+    )
+    if crashdump_dir is not None:
+        workflow.config["execution"]["crashdump_dir"] = crashdump_dir
+
+    input_node = pe.Node(
+        IdentityInterface(
+            fields=[
+                "in_file",
+                "out_file",
+                "events_file",
+                "confounds_file",
+                "tr",
+                "mask_file",
+                "scrub_vector",
+            ],
+            mandatory_inputs=False,
+        ),
+        name="inputnode",
+    )
+    output_node = pe.Node(
+        IdentityInterface(fields=["out_file", "events_file"], mandatory_inputs=False),
+        name="outputnode",
+    )
+
+    # Set WF inputs and outputs
+    if in_file:
+        input_node.inputs.in_file = in_file
+    if out_file:
+        input_node.inputs.out_file = out_file
+    if events_file:
+        input_node.inputs.events_file = events_file
+    if tr:
+        input_node.inputs.tr = tr
+
+    beta_series_node = pe.Node(BetaSeriesLSS(), name="beta_series_lss")
+    if exclude_trial_types:
+        beta_series_node.inputs.exclude_trial_types = list(exclude_trial_types)
+    if timeline_steps:
+        beta_series_node.inputs.timeline_steps = list(timeline_steps)
+        beta_series_node.inputs.trim_from_beginning = trim_from_beginning
+        beta_series_node.inputs.trim_from_end = trim_from_end
+        beta_series_node.inputs.filtering_high_pass = filtering_high_pass
+        beta_series_node.inputs.filtering_low_pass = filtering_low_pass
+        beta_series_node.inputs.filtering_order = filtering_order
+
+    workflow.connect(input_node, "in_file", beta_series_node, "in_file")
+    workflow.connect(input_node, "out_file", beta_series_node, "out_file")
+    workflow.connect(input_node, "events_file", beta_series_node, "events_file")
+    workflow.connect(input_node, "tr", beta_series_node, "tr")
+    workflow.connect(beta_series_node, "out_file", output_node, "out_file")
+    workflow.connect(beta_series_node, "events_file", output_node, "events_file")
+
+    # Without confounds, trials are modelled with an intercept only
+    if confounds_file:
+        input_node.inputs.confounds_file = confounds_file
+    workflow.connect(input_node, "confounds_file", beta_series_node, "confounds_file")
+
+    if mask_file:
+        input_node.inputs.mask_file = mask_file
+        workflow.connect(input_node, "mask_file", beta_series_node, "mask_file")
+
+    if timeline_steps and STEP_SCRUB_TIMEPOINTS in timeline_steps:
+        if scrub_vector:
+            input_node.inputs.scrub_vector = scrub_vector
+        workflow.connect(input_node, "scrub_vector", beta_series_node, "scrub_vector")
+
+    return workflow
+
+
 def build_aroma_workflow_fsl_regfilt(
     in_file: os.PathLike = None,
     out_file: os.PathLike = None,
@@ -1043,6 +1355,65 @@ def build_aroma_workflow_fsl_regfilt_R(
     return workflow
 
 
+def build_aroma_workflow_native_regfilt(
+    in_file: os.PathLike = None,
+    out_file: os.PathLike = None,
+    mixing_file: os.PathLike = None,
+    noise_file: os.PathLike = None,
+    mask_file: os.PathLike = None,
+    base_dir: os.PathLike = None,
+    crashdump_dir: os.PathLike = None,
+):
+    """Builds a workflow for non-aggressive AROMA regression in Python.
+
+    Computes the same partial regression as fsl_regfilt.R without starting R or
+    fitting each voxel separately.
+
+    Returns:
+        pe.Workflow: An AROMA regression workflow.
+    """
+    workflow = pe.Workflow(
+        name=f"{STEP_AROMA_REGRESSION}_{IMPLEMENTATION_NATIVE_REGFILT}",
+        base_dir=base_dir,
+    )
+    if crashdump_dir is not None:
+        workflow.config["execution"]["crashdump_dir"] = crashdump_dir
+
+    input_node = pe.Node(
+        IdentityInterface(
+            fields=["in_file", "out_file", "mixing_file", "noise_file", "mask_file"],
+            mandatory_inputs=False,
+        ),
+        name="inputnode",
+    )
+    output_node = pe.Node(
+        IdentityInterface(fields=["out_file"], mandatory_inputs=True), name="outputnode"
+    )
+
+    regfilt_node = pe.Node(RegressAroma(), name="native_regfilt")
+
+    # Set WF inputs and outputs
+    if in_file:
+        input_node.inputs.in_file = in_file
+    if mixing_file:
+        input_node.inputs.mixing_file = mixing_file
+    if noise_file:
+        input_node.inputs.noise_file = noise_file
+    if out_file:
+        input_node.inputs.out_file = out_file
+    if mask_file:
+        input_node.inputs.mask_file = mask_file
+        workflow.connect(input_node, "mask_file", regfilt_node, "mask_file")
+
+    workflow.connect(input_node, "in_file", regfilt_node, "in_file")
+    workflow.connect(input_node, "out_file", regfilt_node, "out_file")
+    workflow.connect(input_node, "mixing_file", regfilt_node, "mixing_file")
+    workflow.connect(input_node, "noise_file", regfilt_node, "noise_file")
+    workflow.connect(regfilt_node, "out_file", output_node, "out_file")
+
+    return workflow
+
+
 def build_apply_mask_workflow(
     in_file: os.PathLike = None,
     out_file: os.PathLike = None,
@@ -1121,6 +1492,11 @@ def build_scrubbing_workflow(
     insert_na=True,
     import_path: os.PathLike = None,
     export_path: os.PathLike = None,
+    interpolation: str = INTERPOLATION_NONE,
+    tr: float = None,
+    oversampling_freq: int = 8,
+    percent_freq_sample: float = 1,
+    bin_size: int = 5000,
     base_dir: os.PathLike = None,
     crashdump_dir: os.PathLike = None,
 ):
@@ -1130,6 +1506,22 @@ def build_scrubbing_workflow(
     if crashdump_dir is not None:
         workflow.config["execution"]["crashdump_dir"] = crashdump_dir
 
+    if interpolation == INTERPOLATION_SPECTRAL:
+        return _build_spectral_interpolation_workflow(
+            workflow,
+            scrub_vector=scrub_vector,
+            import_path=import_path,
+            export_path=export_path,
+            tr=tr,
+            oversampling_freq=oversampling_freq,
+            percent_freq_sample=percent_freq_sample,
+            bin_size=bin_size,
+        )
+    elif interpolation not in (None, INTERPOLATION_NONE):
+        raise ImplementationNotFoundError(
+            f"{STEP_SCRUB_TIMEPOINTS} interpolation not found: {interpolation}"
+        )
+
     # Setup identity (pass through) input/output nodes
     input_node = pe.Node(
         IdentityInterface(
@@ -1167,6 +1559,67 @@ def build_scrubbing_workflow(
     return workflow
 
 
+def _build_spectral_interpolation_workflow(
+    workflow: pe.Workflow,
+    scrub_vector: list = None,
+    import_path: os.PathLike = None,
+    export_path: os.PathLike = None,
+    tr: float = None,
+    oversampling_freq: int = 8,
+    percent_freq_sample: float = 1,
+    bin_size: int = 5000,
+):
+    if not tr:
+        raise ValueError(
+            f"{STEP_SCRUB_TIMEPOINTS}: Missing TR for spectral interpolation."
+        )
+
+    input_node = pe.Node(
+        IdentityInterface(
+            fields=["in_file", "out_file", "scrub_vector"],
+            mandatory_inputs=False,
+        ),
+        name="inputnode",
+    )
+    output_node = build_output_node()
+
+    interpolate_node = pe.Node(
+        Function(
+            input_names=[
+                "nii_file",
+                "scrub_vector",
+                "tr",
+                "oversampling_freq",
+                "percent_freq_sample",
+                "bin_size",
+                "export_path",
+            ],
+            output_names=["out_file"],
+            function=interpolate_image,
+        ),
+        name="interpolate_timepoints",
+    )
+    interpolate_node.inputs.tr = tr
+    interpolate_node.inputs.oversampling_freq = oversampling_freq
+    interpolate_node.inputs.percent_freq_sample = percent_freq_sample
+    interpolate_node.inputs.bin_size = bin_size
+
+    # Set WF inputs and outputs
+    if import_path:
+        input_node.inputs.in_file = import_path
+    if export_path:
+        input_node.inputs.out_file = export_path
+    if scrub_vector:
+        input_node.inputs.scrub_vector = scrub_vector
+
+    workflow.connect(input_node, "in_file", interpolate_node, "nii_file")
+    workflow.connect(input_node, "scrub_vector", interpolate_node, "scrub_vector")
+    workflow.connect(input_node, "out_file", interpolate_node, "export_path")
+    workflow.connect(interpolate_node, "out_file", output_node, "out_file")
+
+    return workflow
+
+
 def build_resample_workflow(
     reference_image: os.PathLike = None,
     in_file: os.PathLike = None,
@@ -16,7 +16,22 @@ import nipype.pipeline.engine as pe
 from nipype.interfaces.utility import IdentityInterface
 from nipype.interfaces.base.traits_extension import isdefined
 
-from clpipe.postprocutils.utils import apply_filter, calc_filter
+from clpipe.postprocutils.utils import (
+    apply_filter_chunked,
+    calc_filter,
+    load_confounds_matrix,
+    load_image_matrix,
+    load_mask_vector,
+    save_image_matrix,
+    regress_confounds_chunked,
+    regress_aroma_chunked,
+    split_spike_regressors,
+    lss_beta_series,
+    build_trial_design,
+    align_trial_design,
+    get_scrub_targets,
+    DEFAULT_FILTER_CHUNK_SIZE,
+)
 
 
 def build_input_node():
@@ -32,6 +47,29 @@ def build_output_node():
     )
 
 
+def _load_voxel_data(in_file, mask_file):
+    """Load an image as a Fortran ordered voxels x time matrix for a native node.
+
+    Returns:
+        Tuple: The data matrix, the indexes of the voxels inside the mask or None
+            if no mask is defined, and the image info needed to save the matrix.
+    """
+    voxel_data, spatial_shape, affine, header = load_image_matrix(in_file, order="F")
+
+    voxel_index = None
+    if isdefined(mask_file):
+        mask = load_mask_vector(mask_file, spatial_shape, order="F")
+        voxel_index = np.flatnonzero(mask)
+
+    return voxel_data, voxel_index, (spatial_shape, affine, header)
+
+
+def _save_voxel_data(voxel_data, image_info, out_file):
+    """Save a matrix loaded with _load_voxel_data as an image."""
+    spatial_shape, affine, header = image_info
+    save_image_matrix(voxel_data, spatial_shape, affine, header, out_file, order="F")
+
+
 class ButterworthFilterInputSpec(BaseInterfaceInputSpec):
     in_file = File(exists=True, desc="Image to be normalized", mandatory=False)
     hp = traits.Float(
@@ -42,6 +80,16 @@ class ButterworthFilterInputSpec(BaseInterfaceInputSpec):
     )
     tr = traits.Float(desc="Repetition time.", mandatory=True)
     order = traits.Float(desc="Order of the filter", mandatory=True)
+    mask_file = File(
+        exists=True,
+        desc="Only voxels inside this mask are filtered",
+        mandatory=False,
+    )
+    chunk_size = traits.Int(
+        DEFAULT_FILTER_CHUNK_SIZE,
+        usedefault=True,
+        desc="Maximum number of values (voxels x timepoints) filtered at once",
+    )
     out_file = File(mandatory=False)
 
 
@@ -55,15 +103,18 @@ class ButterworthFilter(BaseInterface):
 
     def _run_interface(self, runtime):
         fname = self.inputs.in_file
-        img = nb.load(fname)
-        data = np.array(img.get_data())
+        # Filter a float32 copy of the image in place, rather than holding
+        #   several float64 copies at once
+        voxel_data, voxel_index, image_info = _load_voxel_data(
+            fname, self.inputs.mask_file
+        )
 
         filter = calc_filter(
             self.inputs.hp, self.inputs.lp, self.inputs.tr, self.inputs.order
         )
-        filtered_data = apply_filter(filter, data)
-
-        new_img = nb.Nifti1Image(filtered_data, img.affine, img.header)
+        apply_filter_chunked(
+            filter, voxel_data, voxel_index, chunk_size=self.inputs.chunk_size
+        )
 
         if not isdefined(self.inputs.out_file):
             _, base, _ = split_filename(fname)
@@ -71,7 +122,78 @@ class ButterworthFilter(BaseInterface):
         else:
             self.new_file = self.inputs.out_file
 
-        nb.save(new_img, self.new_file)
+        _save_voxel_data(voxel_data, image_info, self.new_file)
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["out_file"] = os.path.abspath(self.new_file)
+
+        return outputs
+
+
+class ConfoundRegressionInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, desc="Image to be regressed", mandatory=False)
+    confounds_file = File(
+        exists=True,
+        desc="Confounds to regress out, one column per regressor",
+        mandatory=True,
+    )
+    mask_file = File(
+        exists=True,
+        desc="Only voxels inside this mask are regressed",
+        mandatory=False,
+    )
+    chunk_size = traits.Int(
+        DEFAULT_FILTER_CHUNK_SIZE,
+        usedefault=True,
+        desc="Maximum number of values (voxels x timepoints) regressed at once",
+    )
+    out_file = File(mandatory=False)
+
+
+class ConfoundRegressionOutputSpec(TraitedSpec):
+    out_file = File(exists=False, desc="Regressed image")
+
+
+class ConfoundRegression(BaseInterface):
+    input_spec = ConfoundRegressionInputSpec
+    output_spec = ConfoundRegressionOutputSpec
+
+    def _run_interface(self, runtime):
+        fname = self.inputs.in_file
+        voxel_data, voxel_index, image_info = _load_voxel_data(
+            fname, self.inputs.mask_file
+        )
+
+        # Voxels outside the mask are zeroed, as 3dTproject does before the mean
+        #   is added back
+        if voxel_index is not None:
+            outside_mask = np.ones(voxel_data.shape[0], dtype=bool)
+            outside_mask[voxel_index] = False
+            voxel_data[outside_mask] = 0
+
+        # Motion outlier columns are applied as spike indexes, keeping them out of
+        #   the QR decomposition
+        confounds, spike_index = split_spike_regressors(
+            load_confounds_matrix(self.inputs.confounds_file)
+        )
+        regress_confounds_chunked(
+            voxel_data,
+            confounds,
+            voxel_index,
+            chunk_size=self.inputs.chunk_size,
+            spike_index=spike_index,
+        )
+
+        if not isdefined(self.inputs.out_file):
+            _, base, _ = split_filename(fname)
+            self.new_file = base + "_regressed.nii"
+        else:
+            self.new_file = self.inputs.out_file
+
+        _save_voxel_data(voxel_data, image_info, self.new_file)
 
         return runtime
 
@@ -134,6 +256,205 @@ class RegressAromaR(CommandLine):
         return os.path.abspath(retval)
 
 
+class RegressAromaInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, desc="Image to be regressed", mandatory=True)
+    mixing_file = File(exists=True, desc="The AROMA mixing file", mandatory=True)
+    noise_file = File(exists=True, desc="The AROMA noise file", mandatory=True)
+    mask_file = File(
+        exists=True,
+        desc="Only voxels inside this mask are regressed",
+        mandatory=False,
+    )
+    chunk_size = traits.Int(
+        DEFAULT_FILTER_CHUNK_SIZE,
+        usedefault=True,
+        desc="Maximum number of values (voxels x timepoints) regressed at once",
+    )
+    out_file = File(mandatory=False)
+
+
+class RegressAromaOutputSpec(TraitedSpec):
+    out_file = File(exists=False, desc="Regressed image")
+
+
+class RegressAroma(BaseInterface):
+    input_spec = RegressAromaInputSpec
+    output_spec = RegressAromaOutputSpec
+
+    def _run_interface(self, runtime):
+        fname = self.inputs.in_file
+        voxel_data, voxel_index, image_info = _load_voxel_data(
+            fname, self.inputs.mask_file
+        )
+
+        mixing = np.loadtxt(self.inputs.mixing_file, ndmin=2)
+        noise_ics = np.loadtxt(
+            self.inputs.noise_file, delimiter=",", dtype=np.int64, ndmin=1
+        )
+        regress_aroma_chunked(
+            voxel_data,
+            mixing,
+            noise_ics,
+            voxel_index,
+            chunk_size=self.inputs.chunk_size,
+        )
+
+        if not isdefined(self.inputs.out_file):
+            _, base, _ = split_filename(fname)
+            self.new_file = base + "_AROMAregressed.nii"
+        else:
+            self.new_file = self.inputs.out_file
+
+        _save_voxel_data(voxel_data, image_info, self.new_file)
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["out_file"] = os.path.abspath(self.new_file)
+
+        return outputs
+
+
+class BetaSeriesLSSInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, desc="Image to estimate betas from", mandatory=True)
+    events_file = File(exists=True, desc="The image's BIDS events file", mandatory=True)
+    tr = traits.Float(desc="Repetition time of the image", mandatory=True)
+    confounds_file = File(
+        exists=True,
+        desc="Nuisance regressors shared by every trial's model",
+        mandatory=False,
+    )
+    mask_file = File(
+        exists=True,
+        desc="Only voxels inside this mask are estimated",
+        mandatory=False,
+    )
+    exclude_trial_types = traits.List(
+        traits.Str, desc="Trial types left out of the beta series", mandatory=False
+    )
+    chunk_size = traits.Int(
+        DEFAULT_FILTER_CHUNK_SIZE,
+        usedefault=True,
+        desc="Maximum number of values (voxels x timepoints) estimated at once",
+    )
+    timeline_steps = traits.List(
+        traits.Str,
+        desc=(
+            "Steps run on the image before the beta series that changed its "
+            "timeline, in order, to replay on the trial design"
+        ),
+        mandatory=False,
+    )
+    trim_from_beginning = traits.Int(
+        0, usedefault=True, desc="Volumes trimmed from the beginning"
+    )
+    trim_from_end = traits.Int(0, usedefault=True, desc="Volumes trimmed from the end")
+    scrub_vector = traits.List(
+        traits.Int, desc="1 for each volume removed by scrubbing", mandatory=False
+    )
+    filtering_high_pass = traits.Float(
+        -1, usedefault=True, desc="High-pass cutoff of the temporal filter"
+    )
+    filtering_low_pass = traits.Float(
+        -1, usedefault=True, desc="Low-pass cutoff of the temporal filter"
+    )
+    filtering_order = traits.Float(
+        2, usedefault=True, desc="Order of the temporal filter"
+    )
+    out_file = File(mandatory=False)
+
+
+class BetaSeriesLSSOutputSpec(TraitedSpec):
+    out_file = File(exists=False, desc="Beta series image, one volume per trial")
+    events_file = File(exists=False, desc="The events used, in volume order")
+
+
+class BetaSeriesLSS(BaseInterface):
+    input_spec = BetaSeriesLSSInputSpec
+    output_spec = BetaSeriesLSSOutputSpec
+
+    def _run_interface(self, runtime):
+        fname = self.inputs.in_file
+        voxel_data, voxel_index, image_info = _load_voxel_data(
+            fname, self.inputs.mask_file
+        )
+        n_timepoints = voxel_data.shape[1]
+
+        confounds, spike_index = None, None
+        if isdefined(self.inputs.confounds_file):
+            confounds, spike_index = split_spike_regressors(
+                load_confounds_matrix(self.inputs.confounds_file)
+            )
+
+        exclude_trial_types = None
+        if isdefined(self.inputs.exclude_trial_types):
+            exclude_trial_types = self.inputs.exclude_trial_types
+        timeline_steps = []
+        if isdefined(self.inputs.timeline_steps):
+            timeline_steps = self.inputs.timeline_steps
+        scrub_vector = None
+        if isdefined(self.inputs.scrub_vector):
+            scrub_vector = self.inputs.scrub_vector
+
+        # Build the design on the image's original timeline, then put it through
+        #   the same trimming, volume removal and filtering as the image
+        original_timepoints = n_timepoints
+        if "TrimTimepoints" in timeline_steps:
+            original_timepoints += (
+                self.inputs.trim_from_beginning + self.inputs.trim_from_end
+            )
+        if "ScrubTimepoints" in timeline_steps:
+            original_timepoints += len(get_scrub_targets(scrub_vector))
+        ev_matrix, events = build_trial_design(
+            self.inputs.events_file,
+            self.inputs.tr,
+            original_timepoints,
+            exclude_trial_types=exclude_trial_types,
+        )
+        ev_matrix = align_trial_design(
+            ev_matrix,
+            timeline_steps,
+            tr=self.inputs.tr,
+            trim_from_beginning=self.inputs.trim_from_beginning,
+            trim_from_end=self.inputs.trim_from_end,
+            scrub_vector=scrub_vector,
+            filtering_high_pass=self.inputs.filtering_high_pass,
+            filtering_low_pass=self.inputs.filtering_low_pass,
+            filtering_order=self.inputs.filtering_order,
+        )
+
+        betas = lss_beta_series(
+            voxel_data,
+            ev_matrix,
+            confounds,
+            voxel_index,
+            chunk_size=self.inputs.chunk_size,
+            spike_index=spike_index,
+        )
+
+        if not isdefined(self.inputs.out_file):
+            _, base, _ = split_filename(fname)
+            self.new_file = base + "_betaseries.nii"
+        else:
+            self.new_file = self.inputs.out_file
+        _save_voxel_data(betas, image_info, self.new_file)
+
+        # Record which trial each volume holds, next to the beta series
+        path, base, _ = split_filename(self.new_file)
+        self.events_file = os.path.join(path, base + "_usedevents.tsv")
+        events.to_csv(self.events_file, sep="\t", index=False, na_rep="n/a")
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["out_file"] = os.path.abspath(self.new_file)
+        outputs["events_file"] = os.path.abspath(self.events_file)
+
+        return outputs
+
+
 class ImageSliceInputSpec(BaseInterfaceInputSpec):
     in_file = File(exists=True, desc="Image to be sliced", mandatory=False)
     trim_from_beginning = traits.Int(
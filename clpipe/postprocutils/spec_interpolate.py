@@ -1,72 +1,87 @@
 import numpy
 import math
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
+DEFAULT_OVERSAMPLING_FREQ = 8
+DEFAULT_PERCENT_FREQ_SAMPLE = 1
+DEFAULT_BIN_SIZE = 5000
 
-def spec_inter(arr, tr, ofreq, scrub_mask, hifreq, binSize):
+
+def spec_inter(arr, tr, ofreq, scrub_mask, hifreq, binSize, n_threads=1):
+    """Replace scrubbed timepoints with a spectral (Lomb-Scargle) interpolation
+    fit to the unscrubbed timepoints.
+
+    The sine and cosine bases depend only on the scrub mask, so they are built once
+    and folded into a single (timepoints x good timepoints) reconstruction matrix.
+    Each bin of voxels then costs one matrix product.
+
+    Args:
+        arr (np.ndarray): A 2D (timepoints, voxels) data matrix.
+        tr (float): The repetition time.
+        ofreq (int): The oversampling frequency.
+        scrub_mask (list): 1 for each timepoint to replace, 0 otherwise.
+        hifreq (float): The highest frequency to sample, as a fraction of the
+            Nyquist frequency of the unscrubbed timepoints.
+        binSize (int): The number of voxels reconstructed at once.
+        n_threads (int, optional): The number of bins reconstructed in parallel.
+            Defaults to 1.
+
+    Returns:
+        np.ndarray: A copy of arr with the scrubbed timepoints replaced.
+    """
     scrub_mask = numpy.asarray(scrub_mask)
-    goodtpindex = numpy.asarray([[i for i, e in enumerate(scrub_mask) if e == 0]])
-    badtpindex = numpy.asarray([[i for i, e in enumerate(scrub_mask) if e == 1]])
+    goodtpindex = numpy.flatnonzero(scrub_mask == 0)
+    badtpindex = numpy.flatnonzero(scrub_mask == 1)
     tobs_good = (goodtpindex + 1) * tr
     timespan = tobs_good.max() - tobs_good.min()
     tpobs_all = numpy.arange(tr, tr * float(scrub_mask.shape[0] + 1), tr)
     freq = numpy.arange(
         1 / (timespan * ofreq),
-        hifreq * tobs_good.shape[1] / (2 * timespan) + 1 / (timespan * ofreq),
+        hifreq * tobs_good.shape[0] / (2 * timespan) + 1 / (timespan * ofreq),
         1 / (timespan * ofreq),
-    )[numpy.newaxis]
+    )
     freqang = 2.0 * math.pi * freq
     offsets = numpy.arctan2(
-        numpy.sin(numpy.matmul(numpy.transpose(2 * freqang), tobs_good)).sum(1),
-        numpy.cos(numpy.matmul(numpy.transpose(2 * freqang), tobs_good)).sum(1),
+        numpy.sin(numpy.outer(2 * freqang, tobs_good)).sum(1),
+        numpy.cos(numpy.outer(2 * freqang, tobs_good)).sum(1),
     ) / (2 * freqang)
-    costerm = numpy.cos(
-        numpy.matmul(numpy.transpose(freqang), tobs_good) - (offsets * freqang).T
-    )
-    sinterm = numpy.sin(
-        numpy.matmul(numpy.transpose(freqang), tobs_good) - (offsets * freqang).T
-    )
-    totbins = math.ceil(float(arr.shape[1]) / float(binSize))
-    binnedRecon = []
-    for bin in range(0, totbins):
+    phase = numpy.outer(freqang, tobs_good) - (offsets * freqang)[:, numpy.newaxis]
+    costerm = numpy.cos(phase)
+    sinterm = numpy.sin(phase)
+
+    # Fold the least squares denominators and the reconstruction basis into one
+    #   projection from the good timepoints onto every timepoint
+    freqRep = numpy.outer(tpobs_all, freqang)
+    cos_t = numpy.cos(freqRep) / numpy.power(costerm, 2).sum(axis=1)
+    sin_t = numpy.sin(freqRep) / numpy.power(sinterm, 2).sum(axis=1)
+    projection = cos_t @ costerm + sin_t @ sinterm
+
+    n_voxels = arr.shape[1]
+    totbins = math.ceil(float(n_voxels) / float(binSize))
+    recon = numpy.empty((tpobs_all.shape[0], n_voxels))
+
+    def reconstruct_bin(bin):
         logging.debug("Bin " + str(bin) + " out of " + str(totbins))
-        binVox = numpy.arange(bin * binSize, (bin + 1) * binSize, 1)
-        binVox = numpy.delete(
-            binVox, [i for i, e in enumerate(binVox) if e >= arr.shape[1]]
-        )
-        gooddata = arr[goodtpindex.T, binVox]
-        cosMultTemp = [
-            numpy.matmul(costerm[:, i][numpy.newaxis].T, gooddata[i, :][numpy.newaxis])
-            for i in range(0, tobs_good.shape[1])
-        ]
-        cosmult = numpy.dstack(cosMultTemp)
-        num = cosmult.sum(axis=2)
-        dem = (numpy.power(costerm, 2)).sum(axis=1)[numpy.newaxis].T
-        cosine = num / dem
-        sinMultTemp = [
-            numpy.matmul(sinterm[:, i][numpy.newaxis].T, gooddata[i, :][numpy.newaxis])
-            for i in range(0, tobs_good.shape[1])
-        ]
-        sinmult = numpy.dstack(sinMultTemp)
-        num = sinmult.sum(axis=2)
-        dem = (numpy.power(sinterm, 2)).sum(axis=1)[numpy.newaxis].T
-        sine = num / dem
-        freqRep = numpy.dstack([freqang * tp for tp in tpobs_all])[0, :, :].T
-        sin_t = numpy.sin(freqRep)
-        cos_t = numpy.cos(freqRep)
-        S = numpy.matmul(sin_t, sine)
-        C = numpy.matmul(cos_t, cosine)
-        temp = C + S
-        binnedRecon.append(temp)
-    recon = numpy.hstack(binnedRecon)
+        binVox = slice(bin * binSize, min((bin + 1) * binSize, n_voxels))
+        recon[:, binVox] = projection @ arr[goodtpindex, binVox]
+
+    if n_threads > 1:
+        # The matrix products release the GIL, so bins can run in parallel threads
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            list(executor.map(reconstruct_bin, range(totbins)))
+    else:
+        for bin in range(totbins):
+            reconstruct_bin(bin)
+
     recon_std = numpy.std(recon, 0, ddof=1)
-    data_std = numpy.std(arr[goodtpindex, :], 1, ddof=1)
+    data_std = numpy.std(arr[goodtpindex, :], 0, ddof=1)
     data_std[data_std == 0] = -1
     with numpy.errstate(divide="ignore", invalid="ignore"):
         cor_factor = recon_std / data_std
         recon = recon / cor_factor
     numpy.nan_to_num(recon, copy=False)
     corr_arr = numpy.copy(arr)
-    if badtpindex.shape[1] != 0:
+    if badtpindex.shape[0] != 0:
         corr_arr[badtpindex, :] = recon[badtpindex, :]
     return corr_arr
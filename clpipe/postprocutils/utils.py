@@ -7,6 +7,7 @@ from typing import List
 
 
 DEFAULT_GRAPH_STYLE = "colored"
+DEFAULT_FILTER_CHUNK_SIZE = 2**22
 
 
 def find_sub_list(sl, l):
@@ -33,44 +34,81 @@ def get_scrub_vector(fdts, fd_thres=0.3, fd_behind=1, fd_ahead=1, fd_contig=3):
     Returns:
         _type_: the fully prepared scrub target vector
     """
-    import numpy
+    import numpy as np
+    from clpipe.postprocutils.utils import get_scrub_matrix
+
+    timeseries = np.asarray(fdts, dtype=float).reshape(-1, 1)
+    scrub_matrix = get_scrub_matrix(
+        timeseries, [fd_thres], [fd_behind], [fd_ahead], [fd_contig]
+    )
+
+    return scrub_matrix[:, 0].tolist()
+
+
+def get_scrub_matrix(timeseries, thresholds, fd_behind, fd_ahead, fd_contig):
+    """Compute the scrub vectors of many timeseries at once.
 
-    # index all timepoints that exceed the threshold as the base scrub targets
-    scrubTargets = [i for i, e in enumerate(fdts) if e > fd_thres]
-
-    # Generate scrub indexes behind the base targets
-    for t in numpy.arange(0, fd_behind + 1):
-        scrubTargetsAdd = scrubTargets - t
-        scrubTargets.extend(scrubTargetsAdd)
-
-    # Generate scrub indexes ahead of the base targets
-    for t in numpy.arange(0, fd_ahead + 1):
-        scrubTargetsAdd = scrubTargets + t
-        scrubTargets.extend(scrubTargetsAdd)
-
-    # Remove duplicates by converting to a set temporarily
-    scrubTargets = list(set(scrubTargets))
-    # Remove negatives
-    scrubTargets = [e for i, e in enumerate(scrubTargets) if e >= 0]
-    # Remove items outside the bounds of the original set of indexes
-    scrubTargets = [e for i, e in enumerate(scrubTargets) if e <= len(fdts) - 1]
-    # Convert to a set again
-    # TODO: is this necessary? Duplicates already removed above
-    scrubTargets = set(scrubTargets)
-    # Create a vector of 0s representing points not to scrub
-    scrubVect = [0] * len(fdts)
-    # Populate the 0 vector with 1s representing scrub targets
-    scrubVect = [1 if i in scrubTargets else 0 for i, e in enumerate(scrubVect)]
-
-    # Ensure fd_config number of consecutive points
-    if fd_contig > 0:
-        target = [0] * fd_contig
-        contigSets = find_sub_list(target, scrubVect)
-        scrubVectTemp = [1] * len(fdts)
-        for conSet in contigSets:
-            scrubVectTemp[conSet[0] : conSet[1]] = target
-        scrubVect = scrubVectTemp
-    return scrubVect
+    Each column of the timeseries matrix is scrubbed with the threshold, behind,
+    ahead and contiguous settings at the same position in the given sequences.
+    Results match get_scrub_vector() called on each column separately.
+
+    Args:
+        timeseries (np.ndarray): A (timepoints, columns) matrix of timeseries.
+        thresholds (Sequence[float]): The cutoff threshold for each column.
+        fd_behind (Sequence[int]): How far behind each target to scrub, per column.
+        fd_ahead (Sequence[int]): How far ahead of each target to scrub, per column.
+        fd_contig (Sequence[int]): The minimum run of kept timepoints, per column.
+
+    Returns:
+        np.ndarray: A (timepoints, columns) matrix of 1s (scrub) and 0s (keep).
+    """
+    import numpy as np
+
+    timeseries = np.asarray(timeseries, dtype=float)
+    n_timepoints, n_columns = timeseries.shape
+    fd_behind = np.asarray(fd_behind, dtype=int)
+    fd_ahead = np.asarray(fd_ahead, dtype=int)
+    fd_contig = np.asarray(fd_contig, dtype=int)
+
+    # Timepoints exceeding the threshold are the base scrub targets. NaN never
+    #   exceeds the threshold.
+    with np.errstate(invalid="ignore"):
+        targets = timeseries > np.asarray(thresholds, dtype=float)
+
+    # Each pass of the original behind/ahead loops re-offset the targets already
+    #   added, so n steps reach n * (n + 1) / 2 timepoints away
+    reach_behind = fd_behind * (fd_behind + 1) // 2
+    reach_ahead = fd_ahead * (fd_ahead + 1) // 2
+
+    # Timepoint i is scrubbed if any target falls in [i - ahead, i + behind],
+    #   counted with a cumulative sum over the targets of each column
+    target_counts = np.zeros((n_timepoints + 1, n_columns), dtype=np.int64)
+    np.cumsum(targets, axis=0, out=target_counts[1:])
+    index = np.arange(n_timepoints).reshape(-1, 1)
+    window_start = np.clip(index - reach_ahead, 0, n_timepoints)
+    window_end = np.clip(index + reach_behind + 1, 0, n_timepoints)
+    scrub = np.take_along_axis(target_counts, window_end, axis=0) > np.take_along_axis(
+        target_counts, window_start, axis=0
+    )
+
+    # Runs of kept timepoints shorter than fd_contig are scrubbed as well
+    contig_columns = fd_contig > 0
+    if contig_columns.any():
+        kept = np.zeros((n_columns, n_timepoints + 2), dtype=np.int8)
+        kept[:, 1:-1] = ~scrub.T
+        edges = np.diff(kept, axis=1)
+        run_columns, run_starts = np.nonzero(edges == 1)
+        run_ends = np.nonzero(edges == -1)[1]
+
+        short_runs = (run_ends - run_starts < fd_contig[run_columns]) & contig_columns[
+            run_columns
+        ]
+        short_run_marks = np.zeros((n_columns, n_timepoints + 1), dtype=np.int64)
+        np.add.at(short_run_marks, (run_columns[short_runs], run_starts[short_runs]), 1)
+        np.add.at(short_run_marks, (run_columns[short_runs], run_ends[short_runs]), -1)
+        scrub |= (np.cumsum(short_run_marks, axis=1)[:, :-1] > 0).T
+
+    return scrub.astype(int)
 
 
 def get_scrub_vector_node(confounds_file, scrub_configs):
@@ -92,6 +130,31 @@ def get_scrub_vector_node(confounds_file, scrub_configs):
     return scrub_vector
 
 
+def get_combined_scrub_vector(confounds_file, scrub_configs):
+    """Compute the scrub vector of every scrub config in one pass over a confounds
+    file, combined with a logical or.
+
+    Target variables with wildcards (*) are expanded before scrubbing.
+    """
+    import pandas as pd
+    from clpipe.postprocutils.utils import expand_scrub_dict, get_scrub_matrix
+
+    confounds_df = pd.read_csv(confounds_file, sep="\t")
+    scrub_configs = expand_scrub_dict(confounds_file, scrub_configs)
+
+    if len(scrub_configs) == 0:
+        return [0] * len(confounds_df)
+
+    scrub_matrix = get_scrub_matrix(
+        confounds_df[[config["target_variable"] for config in scrub_configs]],
+        [config["threshold"] for config in scrub_configs],
+        [config["scrub_behind"] for config in scrub_configs],
+        [config["scrub_ahead"] for config in scrub_configs],
+        [config["scrub_contiguous"] for config in scrub_configs],
+    )
+    return scrub_matrix.any(axis=1).astype(int).tolist()
+
+
 def get_scrub_targets(scrub_vector: list):
     """Given a scrubbing vector of 1s and 0s, convert this into a list of indexes."""
 
@@ -107,42 +170,38 @@ def scrub_data(data, fdts):
 
 
 def scrub_image(nii_file, scrub_vector, insert_na=True, export_path=None):
-    """Scrub the targets from the given image."""
+    """Scrub the targets from the given image.
+
+    Works along the time axis of the image's own array, memory-mapped when the
+    image is uncompressed, so only the scrubbed volumes are touched rather than a
+    transposed float64 copy of the whole image. Removal keeps the input data type.
+    NA insertion needs a float type, so non-float images are saved as float32.
+    """
     import nibabel as nib
     import numpy as np
     from pathlib import Path
 
     from clpipe.postprocutils.utils import get_scrub_targets
 
-    image = nib.load(nii_file)
-    data = image.get_fdata()
-    affine = image.affine
-    orig_shape = data.shape
-    header = image.header
-
-    # Reorganize the data to be 2D with time on X
-    data = data.reshape((np.prod(np.shape(data)[:-1]), data.shape[-1]))
-    data = np.transpose(data)
+    # Copy-on-write mapping: writes change memory only, never the input file
+    image = nib.load(nii_file, mmap="c")
+    header = image.header.copy()
+    data = np.asanyarray(image.dataobj)
 
     # Get the scrub indexes
     scrub_targets = get_scrub_targets(scrub_vector)
     if insert_na:
+        if not np.issubdtype(header.get_data_dtype(), np.floating):
+            header.set_data_dtype(np.float32)
+            data = data.astype(np.float32)
+        elif not data.flags.writeable:
+            data = np.array(data)
         # Replace scrub targets with NA
-        data[scrub_targets, :] = np.nan
-        new_shape = orig_shape
+        data[..., scrub_targets] = np.nan
     else:
-        # Remove the scrub targets
-        data = np.delete(data, scrub_targets, axis=0)
-        new_shape = (
-            orig_shape[0],
-            orig_shape[1],
-            orig_shape[2],
-            orig_shape[3] - len(scrub_targets),
-        )
-
-    # Swap the data back to original format
-    data = np.transpose(data)
-    data = data.reshape(new_shape)
+        # Keep everything but the scrub targets
+        keep = np.setdiff1d(np.arange(data.shape[-1]), scrub_targets)
+        data = np.take(data, keep, axis=-1)
 
     if export_path is None:
         # Crude way to figure out .nii vs .nii.gz
@@ -156,12 +215,54 @@ def scrub_image(nii_file, scrub_vector, insert_na=True, export_path=None):
     else:
         out_path = export_path
 
-    out_image = nib.Nifti1Image(data, affine, header)
+    out_image = nib.Nifti1Image(data, image.affine, header)
     nib.save(out_image, out_path)
 
     return out_path
 
 
+def interpolate_image(
+    nii_file,
+    scrub_vector,
+    tr,
+    oversampling_freq=8,
+    percent_freq_sample=1,
+    bin_size=5000,
+    export_path=None,
+):
+    """Replace the scrub targets of the given image with a spectral interpolation
+    of its remaining timepoints."""
+    import nibabel as nib
+    import numpy as np
+    from pathlib import Path
+
+    from clpipe.postprocutils.spec_interpolate import spec_inter
+
+    image = nib.load(nii_file)
+    data = image.get_fdata()
+    orig_shape = data.shape
+
+    # Reorganize the data to be 2D with time on X
+    data = data.reshape((-1, orig_shape[-1])).T
+    data = spec_inter(
+        data, tr, oversampling_freq, scrub_vector, percent_freq_sample, bin_size
+    )
+    data = data.T.reshape(orig_shape)
+
+    if export_path is None:
+        path_stem = Path(nii_file).name.split(".")[0]
+        out_path = str(Path(path_stem + "_interpolated.nii.gz").absolute())
+    else:
+        out_path = export_path
+
+    # Interpolated values are not integers, so save as floats
+    header = image.header.copy()
+    header.set_data_dtype(np.float32)
+    nib.save(nib.Nifti1Image(data, image.affine, header), out_path)
+
+    return out_path
+
+
 def calc_filter(hp, lp, tr, order):
     from scipy.signal import butter
 
@@ -190,6 +291,411 @@ def apply_filter(sos, arr):
         return toReturn
 
 
+def apply_filter_chunked(
+    sos, data, voxel_index=None, chunk_size=DEFAULT_FILTER_CHUNK_SIZE
+):
+    """Filter a voxels-by-time matrix in place, one block of voxels at a time.
+
+    Only one block is ever held at filtering precision, so memory use beyond the
+    input matrix is bounded by chunk_size regardless of the length of the run.
+
+    Args:
+        sos: The filter, as returned by calc_filter.
+        data (np.ndarray): A 2D (voxels, timepoints) matrix, modified in place.
+        voxel_index (np.ndarray, optional): Indexes of the rows to filter. Other
+            rows are left unfiltered. Defaults to filtering every row.
+        chunk_size (int, optional): The maximum number of values (voxels x
+            timepoints) filtered at once.
+
+    Returns:
+        np.ndarray: The filtered data matrix.
+    """
+    import numpy as np
+    from scipy.signal import sosfilt
+
+    if isinstance(sos, str) and sos == "none":
+        return data
+
+    n_voxels, n_timepoints = data.shape
+    block_size = max(1, chunk_size // max(1, n_timepoints))
+
+    if voxel_index is None:
+        for start in range(0, n_voxels, block_size):
+            block = slice(start, start + block_size)
+            data[block] = sosfilt(sos, data[block], axis=1)
+    else:
+        voxel_index = np.asarray(voxel_index)
+        for start in range(0, len(voxel_index), block_size):
+            block = voxel_index[start : start + block_size]
+            data[block] = sosfilt(sos, data[block], axis=1)
+
+    return data
+
+
+def regress_confounds_chunked(
+    data,
+    confounds,
+    voxel_index=None,
+    chunk_size=DEFAULT_FILTER_CHUNK_SIZE,
+    preserve_mean=True,
+    spike_index=None,
+):
+    """Regress confounds out of a voxels-by-time matrix in place, one block of
+    voxels at a time.
+
+    The design (an intercept plus the confounds) is factored once with a thin QR
+    decomposition, so each block costs two small matrix products. Timepoints that
+    are NaN in the confounds or the data, such as volumes scrubbed with NA
+    insertion, are left out of the fit and left unchanged in the output.
+
+    Spike regressors can be given as timepoint indexes rather than as design
+    columns. A spike fits its timepoint exactly, so each one is applied by leaving
+    its timepoint out of the fit and zeroing its residual, which keeps them out of
+    the QR decomposition.
+
+    Args:
+        data (np.ndarray): A 2D (voxels, timepoints) matrix, modified in place.
+        confounds (np.ndarray): A 2D (timepoints, regressors) matrix of confounds.
+        voxel_index (np.ndarray, optional): Indexes of the rows to regress. Other
+            rows are left unchanged. Defaults to regressing every row.
+        chunk_size (int, optional): The maximum number of values (voxels x
+            timepoints) regressed at once.
+        preserve_mean (bool, optional): Add each voxel's mean back to its
+            residuals, as the 3dTproject implementation does. Defaults to True.
+        spike_index (np.ndarray, optional): Timepoint indexes of spike regressors.
+            Defaults to None.
+
+    Returns:
+        np.ndarray: The residual data matrix.
+    """
+    import numpy as np
+    from scipy.linalg import qr, solve_triangular
+
+    n_voxels, n_timepoints = data.shape
+    confounds = np.asarray(confounds, dtype=np.float64).reshape((n_timepoints, -1))
+    if voxel_index is None:
+        voxel_index = np.arange(n_voxels)
+    else:
+        voxel_index = np.asarray(voxel_index)
+    block_size = max(1, chunk_size // max(1, n_timepoints))
+
+    # Row masking: only timepoints with finite confounds and data inform the fit
+    keep = np.isfinite(confounds).all(axis=1)
+    for start in range(0, len(voxel_index), block_size):
+        block = voxel_index[start : start + block_size]
+        keep &= np.isfinite(data[block]).all(axis=0)
+    # Spike timepoints count towards the mean, but not the fit
+    finite = keep.copy()
+    spikes = np.zeros(n_timepoints, dtype=bool)
+    if spike_index is not None:
+        spikes[np.asarray(spike_index, dtype=np.int64)] = True
+        keep &= ~spikes
+    if not keep.any():
+        raise ValueError("No timepoints are available for confound regression.")
+
+    design = np.column_stack((np.ones(n_timepoints), confounds))
+    # Pivoting lets collinear regressors be dropped rather than failing the solve
+    q, r, pivots = qr(design[keep], mode="economic", pivoting=True)
+    diagonal = np.abs(np.diag(r))
+    rank = int(np.sum(diagonal > diagonal[0] * max(design.shape) * 1e-10))
+    q, r = q[:, :rank], r[:rank, :rank]
+    design = design[:, pivots[:rank]]
+
+    # Residuals are written for every timepoint with finite confounds, including
+    #   NaN timepoints in the data, which stay NaN
+    target = np.isfinite(confounds).all(axis=1)
+    for start in range(0, len(voxel_index), block_size):
+        block = voxel_index[start : start + block_size]
+        values = data[block].astype(np.float64)
+        betas = solve_triangular(r, q.T @ values[:, keep].T)
+        residuals = values[:, target] - (design[target] @ betas).T
+        residuals[:, (spikes & finite)[target]] = 0
+        if preserve_mean:
+            residuals += values[:, finite].mean(axis=1, keepdims=True)
+        values[:, target] = residuals
+        data[block] = values
+
+    return data
+
+
+def regress_aroma_chunked(
+    data, mixing, noise_ics, voxel_index=None, chunk_size=DEFAULT_FILTER_CHUNK_SIZE
+):
+    """Remove AROMA noise components from a voxels-by-time matrix in place, using
+    non-aggressive (partial) regression, one block of voxels at a time.
+
+    Every voxel is fit against all components of the mixing matrix in a single
+    least squares solve, then only the fitted contribution of the noise components
+    is subtracted. Constant voxels are left unchanged.
+
+    Args:
+        data (np.ndarray): A 2D (voxels, timepoints) matrix, modified in place.
+        mixing (np.ndarray): A 2D (timepoints, components) MELODIC mixing matrix.
+        noise_ics (list): The 1-based indexes of the noise components.
+        voxel_index (np.ndarray, optional): Indexes of the rows to regress. Other
+            rows are left unchanged. Defaults to regressing every row.
+        chunk_size (int, optional): The maximum number of values (voxels x
+            timepoints) regressed at once.
+
+    Returns:
+        np.ndarray: The denoised data matrix.
+    """
+    import numpy as np
+
+    n_voxels, n_timepoints = data.shape
+    mixing = np.asarray(mixing, dtype=np.float64).reshape((n_timepoints, -1))
+    noise_ics = np.asarray(noise_ics, dtype=np.int64).ravel() - 1
+    if voxel_index is None:
+        voxel_index = np.arange(n_voxels)
+    else:
+        voxel_index = np.asarray(voxel_index)
+    block_size = max(1, chunk_size // max(1, n_timepoints))
+
+    # The noise rows of the pseudoinverse give the noise betas of every voxel, so
+    #   the partial fit reduces to one (timepoints x timepoints) projection
+    noise_betas = np.linalg.pinv(mixing)[noise_ics]
+    noise_projection = (mixing[:, noise_ics] @ noise_betas).T
+
+    for start in range(0, len(voxel_index), block_size):
+        block = voxel_index[start : start + block_size]
+        values = data[block].astype(np.float64)
+        nonconstant = np.ptp(values, axis=1) != 0
+        values[nonconstant] -= values[nonconstant] @ noise_projection
+        data[block] = values
+
+    return data
+
+
+def lss_beta_series(
+    data,
+    ev_matrix,
+    confounds=None,
+    voxel_index=None,
+    chunk_size=DEFAULT_FILTER_CHUNK_SIZE,
+    spike_index=None,
+):
+    """Estimate a least squares - separate (LSS) beta series from a voxels-by-time
+    matrix, one block of voxels at a time.
+
+    Each trial is modelled with its own regressor, the sum of every other trial's
+    regressors, and a nuisance block (an intercept plus the confounds) shared by
+    all trials. The nuisance block is projected out of the trial regressors once,
+    which leaves a 2 column system per trial. The pseudoinverses of those systems
+    are found for all trials together from their 2x2 Gram matrices, so each block
+    of voxels costs two matrix products however many trials there are.
+
+    Timepoints that are NaN in the confounds or the data are left out of the fit,
+    as are spike timepoints.
+
+    Args:
+        data (np.ndarray): A 2D (voxels, timepoints) matrix.
+        ev_matrix (np.ndarray): A 2D (timepoints, trials) matrix with one
+            regressor per trial.
+        confounds (np.ndarray, optional): A 2D (timepoints, regressors) matrix of
+            nuisance regressors. Defaults to an intercept only.
+        voxel_index (np.ndarray, optional): Indexes of the rows to estimate. Other
+            rows are left zero. Defaults to estimating every row.
+        chunk_size (int, optional): The maximum number of values (voxels x
+            timepoints) estimated at once.
+        spike_index (np.ndarray, optional): Timepoint indexes of spike regressors.
+            Defaults to None.
+
+    Returns:
+        np.ndarray: A (voxels, trials) float32 matrix of trial betas.
+    """
+    import numpy as np
+    from scipy.linalg import qr
+
+    n_voxels, n_timepoints = data.shape
+    ev_matrix = np.asarray(ev_matrix, dtype=np.float64).reshape((n_timepoints, -1))
+    if confounds is None:
+        confounds = np.empty((n_timepoints, 0))
+    confounds = np.asarray(confounds, dtype=np.float64).reshape((n_timepoints, -1))
+    if voxel_index is None:
+        voxel_index = np.arange(n_voxels)
+    else:
+        voxel_index = np.asarray(voxel_index)
+    block_size = max(1, chunk_size // max(1, n_timepoints))
+
+    keep = np.isfinite(confounds).all(axis=1) & np.isfinite(ev_matrix).all(axis=1)
+    for start in range(0, len(voxel_index), block_size):
+        block = voxel_index[start : start + block_size]
+        keep &= np.isfinite(data[block]).all(axis=0)
+    # Excluding a spike's timepoint is equivalent to fitting its regressor
+    if spike_index is not None:
+        keep[np.asarray(spike_index, dtype=np.int64)] = False
+    if not keep.any():
+        raise ValueError("No timepoints are available for beta series estimation.")
+
+    nuisance = np.column_stack((np.ones(np.count_nonzero(keep)), confounds[keep]))
+    q, r, _ = qr(nuisance, mode="economic", pivoting=True)
+    diagonal = np.abs(np.diag(r))
+    rank = int(np.sum(diagonal > diagonal[0] * max(nuisance.shape) * 1e-10))
+    q = q[:, :rank]
+
+    # Residualized trial regressors. The other trials regressor of each trial is
+    #   the sum of all trials less its own, so every Gram matrix entry follows from
+    #   the trial and sum regressors' inner products.
+    trials = ev_matrix[keep]
+    trials -= q @ (q.T @ trials)
+    total = trials.sum(axis=1)
+    trial_ss = np.einsum("ij,ij->j", trials, trials)
+    trial_total = trials.T @ total
+    gram = np.empty((trials.shape[1], 2, 2))
+    gram[:, 0, 0] = trial_ss
+    gram[:, 0, 1] = gram[:, 1, 0] = trial_total - trial_ss
+    gram[:, 1, 1] = total @ total - 2 * trial_total + trial_ss
+    # pinv(X.T X) X.T is pinv(X), so degenerate trials, such as a lone trial with
+    #   no others, get the same minimum norm betas as a per-trial pinv
+    gram_inverse = np.linalg.pinv(gram)
+    trial_weights = gram_inverse[:, 0, 0] - gram_inverse[:, 0, 1]
+    total_weights = gram_inverse[:, 0, 1]
+
+    betas = np.zeros((n_voxels, trials.shape[1]), dtype=np.float32)
+    for start in range(0, len(voxel_index), block_size):
+        block = voxel_index[start : start + block_size]
+        values = data[block][:, keep].astype(np.float64)
+        betas[block] = (values @ trials) * trial_weights + np.outer(
+            values @ total, total_weights
+        )
+
+    return betas
+
+
+def canonical_hrf(dt, length=32.0):
+    """The canonical double gamma hemodynamic response function, sampled every dt
+    seconds and scaled to sum to 1."""
+    import numpy as np
+    from scipy.stats import gamma
+
+    times = np.arange(0, length, dt)
+    hrf = gamma.pdf(times, 6) - gamma.pdf(times, 16) / 6.0
+    return hrf / hrf.sum()
+
+
+def build_trial_design(
+    events, tr, n_timepoints, exclude_trial_types=None, oversampling=16
+):
+    """Build one HRF-convolved regressor per trial of an events file.
+
+    Each trial's boxcar lives on a grid oversampling times finer than the TR, is
+    convolved with the canonical HRF, and is sampled at the start of each volume.
+
+    A boxcar is the running sum of a +1 at its onset and a -1 at its offset, so its
+    convolution with the HRF is the difference of two shifted copies of the
+    integrated HRF. All trials are therefore built at once from a sparse
+    onset/offset matrix, evaluated only at the sampled grid points, without
+    materializing the upsampled design.
+
+    Args:
+        events (os.PathLike | pd.DataFrame): A BIDS events file or table, with
+            onset and duration columns in seconds.
+        tr (float): The repetition time.
+        n_timepoints (int): The number of volumes in the image.
+        exclude_trial_types (list, optional): Trial types left out of the design.
+            Defaults to None.
+        oversampling (int, optional): The number of grid points per TR.
+
+    Returns:
+        Tuple: A (timepoints, trials) design matrix, and the events used, in
+            column order.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if not isinstance(events, pd.DataFrame):
+        events = pd.read_csv(events, sep="\t", na_values=["n/a"])
+    if exclude_trial_types and "trial_type" in events.columns:
+        events = events[~events["trial_type"].isin(exclude_trial_types)]
+    events = events.reset_index(drop=True)
+
+    dt = tr / oversampling
+    hrf = canonical_hrf(dt)
+    # integrated_hrf[k] is the sum of the first k HRF samples
+    integrated_hrf = np.concatenate(([0.0], np.cumsum(hrf)))
+
+    onsets = events["onset"].to_numpy(dtype=float)
+    offsets = onsets + events["duration"].to_numpy(dtype=float)
+    start = np.maximum(np.floor(onsets / dt).astype(int), 0)
+    stop = np.maximum(start + 1, np.ceil(offsets / dt).astype(int))
+
+    # Upsampled grid index of each volume, against each trial's onset and offset
+    sample_index = np.arange(n_timepoints)[:, np.newaxis] * oversampling + 1
+    rise = np.clip(sample_index - start, 0, len(hrf))
+    fall = np.clip(sample_index - stop, 0, len(hrf))
+    design = integrated_hrf[rise] - integrated_hrf[fall]
+
+    return design, events
+
+
+def align_trial_design(
+    design,
+    timeline_steps,
+    tr=None,
+    trim_from_beginning=0,
+    trim_from_end=0,
+    scrub_vector=None,
+    filtering_high_pass=-1,
+    filtering_low_pass=-1,
+    filtering_order=2,
+):
+    """Apply the timeline changes made to an image to its trial design.
+
+    The design must be built on the image's original timeline. Each step is
+    replayed in order, the same way it was applied to the image, so the trial
+    regressors stay aligned with the volumes and see the same filter.
+
+    Args:
+        design (np.ndarray): A 2D (timepoints, trials) design matrix.
+        timeline_steps (list): The steps to replay, in order. One of
+            TrimTimepoints, ScrubTimepoints (volume removal) or TemporalFiltering
+            (Butterworth).
+        tr (float, optional): The repetition time, needed for filtering.
+        trim_from_beginning (int, optional): Volumes trimmed from the beginning.
+        trim_from_end (int, optional): Volumes trimmed from the end.
+        scrub_vector (list, optional): 1 for each volume removed by scrubbing.
+        filtering_high_pass (float, optional): The high-pass cutoff, or -1.
+        filtering_low_pass (float, optional): The low-pass cutoff, or -1.
+        filtering_order (int, optional): The order of the Butterworth filter.
+
+    Returns:
+        np.ndarray: The aligned design matrix.
+    """
+    import numpy as np
+
+    for step in timeline_steps:
+        if step == "TrimTimepoints":
+            design = design[trim_from_beginning : design.shape[0] - trim_from_end]
+        elif step == "ScrubTimepoints":
+            design = np.delete(design, get_scrub_targets(scrub_vector), axis=0)
+        elif step == "TemporalFiltering":
+            sos = calc_filter(
+                filtering_high_pass, filtering_low_pass, tr, filtering_order
+            )
+            design = apply_filter_chunked(sos, np.array(design.T)).T
+        else:
+            raise ValueError(f"Cannot align a trial design to step: {step}")
+
+    return design
+
+
+def load_confounds_matrix(confounds_file):
+    """Load a confounds file, with or without a header row, as a (timepoints,
+    regressors) float matrix. NA values are read as NaN."""
+    import numpy as np
+    import pandas as pd
+
+    confounds = pd.read_csv(
+        confounds_file, sep=r"\s+", header=None, na_values=["n/a", "NA"]
+    )
+    # Drop the header row, if there is one
+    first_row = pd.to_numeric(confounds.iloc[0], errors="coerce")
+    if first_row.isna().all():
+        confounds = confounds.iloc[1:]
+
+    return confounds.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+
+
 def regress(pred, target):
     import numpy
 
@@ -318,12 +824,78 @@ def matrix_to_nii(matrix, orig_shape, affine):
     return out_image
 
 
+def load_image_matrix(in_file, order="C"):
+    """Load a 4D image as a voxels-by-time float32 matrix.
+
+    With order "C" each voxel's timeseries is contiguous in memory. With order "F"
+    each volume is, which avoids copying the data of most NIfTI images.
+
+    Returns:
+        Tuple: The data matrix, the 3D spatial shape, the affine, and the header.
+    """
+    import numpy as np
+    import nibabel as nib
+
+    image = nib.load(str(in_file))
+    spatial_shape = image.shape[:3]
+    data = np.asarray(image.get_fdata(dtype=np.float32), order=order)
+    image.uncache()
+
+    return (
+        data.reshape((-1, image.shape[3]), order=order),
+        spatial_shape,
+        image.affine,
+        image.header,
+    )
+
+
+def save_image_matrix(data, spatial_shape, affine, header, out_file, order="C"):
+    """Save a voxels-by-time matrix as a float32 4D image, using the order the
+    matrix was loaded with."""
+    import numpy as np
+    import nibabel as nib
+
+    header = header.copy()
+    header.set_data_dtype(np.float32)
+    out_data = data.reshape(tuple(spatial_shape) + (data.shape[1],), order=order)
+
+    nib.save(nib.Nifti1Image(out_data, affine, header), str(out_file))
+
+
+def load_mask_vector(mask_file, spatial_shape, order="C"):
+    """Load a 3D mask as a flat boolean vector matching a data matrix's rows.
+
+    Voxels with a value above 0 are inside the mask. The order must match the one
+    used to flatten the data matrix.
+
+    Raises:
+        ValueError: If the mask's shape does not match the image's spatial shape.
+    """
+    import numpy as np
+    import nibabel as nib
+
+    mask_image = nib.load(str(mask_file))
+    if mask_image.shape[:3] != tuple(spatial_shape):
+        raise ValueError(
+            f"Mask shape {mask_image.shape[:3]} does not match image shape "
+            f"{tuple(spatial_shape)}: {mask_file}"
+        )
+    return np.asanyarray(mask_image.dataobj).reshape(-1, order=order) > 0
+
+
 def expand_columns(tsv_file, column_names):
     import pandas as pd
-    import fnmatch
+    from clpipe.postprocutils.utils import expand_column_names
 
     df = pd.read_csv(tsv_file, sep="\t")
-    column_list = df.columns
+    return expand_column_names(df.columns, column_names)
+
+
+def expand_column_names(column_list, column_names):
+    """Expand any wildcard (*) patterns in column_names against column_list."""
+    import fnmatch
+
+    column_list = list(column_list)
     expanded_columns = []
     for pattern in column_names:
         matching_columns = []
@@ -336,7 +908,8 @@ def expand_columns(tsv_file, column_names):
             # Import logger and hook into nypipe logging
             pass
         expanded_columns.extend(matching_columns)
-    return [*set(expanded_columns)]  # Removes duplicates from list
+    # Removes duplicates from list, keeping the first occurrence's position
+    return list(dict.fromkeys(expanded_columns))
 
 
 def expand_scrub_dict(tsv_file, scrub_configs):
@@ -379,15 +952,72 @@ def vector_to_txt(vector):
     return str(fname.resolve())
 
 
+def get_remaining_timepoints(
+    n_timepoints,
+    timeline_steps,
+    trim_from_beginning=0,
+    trim_from_end=0,
+    scrub_vector=None,
+):
+    """Find which of a run's original timepoints remain after its volumes are
+    trimmed or removed by scrubbing.
+
+    Args:
+        n_timepoints (int): The original number of timepoints.
+        timeline_steps (list): The steps that removed timepoints, in order. One of
+            TrimTimepoints or ScrubTimepoints (volume removal).
+        trim_from_beginning (int, optional): Timepoints trimmed from the beginning.
+        trim_from_end (int, optional): Timepoints trimmed from the end.
+        scrub_vector (list, optional): 1 for each timepoint removed by scrubbing.
+
+    Returns:
+        np.ndarray: The original indexes of the remaining timepoints.
+    """
+    import numpy as np
+
+    timepoints = np.arange(n_timepoints)
+    for step in timeline_steps:
+        if step == "TrimTimepoints":
+            end_index = len(timepoints) - trim_from_end
+            timepoints = timepoints[trim_from_beginning:end_index]
+        elif step == "ScrubTimepoints":
+            timepoints = np.delete(timepoints, get_scrub_targets(scrub_vector))
+
+    return timepoints
+
+
 def construct_motion_outliers(scrub_targets):
+    """Build one spike regressor column per scrubbed timepoint.
+
+    Args:
+        scrub_targets (list): 1 for each outlier timepoint, 0 otherwise.
+    """
     import pandas
     import numpy as np
 
-    size = sum(scrub_targets)
-    mot_outliers = pandas.DataFrame(np.zeros((len(scrub_targets), size)))
-    counter = 0
-    for ind, i in enumerate(scrub_targets):
-        if i == 1:
-            mot_outliers.iloc[ind, counter] = 1
-            counter += 1
-    return mot_outliers
+    spike_index = np.flatnonzero(np.asarray(scrub_targets) == 1)
+    mot_outliers = np.zeros((len(scrub_targets), len(spike_index)))
+    mot_outliers[spike_index, np.arange(len(spike_index))] = 1
+    return pandas.DataFrame(mot_outliers)
+
+
+def split_spike_regressors(confounds):
+    """Separate one-hot spike regressor columns from a (timepoints, regressors)
+    confounds matrix.
+
+    Returns:
+        Tuple: The confounds without spike columns, and the timepoint index of each
+        spike, as taken by regress_confounds_chunked's spike_index.
+    """
+    import numpy as np
+
+    confounds = np.asarray(confounds, dtype=np.float64)
+    finite = np.isfinite(confounds).all(axis=0)
+    is_spike = (
+        finite
+        & np.isin(confounds, (0, 1)).all(axis=0)
+        & (np.count_nonzero(confounds, axis=0) == 1)
+    )
+    spike_index = np.argmax(confounds[:, is_spike], axis=0)
+
+    return confounds[:, ~is_spike], spike_index
@@ -1,4 +1,6 @@
 import numpy as np
+import nibabel as nib
+import pandas as pd
 import warnings
 
 with warnings.catch_warnings():
@@ -7,12 +9,16 @@ with warnings.catch_warnings():
     from nilearn.input_data import NiftiLabelsMasker
     from nilearn.input_data import NiftiMapsMasker
     from nilearn.image import concat_imgs
+    from nilearn.image import resample_img
 import os
 
 import click
+import hashlib
 import json
 import glob
 import shutil
+import tempfile
+from scipy import sparse
 from .config.options import ProjectOptions
 from .job_manager import JobManagerFactory
 from pkg_resources import resource_stream, resource_filename
@@ -21,6 +27,15 @@ from .utils import get_logger, resolve_fmriprep_dir
 from pathlib import Path
 
 STEP_NAME = "roi_extraction"
+OUTPUT_FORMAT_CSV = "csv"
+OUTPUT_FORMAT_NPZ = "npz"
+OUTPUT_FORMAT_PARQUET = "parquet"
+OUTPUT_FORMATS = [OUTPUT_FORMAT_CSV, OUTPUT_FORMAT_NPZ, OUTPUT_FORMAT_PARQUET]
+CONSOLIDATED_DIR = "consolidated"
+"""Where consolidated timeseries are saved, within the ROI extraction output folder"""
+TIMEPOINT_COLUMN = "timepoint"
+ATLAS_CACHE_DIR = "atlas_cache"
+"""Where resampled atlases are cached, within the ROI extraction output folder"""
 
 
 def fmri_roi_extraction(
@@ -41,6 +56,7 @@ def fmri_roi_extraction(
     overlap_ok=None,
     debug=False,
     overwrite=False,
+    multi_atlas=None,
 ):
     config = ProjectOptions.load(config_file)
     config.load_cli_args(
@@ -53,6 +69,8 @@ def fmri_roi_extraction(
 
     logger = get_logger(STEP_NAME, debug=debug, log_dir=config.get_logs_dir())
 
+    check_output_format(config.roi_extraction.output_format)
+
     if not single:
         config_path = os.path.join(
             config.roi_extraction.output_directory, os.path.basename(config_file)
@@ -75,12 +93,14 @@ def fmri_roi_extraction(
     else:
         atlas_list = config.roi_extraction.atlases
 
+    if multi_atlas is None:
+        multi_atlas = config.roi_extraction.multi_atlas
+
     with resource_stream(__name__, "data/atlasLibrary.json") as at_lib:
         atlas_library = json.load(at_lib)
 
     atlas_names = [atlas["atlas_name"] for atlas in atlas_library["Atlases"]]
     logger.debug(atlas_names)
-    custom_radius = sphere_radius
     submission_string = (
         """clpipe roi extract -config_file={config} -atlas_name={atlas} -single"""
     )
@@ -89,6 +109,9 @@ def fmri_roi_extraction(
         "-atlas_name={atlas} -custom_atlas={custom_atlas} -custom_label={custom_labels} "
         "-custom_type={custom_type} -single"
     )
+    submission_string_multi_atlas = (
+        "clpipe roi extract -config_file={config} -multi_atlas -single"
+    )
 
     batch_manager = JobManagerFactory.get(
         batch_config=config.batch_config_path,
@@ -96,99 +119,102 @@ def fmri_roi_extraction(
         mem_use=config.roi_extraction.time_usage,
         time=config.roi_extraction.time_usage,
         threads=config.roi_extraction.n_threads,
-        email=config.email_address
+        email=config.email_address,
+        max_workers=config.max_workers
     )
-    
+
+    atlases = [
+        _resolve_atlas(
+            cur_atlas,
+            atlas_library,
+            atlas_names,
+            custom_atlas,
+            custom_label,
+            custom_type,
+            sphere_radius,
+            logger,
+        )
+        for cur_atlas in atlas_list
+    ]
+
+    job_options = ""
+    if task is not None:
+        job_options = job_options + " -task=" + task
+    if overlap_ok or config.roi_extraction.overlap_ok:
+        job_options = job_options + " -overlap_ok"
+        logger.debug("Overlap ok flag set")
+
     for subject in sublist:
         logger.debug(f"Setting up ROI extraction for subject {subject}")
-        for cur_atlas in atlas_list:
-            custom_flag = False
-            sphere_flag = False
-            if type(cur_atlas) is dict:
-                custom_flag = True
-                atlas_name = cur_atlas["atlas_name"]
-                logger.info(f"Using Custom Dict Atlas: {atlas_name}")
-                custom_atlas = cur_atlas["atlas_file"]
-                logger.debug(custom_atlas)
-                custom_label = cur_atlas["atlas_labels"]
-                logger.debug(custom_label)
-                custom_type = cur_atlas["atlas_type"]
-                logger.debug(custom_type)
-                if "sphere" in custom_type:
-                    logger.debug("Sphere flag: ON")
-                    sphere_flag = True
-                    custom_radius = cur_atlas["radius"]
-                    logger.debug(custom_radius)
-            else:
-                atlas_name = cur_atlas
-            logger.debug(atlas_name)
-            if atlas_name in atlas_names:
-                logger.debug("Found atlas name in library")
-                index = atlas_names.index(atlas_name)
-                atlas_filename = atlas_library["Atlases"][index]["atlas_file"]
-                atlas_labels = atlas_library["Atlases"][index]["atlas_labels"]
-                atlas_type = atlas_library["Atlases"][index]["atlas_type"]
-                if "sphere" in atlas_type:
-                    sphere_flag = True
-            else:
-                logger.debug("Did Not Find Atlas Name in Library")
-                custom_flag = True
-                if any(
-                    [
-                        not os.path.exists(custom_atlas),
-                        not os.path.exists(custom_label),
-                        custom_type not in ["label", "maps", "sphere"],
-                    ]
-                ):
-                    raise ValueError(
-                        "You are attempting to use a custom atlas, but have not "
-                        "specified one or more of the following: \n"
-                        "\t A custom atlas mask file (.nii or .nii.gz)"
-                        "\t A custom atlas label file (a file with information about the atlas)"
-                        "\t A custom atlas type (label, maps or spheres)"
+        if multi_atlas:
+            # Extract all atlases in one job, so each image is only loaded once
+            sub_string_temp = submission_string_multi_atlas.format(config=config_path)
+            if atlas_name is not None:
+                sub_string_temp = sub_string_temp + " -atlas_name=" + atlas_name
+                if custom_atlas is not None:
+                    sub_string_temp = (
+                        sub_string_temp
+                        + " -custom_atlas="
+                        + custom_atlas
+                        + " -custom_label="
+                        + custom_label
+                        + " -custom_type="
+                        + custom_type
                     )
-                else:
-                    atlas_filename = custom_atlas
-                    atlas_labels = custom_label
-                    atlas_type = custom_type
-                    if "sphere" in custom_type:
-                        sphere_flag = True
-            if custom_flag:
+            sub_string_temp = (
+                sub_string_temp
+                + " -sphere_radius="
+                + str(sphere_radius)
+                + job_options
+                + " "
+                + subject
+            )
+            batch_manager.add_job("ROI_extract_" + subject, sub_string_temp)
+            if single:
+                _fmri_roi_extract_subject_multi_atlas(
+                    subject,
+                    task,
+                    atlases,
+                    config,
+                    overlap_ok,
+                    overwrite,
+                    logger,
+                )
+            continue
+
+        for atlas in atlases:
+            if atlas["custom_flag"]:
                 sub_string_temp = submission_string_custom.format(
                     config=config_path,
-                    atlas=atlas_name,
-                    custom_atlas=atlas_filename,
-                    custom_labels=atlas_labels,
-                    custom_type=atlas_type,
+                    atlas=atlas["atlas_name"],
+                    custom_atlas=atlas["atlas_filename"],
+                    custom_labels=atlas["atlas_labels"],
+                    custom_type=atlas["atlas_type"],
                 )
             else:
                 sub_string_temp = submission_string.format(
                     config=config_path,
-                    atlas=atlas_name,
+                    atlas=atlas["atlas_name"],
+                )
+            if atlas["sphere_flag"]:
+                sub_string_temp = (
+                    sub_string_temp + " -sphere_radius=" + str(atlas["sphere_radius"])
                 )
-            if sphere_flag:
-                sub_string_temp = sub_string_temp + " -sphere_radius=" + custom_radius
-            if task is not None:
-                sub_string_temp = sub_string_temp + " -task=" + task
-            if overlap_ok or config.roi_extraction.overlap_ok:
-                sub_string_temp = sub_string_temp + " -overlap_ok"
-                logger.debug("Overlap ok flag set")
-
-            sub_string_temp = sub_string_temp + " " + subject
+            sub_string_temp = sub_string_temp + job_options + " " + subject
             batch_manager.add_job(
-                "ROI_extract_" + subject + "_" + atlas_name, 
-                sub_string_temp
+                "ROI_extract_" + subject + "_" + atlas["atlas_name"],
+                sub_string_temp,
             )
             if single:
                 _fmri_roi_extract_subject(
                     subject,
                     task,
-                    atlas_name,
-                    atlas_filename,
-                    atlas_labels,
-                    atlas_type,
-                    custom_radius,
-                    custom_flag,
+                    atlas["atlas_name"],
+                    atlas["atlas_filename"],
+                    atlas["atlas_labels"],
+                    atlas["atlas_type"],
+                    atlas["sphere_radius"],
+                    atlas["custom_flag"],
                     config,
                     overlap_ok,
                     overwrite,
@@ -201,6 +227,81 @@ def fmri_roi_extraction(
             click.echo(batch_manager.print_jobs())
 
 
+def _resolve_atlas(
+    cur_atlas,
+    atlas_library,
+    atlas_names,
+    custom_atlas,
+    custom_label,
+    custom_type,
+    sphere_radius,
+    logger,
+) -> dict:
+    """Look up an atlas from the configuration in the atlas library, or validate
+    it as a custom atlas."""
+    custom_flag = False
+    sphere_flag = False
+    if type(cur_atlas) is dict:
+        custom_flag = True
+        atlas_name = cur_atlas["atlas_name"]
+        logger.info(f"Using Custom Dict Atlas: {atlas_name}")
+        custom_atlas = cur_atlas["atlas_file"]
+        logger.debug(custom_atlas)
+        custom_label = cur_atlas["atlas_labels"]
+        logger.debug(custom_label)
+        custom_type = cur_atlas["atlas_type"]
+        logger.debug(custom_type)
+        if "sphere" in custom_type:
+            logger.debug("Sphere flag: ON")
+            sphere_flag = True
+            sphere_radius = cur_atlas["radius"]
+            logger.debug(sphere_radius)
+    else:
+        atlas_name = cur_atlas
+    logger.debug(atlas_name)
+    if atlas_name in atlas_names:
+        logger.debug("Found atlas name in library")
+        index = atlas_names.index(atlas_name)
+        atlas_filename = atlas_library["Atlases"][index]["atlas_file"]
+        atlas_labels = atlas_library["Atlases"][index]["atlas_labels"]
+        atlas_type = atlas_library["Atlases"][index]["atlas_type"]
+        if "sphere" in atlas_type:
+            sphere_flag = True
+    else:
+        logger.debug("Did Not Find Atlas Name in Library")
+        custom_flag = True
+        if any(
+            [
+                custom_atlas is None or not os.path.exists(custom_atlas),
+                custom_label is None or not os.path.exists(custom_label),
+                custom_type not in ["label", "maps", "sphere"],
+            ]
+        ):
+            raise ValueError(
+                "You are attempting to use a custom atlas, but have not "
+                "specified one or more of the following: \n"
+                "\t A custom atlas mask file (.nii or .nii.gz)"
+                "\t A custom atlas label file (a file with information about the atlas)"
+                "\t A custom atlas type (label, maps or spheres)"
+            )
+        else:
+            atlas_filename = custom_atlas
+            atlas_labels = custom_label
+            atlas_type = custom_type
+            if "sphere" in custom_type:
+                sphere_flag = True
+
+    return {
+        "atlas_name": atlas_name,
+        "atlas_filename": atlas_filename,
+        "atlas_labels": atlas_labels,
+        "atlas_type": atlas_type,
+        "sphere_radius": sphere_radius,
+        "custom_flag": custom_flag,
+        "sphere_flag": sphere_flag,
+    }
+
+
 def _fmri_roi_extract_subject(
     subject,
     task,
@@ -224,6 +325,90 @@ def _fmri_roi_extract_subject(
         + atlas_type
     )
 
+    atlas_path = _setup_atlas(
+        atlas_name, atlas_filename, atlas_label, custom_flag, config, logger
+    )
+    subject_files = _get_subject_files(subject, task, config, logger)
+
+    for file in subject_files:
+        fmri_roi_extract_image(
+            file,
+            config,
+            atlas_name,
+            atlas_path,
+            atlas_type,
+            sphere_radius,
+            overlap_ok,
+            overwrite,
+            logger,
+        )
+
+
+def _fmri_roi_extract_subject_multi_atlas(
+    subject,
+    task,
+    atlases,
+    config: ProjectOptions,
+    overlap_ok,
+    overwrite,
+    logger,
+):
+    """Extract every atlas for a subject, loading each image only once."""
+    logger.info(
+        "Running Subject "
+        + subject
+        + " Atlases: "
+        + ", ".join(atlas["atlas_name"] for atlas in atlases)
+    )
+
+    atlas_paths = [
+        _setup_atlas(
+            atlas["atlas_name"],
+            atlas["atlas_filename"],
+            atlas["atlas_labels"],
+            atlas["custom_flag"],
+            config,
+            logger,
+        )
+        for atlas in atlases
+    ]
+    subject_files = _get_subject_files(subject, task, config, logger)
+
+    for file in subject_files:
+        image = None
+        for atlas, atlas_path in zip(atlases, atlas_paths):
+            if _roi_timeseries_exists(file, config, atlas["atlas_name"], overwrite):
+                logger.info(
+                    f"{atlas['atlas_name']} output exists! Skipping. "
+                    "Use -overwrite to reprocess."
+                )
+                continue
+            if image is None:
+                image = load_roi_image(file)
+            fmri_roi_extract_image(
+                file,
+                config,
+                atlas["atlas_name"],
+                atlas_path,
+                atlas["atlas_type"],
+                atlas["sphere_radius"],
+                overlap_ok,
+                overwrite,
+                logger,
+                image=image,
+            )
+
+
+def load_roi_image(file) -> nib.Nifti1Image:
+    """Load an image's data once so it can be shared by several maskers.
+
+    Uncompressed images are memory-mapped rather than read into memory.
+    """
+    image = nib.load(file, mmap=True)
+    return nib.Nifti1Image(np.asanyarray(image.dataobj), image.affine, image.header)
+
+
+def _setup_atlas(atlas_name, atlas_filename, atlas_label, custom_flag, config, logger):
     if not custom_flag:
         atlas_path = resource_filename(__name__, atlas_filename)
         atlas_labelpath = resource_filename(__name__, atlas_label)
@@ -232,6 +417,17 @@ def _fmri_roi_extract_subject(
         atlas_labelpath = os.path.abspath(atlas_label)
     logger.debug(f"Using atlas path: {atlas_path}")
 
+    os.makedirs(
+        os.path.join(config.roi_extraction.output_directory, atlas_name),
+        exist_ok=True,
+    )
+    if not Path(atlas_labelpath).exists():
+        shutil.copy2(atlas_labelpath, config.roi_extraction.output_directory)
+
+    return atlas_path
+
+
+def _get_subject_files(subject, task, config: ProjectOptions, logger):
     search_string = os.path.abspath(
         os.path.join(
             config.roi_extraction.target_directory,
@@ -247,25 +443,32 @@ def _fmri_roi_extract_subject(
         subject_files = [x for x in subject_files if "task-" + task in x]
     logger.info(f"Processing subjects: {subject_files}")
 
-    os.makedirs(
-        os.path.join(config.roi_extraction.output_directory, atlas_name),
-        exist_ok=True,
-    )
-    if not Path(atlas_labelpath).exists():
-        shutil.copy2(atlas_labelpath, config.roi_extraction.output_directory)
+    return subject_files
 
-    for file in subject_files:
-        fmri_roi_extract_image(
-            file,
-            config,
-            atlas_name,
-            atlas_path,
-            atlas_type,
-            sphere_radius,
-            overlap_ok,
-            overwrite,
-            logger,
+
+def _get_file_outname(file):
+    file_outname = os.path.splitext(os.path.basename(file))[0]
+    if ".nii" in file_outname:
+        file_outname = os.path.splitext(file_outname)[0]
+    return file_outname
+
+
+def _roi_timeseries_exists(file, config: ProjectOptions, atlas_name, overwrite):
+    return (
+        os.path.exists(
+            os.path.join(
+                config.roi_extraction.output_directory,
+                atlas_name
+                + "/"
+                + _get_file_outname(file)
+                + "_atlas-"
+                + atlas_name
+                + "."
+                + config.roi_extraction.output_format,
+            )
         )
+        and not overwrite
+    )
 
 
 def fmri_roi_extract_image(
@@ -278,21 +481,19 @@ def fmri_roi_extract_image(
     overlap_ok,
     overwrite,
     logger,
+    image=None,
 ):
+    """Extract and save an image's ROI timeseries for one atlas.
+
+    An image already loaded with load_roi_image() may be given to avoid reading
+    the file again.
+    """
     logger.info(f"Processing image: {Path(file).stem}")
-    file_outname = os.path.splitext(os.path.basename(file))[0]
-    if ".nii" in file_outname:
-        file_outname = os.path.splitext(file_outname)[0]
+    file_outname = _get_file_outname(file)
+    data = image if image is not None else file
+    cache_dir = _get_atlas_cache_dir(config, atlas_type)
 
-    if (
-        os.path.exists(
-            os.path.join(
-                config.roi_extraction.output_directory,
-                atlas_name + "/" + file_outname + "_atlas-" + atlas_name + ".csv",
-            )
-        )
-        and not overwrite
-    ):
+    if _roi_timeseries_exists(file, config, atlas_name, overwrite):
         logger.info("File Exists! Skipping. Use -overwrite to reprocess.")
         return
 
@@ -309,43 +510,58 @@ def fmri_roi_extract_image(
             logger.warning(
                 "Unable to find a mask for this image. Extracting ROIs without using brain mask."
             )
-            ROI_ts = _fmri_roi_extract_image(
-                file, atlas_path, atlas_type, sphere_radius, overlap_ok, logger
+            ROI_ts, roi_labels = _fmri_roi_extract_image(
+                data,
+                atlas_path,
+                atlas_type,
+                sphere_radius,
+                overlap_ok,
+                logger,
+                cache_dir=cache_dir,
+                return_labels=True,
             )
     else:
         try:
             logger.info("Starting masked ROI extraction...")
             # Attempt to run ROI extraction with mask
-            ROI_ts = _fmri_roi_extract_image(
-                file,
+            ROI_ts, roi_labels = _fmri_roi_extract_image(
+                data,
                 atlas_path,
                 atlas_type,
                 sphere_radius,
                 overlap_ok,
                 logger,
                 mask=mask_file,
+                cache_dir=cache_dir,
+                return_labels=True,
             )
         except ValueError as ve:
             # Trigger fallback flag if any ROIs are outside of the mask region.
             logger.warning(ve.__str__() + ". Extracting ROIs without using brain mask.")
             logger.info("Starting non-masked ROI extraction...")
-            ROI_ts = _fmri_roi_extract_image(
-                file, atlas_path, atlas_type, sphere_radius, overlap_ok, logger
+            ROI_ts, roi_labels = _fmri_roi_extract_image(
+                data,
+                atlas_path,
+                atlas_type,
+                sphere_radius,
+                overlap_ok,
+                logger,
+                cache_dir=cache_dir,
+                return_labels=True,
             )
 
-        temp_mask = concat_imgs([mask_file, mask_file])
-        mask_ROIs = _fmri_roi_extract_image(
-            temp_mask, atlas_path, atlas_type, sphere_radius, overlap_ok, logger
-        )
-        mask_ROIs = np.nan_to_num(mask_ROIs)
-        logger.debug(mask_ROIs[0])
-        to_remove = [
-            ind
-            for ind, prop in np.ndenumerate(mask_ROIs[0])
-            if prop < config.roi_extraction.prop_voxels
-        ]
-        logger.debug(to_remove)
-        ROI_ts[:, to_remove] = np.nan
+        if cache_dir is not None:
+            roi_coverage = get_label_coverage(atlas_path, mask_file, cache_dir, logger)
+        else:
+            temp_mask = concat_imgs([mask_file, mask_file])
+            mask_ROIs = _fmri_roi_extract_image(
+                temp_mask, atlas_path, atlas_type, sphere_radius, overlap_ok, logger
+            )
+            roi_coverage = np.nan_to_num(mask_ROIs)[0]
+        logger.debug(roi_coverage)
+        low_coverage = roi_coverage < config.roi_extraction.prop_voxels
+        logger.debug(np.flatnonzero(low_coverage))
+        ROI_ts[:, low_coverage] = np.nan
 
         # Save ROI masked threshold timeseries
         np.savetxt(
@@ -356,30 +572,50 @@ def fmri_roi_extract_image(
                 ),
                 file_outname + "_atlas-" + atlas_name + "_voxel_prop.csv",
             ),
-            mask_ROIs[0],
+            roi_coverage,
             delimiter=",",
         )
 
     # Save the ROI timeseries
-    np.savetxt(
+    save_roi_timeseries(
+        ROI_ts,
+        roi_labels,
         os.path.join(
             os.path.join(config.roi_extraction.output_directory, atlas_name),
-            file_outname + "_atlas-" + atlas_name + ".csv",
+            file_outname + "_atlas-" + atlas_name,
         ),
-        ROI_ts,
-        delimiter=",",
+        config.roi_extraction.output_format,
+        entities=get_image_entities(file),
     )
 
     logger.info("Extraction completed.")
 
 
 def _fmri_roi_extract_image(
-    data, atlas_path, atlas_type, sphere_radius, overlap_ok, logger, mask=None
+    data,
+    atlas_path,
+    atlas_type,
+    sphere_radius,
+    overlap_ok,
+    logger,
+    mask=None,
+    cache_dir=None,
+    return_labels=False,
 ):
-    if "label" in atlas_type:
+    roi_labels = None
+    if "label" in atlas_type and cache_dir is not None:
+        logger.info("Extract type: label (cached atlas)")
+        data = _load_niimg(data)
+        resampled_atlas = get_resampled_label_atlas(
+            atlas_path, data.affine, data.shape[:3], cache_dir, logger
+        )
+        timeseries = extract_label_timeseries(data, resampled_atlas, mask=mask)
+        roi_labels = resampled_atlas["labels"]
+    elif "label" in atlas_type:
         logger.info("Extract type: label")
         label_masker = NiftiLabelsMasker(atlas_path, mask_img=mask)
         timeseries = label_masker.fit_transform(data)
+        roi_labels = getattr(label_masker, "labels_", None)
     if "sphere" in atlas_type:
         atlas_path = np.loadtxt(atlas_path)
         logger.info("Extract type: sphere")
@@ -396,9 +632,407 @@ def _fmri_roi_extract_image(
         timeseries = maps_masker.fit_transform(data)
     timeseries[timeseries == 0.0] = np.nan
 
+    if return_labels:
+        if roi_labels is None:
+            # Sphere and map ROIs are labeled by their order in the atlas
+            roi_labels = np.arange(timeseries.shape[1])
+        return timeseries, roi_labels
     return timeseries
 
 
+def get_resampled_label_atlas(
+    atlas_path, target_affine, target_shape, cache_dir, logger=None
+) -> dict:
+    """Get a label atlas resampled to an image grid, from the cache if possible.
+
+    Resampled atlases are saved in cache_dir, keyed by the atlas file's contents
+    and the target grid, so all images sharing a space and resolution reuse one
+    resampling.
+
+    Returns:
+        dict: The atlas's labels, the flat indices of its non-background voxels
+            in the target grid, and the index of each voxel's label.
+    """
+    target_shape = tuple(int(dim) for dim in target_shape)
+    key = hashlib.sha1(_hash_file(atlas_path).encode())
+    key.update(np.asarray(target_affine, dtype=np.float64).round(6).tobytes())
+    key.update(str(target_shape).encode())
+    cache_file = (
+        Path(cache_dir) / f"{_get_file_outname(atlas_path)}_{key.hexdigest()[:16]}.npz"
+    )
+
+    if cache_file.exists():
+        if logger:
+            logger.debug(f"Using cached atlas: {cache_file}")
+        with np.load(cache_file) as cached_atlas:
+            return dict(cached_atlas)
+
+    if logger:
+        logger.info(f"Resampling atlas to image grid, caching at: {cache_file}")
+    atlas_img = resample_img(
+        atlas_path,
+        target_affine=target_affine,
+        target_shape=target_shape,
+        interpolation="nearest",
+    )
+    atlas_data = np.nan_to_num(atlas_img.get_fdata(), posinf=0, neginf=0).ravel()
+
+    # Matches NiftiLabelsMasker, which keeps labels emptied by a mask
+    labels = np.unique(atlas_data)
+    labels = labels[labels != 0]
+    voxels = np.flatnonzero(atlas_data != 0)
+    resampled_atlas = {
+        "labels": labels,
+        "voxels": voxels,
+        "voxel_labels": np.searchsorted(labels, atlas_data[voxels]),
+    }
+
+    # Write to a temporary file first, as other jobs may read the cache at once
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    temp_fd, temp_path = tempfile.mkstemp(suffix=".npz", dir=cache_dir)
+    with os.fdopen(temp_fd, "wb") as temp_file:
+        np.savez(temp_file, **resampled_atlas)
+    os.replace(temp_path, cache_file)
+
+    return resampled_atlas
+
+
+def extract_label_timeseries(img, resampled_atlas: dict, mask=None) -> np.ndarray:
+    """Average an image within each label of a resampled atlas.
+
+    Only the atlas's voxels are read from the image. Voxels outside the mask are
+    excluded, and labels without any voxels get a signal of zero.
+
+    Returns:
+        np.ndarray: Signal for each label, shaped (timepoints, labels).
+    """
+    img = _load_niimg(img)
+    spatial_shape = img.shape[:3]
+    voxels = resampled_atlas["voxels"]
+    voxel_labels = resampled_atlas["voxel_labels"]
+    n_labels = len(resampled_atlas["labels"])
+
+    if mask is not None:
+        mask_data = _load_mask_vector(mask, img.affine, spatial_shape) != 0
+        if not mask_data.any():
+            raise ValueError("The mask is invalid as it is empty")
+        in_mask = mask_data[voxels]
+        voxels = voxels[in_mask]
+        voxel_labels = voxel_labels[in_mask]
+
+    data = np.asanyarray(img.dataobj)
+    if data.ndim == 3:
+        data = data[..., np.newaxis]
+    voxel_data = np.asarray(
+        data[np.unravel_index(voxels, spatial_shape)], dtype=np.float64
+    )
+    voxel_data[~np.isfinite(voxel_data)] = 0
+
+    counts = np.bincount(voxel_labels, minlength=n_labels)
+    # Every remaining voxel belongs to a label with at least one voxel
+    weights = 1.0 / counts[voxel_labels]
+    label_means = sparse.csr_matrix(
+        (weights, (voxel_labels, np.arange(len(voxels)))),
+        shape=(n_labels, len(voxels)),
+    )
+
+    return np.asarray(label_means @ voxel_data).T
+
+
+def get_label_coverage(atlas_path, mask, cache_dir, logger=None) -> np.ndarray:
+    """Get the proportion of each label's voxels that are within a mask.
+
+    The atlas is resampled to the mask's grid through the atlas cache, and each
+    label's mask values are summed with a single bincount.
+
+    Returns:
+        np.ndarray: The mean mask value within each label.
+    """
+    mask_img = _load_niimg(mask)
+    spatial_shape = mask_img.shape[:3]
+    resampled_atlas = get_resampled_label_atlas(
+        atlas_path, mask_img.affine, spatial_shape, cache_dir, logger
+    )
+    voxel_labels = resampled_atlas["voxel_labels"]
+    n_labels = len(resampled_atlas["labels"])
+
+    mask_data = _load_mask_vector(mask_img, mask_img.affine, spatial_shape)
+    mask_sums = np.bincount(
+        voxel_labels,
+        weights=mask_data[resampled_atlas["voxels"]],
+        minlength=n_labels,
+    )
+
+    return mask_sums / np.bincount(voxel_labels, minlength=n_labels)
+
+
+def _load_mask_vector(mask, target_affine, target_shape) -> np.ndarray:
+    """Load a mask as a flat vector on the target grid, resampling if needed."""
+    mask_img = _load_niimg(mask)
+    if mask_img.shape[:3] != tuple(target_shape) or not np.allclose(
+        mask_img.affine, target_affine
+    ):
+        mask_img = resample_img(
+            mask_img,
+            target_affine=target_affine,
+            target_shape=target_shape,
+            interpolation="nearest",
+        )
+    mask_data = np.asarray(np.asanyarray(mask_img.dataobj), dtype=np.float64)
+    mask_data[~np.isfinite(mask_data)] = 0
+
+    return mask_data.reshape(-1)
+
+
+def _get_atlas_cache_dir(config: ProjectOptions, atlas_type):
+    if not config.roi_extraction.atlas_cache or "label" not in atlas_type:
+        return None
+    return os.path.join(config.roi_extraction.output_directory, ATLAS_CACHE_DIR)
+
+
+def _load_niimg(img):
+    if isinstance(img, (str, os.PathLike)):
+        return nib.load(img)
+    return img
+
+
+def _hash_file(path) -> str:
+    file_hash = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def check_output_format(output_format):
+    """Check that an ROI output format is known and its dependencies are installed.
+
+    Raises:
+        ValueError: If the output format is unknown.
+        ImportError: If parquet output is chosen without pyarrow installed.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Unknown ROI output format '{output_format}'. "
+            f"Choose from: {', '.join(OUTPUT_FORMATS)}"
+        )
+    if output_format == OUTPUT_FORMAT_PARQUET:
+        try:
+            import pyarrow
+        except ImportError as err:
+            raise ImportError(
+                "The parquet ROI output format requires pyarrow. Install it with "
+                "'pip install clpipe[parquet]', or choose another output format."
+            ) from err
+
+
+def save_roi_timeseries(
+    timeseries: np.ndarray,
+    roi_labels,
+    out_path,
+    output_format=OUTPUT_FORMAT_CSV,
+    entities: dict = None,
+):
+    """Save an image's ROI timeseries in the given output format.
+
+    CSV output contains only the timeseries. NPZ and Parquet outputs also record
+    the ROI labels, as column names for Parquet, and the image's BIDS entities.
+
+    Args:
+        timeseries (np.ndarray): Signal for each ROI, shaped (timepoints, ROIs).
+        roi_labels: The label of each ROI.
+        out_path: The output path, without extension.
+        output_format (str, optional): One of csv, npz or parquet.
+            Defaults to csv.
+        entities (dict, optional): The image's BIDS entities. Defaults to None.
+
+    Returns:
+        str: The path of the saved file.
+    """
+    out_file = f"{out_path}.{output_format}"
+    roi_columns = _get_roi_columns(roi_labels)
+    entities = entities or {}
+
+    if output_format == OUTPUT_FORMAT_CSV:
+        np.savetxt(out_file, timeseries, delimiter=",")
+    elif output_format == OUTPUT_FORMAT_NPZ:
+        np.savez(
+            out_file,
+            timeseries=timeseries,
+            roi_labels=np.array(roi_columns),
+            entities=json.dumps(entities),
+        )
+    elif output_format == OUTPUT_FORMAT_PARQUET:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(
+            pd.DataFrame(timeseries, columns=roi_columns), preserve_index=False
+        )
+        table = table.replace_schema_metadata(
+            {**table.schema.metadata, b"clpipe_entities": json.dumps(entities)}
+        )
+        pq.write_table(table, out_file)
+    else:
+        raise ValueError(
+            f"Unknown ROI output format '{output_format}'. "
+            f"Choose from: {', '.join(OUTPUT_FORMATS)}"
+        )
+
+    return out_file
+
+
+def load_roi_timeseries(path) -> pd.DataFrame:
+    """Load a saved ROI timeseries with one column per ROI.
+
+    CSV outputs have no labels, so their columns are numbered in atlas order.
+    """
+    output_format = Path(path).suffix.lstrip(".")
+
+    if output_format == OUTPUT_FORMAT_CSV:
+        timeseries = np.loadtxt(path, delimiter=",", ndmin=2)
+        return pd.DataFrame(
+            timeseries, columns=_get_roi_columns(range(timeseries.shape[1]))
+        )
+    elif output_format == OUTPUT_FORMAT_NPZ:
+        with np.load(path) as roi_data:
+            return pd.DataFrame(
+                roi_data["timeseries"], columns=list(roi_data["roi_labels"])
+            )
+    elif output_format == OUTPUT_FORMAT_PARQUET:
+        return pd.read_parquet(path)
+    raise ValueError(f"Unknown ROI output format: {path}")
+
+
+def consolidate_roi_timeseries(
+    config_file=None,
+    output_dir=None,
+    atlas_name=None,
+    output_format=None,
+    debug=False,
+):
+    """Combine every run's ROI timeseries for each atlas into a study-level dataset.
+
+    Each atlas's dataset is partitioned by subject into
+    <output>/consolidated/atlas-<name>/sub-<id>.<format>. Rows are timepoints,
+    with a column for each BIDS entity of the run, the timepoint, and each ROI.
+    """
+    config = ProjectOptions.load(config_file)
+    config.roi_extraction.load_cli_args(output_directory=output_dir)
+    logger = get_logger(STEP_NAME, debug=debug, log_dir=config.get_logs_dir())
+
+    input_format = config.roi_extraction.output_format
+    if output_format is None:
+        output_format = input_format
+    check_output_format(input_format)
+    check_output_format(output_format)
+
+    if atlas_name is not None:
+        atlas_names = [atlas_name]
+    else:
+        atlas_names = [
+            atlas["atlas_name"] if type(atlas) is dict else atlas
+            for atlas in config.roi_extraction.atlases
+        ]
+
+    for atlas in atlas_names:
+        run_files = sorted(
+            glob.glob(
+                os.path.join(
+                    config.roi_extraction.output_directory,
+                    atlas,
+                    f"*_atlas-{atlas}.{input_format}",
+                )
+            )
+        )
+        if not run_files:
+            logger.warning(f"No {input_format} ROI timeseries found for: {atlas}")
+            continue
+        logger.info(f"Consolidating {len(run_files)} run(s) for atlas: {atlas}")
+
+        run_tables = []
+        entity_columns = {}
+        roi_columns = {}
+        for run_file in run_files:
+            entities = get_image_entities(run_file)
+            entities.pop("atlas", None)
+            # The consolidated dataset is partitioned by subject
+            if "sub" not in entities:
+                logger.warning(f"Skipping ROI timeseries without a subject: {run_file}")
+                continue
+            run_table = load_roi_timeseries(run_file)
+            roi_columns.update(dict.fromkeys(run_table.columns))
+            entity_columns.update(dict.fromkeys(entities))
+            run_table = run_table.assign(
+                **entities, **{TIMEPOINT_COLUMN: np.arange(len(run_table))}
+            )
+            run_tables.append(run_table)
+        if not run_tables:
+            continue
+        # Runs may not share every entity, e.g. a run or session label
+        atlas_table = pd.concat(run_tables, ignore_index=True)
+        atlas_table[list(entity_columns)] = atlas_table[list(entity_columns)].fillna("")
+        atlas_table = atlas_table[
+            list(entity_columns) + [TIMEPOINT_COLUMN] + list(roi_columns)
+        ]
+
+        atlas_dir = Path(config.roi_extraction.output_directory) / CONSOLIDATED_DIR
+        atlas_dir = atlas_dir / f"atlas-{atlas}"
+        atlas_dir.mkdir(parents=True, exist_ok=True)
+        for subject, subject_table in atlas_table.groupby("sub", sort=True):
+            out_file = _save_roi_table(
+                subject_table, atlas_dir / f"sub-{subject}", output_format
+            )
+            logger.debug(f"Saved consolidated timeseries: {out_file}")
+
+    logger.info("Consolidation completed.")
+
+
+def _save_roi_table(table: pd.DataFrame, out_path, output_format) -> str:
+    out_file = f"{out_path}.{output_format}"
+    if output_format == OUTPUT_FORMAT_CSV:
+        table.to_csv(out_file, index=False)
+    elif output_format == OUTPUT_FORMAT_NPZ:
+        roi_start = table.columns.get_loc(TIMEPOINT_COLUMN) + 1
+        np.savez(
+            out_file,
+            timeseries=table.iloc[:, roi_start:].to_numpy(),
+            roi_labels=np.array(table.columns[roi_start:], dtype=str),
+            **{
+                column: (
+                    table[column].to_numpy(dtype=str)
+                    if column != TIMEPOINT_COLUMN
+                    else table[column].to_numpy()
+                )
+                for column in table.columns[:roi_start]
+            },
+        )
+    elif output_format == OUTPUT_FORMAT_PARQUET:
+        table.to_parquet(out_file, index=False)
+    else:
+        raise ValueError(
+            f"Unknown ROI output format '{output_format}'. "
+            f"Choose from: {', '.join(OUTPUT_FORMATS)}"
+        )
+    return out_file
+
+
+def get_image_entities(file) -> dict:
+    """Parse the BIDS key-value entities from an image's file name."""
+    entities = {}
+    for part in _get_file_outname(file).split("_"):
+        key, separator, value = part.partition("-")
+        if separator:
+            entities[key] = value
+    return entities
+
+
+def _get_roi_columns(roi_labels) -> list:
+    return [
+        f"{label:g}" if not isinstance(label, str) else label for label in roi_labels
+    ]
+
+
 def get_available_atlases():
     with resource_stream(__name__, "data/atlasLibrary.json") as at_lib:
         atlas_library = json.load(at_lib)
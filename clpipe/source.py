@@ -46,7 +46,8 @@ def flywheel_sync(
         debug=debug,
         mem_use=options.source.mem_usage,
         time=options.source.time_usage,
-        threads=options.source.core_usage
+        threads=options.source.core_usage,
+        max_workers=options.max_workers
         )
 
     logger.debug(f"Using dropoff directory: {options.source.dropoff_directory}")
@@ -18,6 +18,7 @@ if __name__ == "__main__":
             license=LICENSE,
             python_requires=PYTHON_REQUIRES,
             install_requires=INSTALL_REQUIRES,
+            extras_require=EXTRAS_REQUIRE,
             include_package_data=True,
             packages=find_packages(),
             package_data=PACKAGE_DATA,
@@ -1,4 +1,6 @@
 import pytest
+import pandas as pd
+import numpy as np
 from clpipe.config.options import ProjectOptions, ScrubColumn, ScrubTimepoints
 
 from clpipe.postprocutils.image_workflows import *
@@ -219,3 +221,130 @@ def test_prepare_confounds_aroma(
 
 def test_build_confounds_add_motion_outliers_workflow():
     pass
+
+
+def test_build_confounds_processor_workflow(
+    artifact_dir,
+    sample_confounds_timeseries,
+    sample_melodic_mixing,
+    sample_aroma_noise_ics,
+    helpers,
+    request,
+):
+    """Check that the single node processor runs the confound steps in one node."""
+
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = [
+        "AROMARegression",
+        "TemporalFiltering",
+        "ScrubTimepoints",
+    ]
+    postprocessing_config.processing_step_options.temporal_filtering.implementation = (
+        "Butterworth"
+    )
+    postprocessing_config.confound_options.columns = ["csf", "t_comp_cor*"]
+
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    out_path = test_path / "postprocessed.tsv"
+
+    wf = build_confounds_processor_workflow(
+        postprocessing_config,
+        confounds_file=sample_confounds_timeseries,
+        export_file=out_path,
+        scrub_vector=[0, 1, 0, 0, 0, 0, 1, 0, 0, 0],
+        tr=2,
+        mixing_file=sample_melodic_mixing,
+        noise_file=sample_aroma_noise_ics,
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    wf.run()
+
+    processed_df = pd.read_csv(out_path, sep="\t")
+
+    assert len(wf.list_node_names()) == 3
+    assert list(processed_df.columns[:5]) == [
+        "csf",
+        "t_comp_cor_00",
+        "t_comp_cor_01",
+        "t_comp_cor_02",
+        "t_comp_cor_03",
+    ]
+    assert processed_df["csf"].isna().tolist() == [
+        bool(scrub) for scrub in [0, 1, 0, 0, 0, 0, 1, 0, 0, 0]
+    ]
+
+
+def test_process_confounds_motion_outliers_follow_trim(
+    artifact_dir, sample_confounds_timeseries, helpers, request
+):
+    """Check that motion outlier columns stay aligned when timepoints are removed."""
+
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = ["TrimTimepoints"]
+    postprocessing_config.processing_step_options.trim_timepoints.from_beginning = 2
+    postprocessing_config.confound_options.columns = ["csf"]
+    postprocessing_config.confound_options.motion_outliers.threshold = 0.14
+
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+
+    out_path = process_confounds(
+        postprocessing_config,
+        sample_confounds_timeseries,
+        export_file=test_path / "postprocessed.tsv",
+    )
+
+    raw_df = pd.read_csv(sample_confounds_timeseries, sep="\t")
+    processed_df = pd.read_csv(out_path, sep="\t")
+    outliers = processed_df.filter(like="motion_outlier").to_numpy()
+
+    assert len(processed_df) == len(raw_df) - 2
+    assert (
+        outliers.sum(axis=1).tolist()
+        == (raw_df["framewise_displacement"][2:] > 0.14).astype(int).tolist()
+    )
+
+
+def test_confounds_processing_paths_motion_outliers_match(
+    artifact_dir, sample_confounds_timeseries, helpers, request
+):
+    """Check that the workflow and native processors emit the same confounds when
+    timepoints are trimmed and scrubbed away."""
+
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = ["TrimTimepoints", "ScrubTimepoints"]
+    step_options = postprocessing_config.processing_step_options
+    step_options.trim_timepoints.from_beginning = 1
+    step_options.scrub_timepoints.insert_na = False
+    postprocessing_config.confound_options.columns = ["csf", "white_matter"]
+    postprocessing_config.confound_options.motion_outliers.threshold = 0.14
+    scrub_vector = [0, 1, 0, 0, 0, 1, 0, 0, 0, 0]
+
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    wf_out_path = test_path / "postprocessed_wf.tsv"
+
+    wf = build_confounds_processing_workflow(
+        postprocessing_config,
+        confounds_file=sample_confounds_timeseries,
+        export_file=wf_out_path,
+        scrub_vector=scrub_vector,
+        tr=2,
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    wf.get_node("inputnode").inputs.scrub_vector = scrub_vector
+    wf.run()
+    native_out_path = process_confounds(
+        postprocessing_config,
+        sample_confounds_timeseries,
+        export_file=test_path / "postprocessed_native.tsv",
+        tr=2,
+        scrub_vector=scrub_vector,
+    )
+
+    wf_df = pd.read_csv(wf_out_path, sep="\t")
+    native_df = pd.read_csv(native_out_path, sep="\t")
+
+    assert list(wf_df.columns) == list(native_df.columns)
+    assert wf_df.filter(like="motion_outlier").shape[1] > 0
+    assert np.allclose(wf_df.to_numpy(), native_df.to_numpy(), rtol=1e-5)
@@ -0,0 +1,223 @@
+import pytest
+import numpy as np
+import nibabel as nib
+from scipy.signal import sosfilt
+
+from clpipe.config.options import ProjectOptions
+from clpipe.errors import ImplementationNotFoundError
+from clpipe.postprocutils.utils import calc_filter
+from clpipe.postprocutils.image_workflows import (
+    build_confound_regression_native_qr_workflow,
+)
+from clpipe.postprocutils.fused_engine import *
+
+
+def test_run_fused_image_postprocessing_filter_mask_trim(
+    artifact_dir, sample_raw_image, sample_raw_image_mask, helpers, request
+):
+    """Check that steps are applied in order to the in-memory image."""
+
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = [
+        "TemporalFiltering",
+        "ApplyMask",
+        "TrimTimepoints",
+    ]
+    postprocessing_config.processing_step_options.temporal_filtering.implementation = (
+        "Butterworth"
+    )
+    postprocessing_config.processing_step_options.trim_timepoints.from_beginning = 2
+    postprocessing_config.processing_step_options.trim_timepoints.from_end = 1
+
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    out_path = test_path / "postprocessed.nii.gz"
+
+    run_fused_image_postprocessing(
+        postprocessing_config,
+        in_file=sample_raw_image,
+        export_path=out_path,
+        tr=2,
+        mask_file=sample_raw_image_mask,
+    )
+
+    raw_image = nib.load(sample_raw_image)
+    out_image = nib.load(out_path)
+    out_data = out_image.get_fdata()
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+
+    assert out_image.shape == raw_image.shape[:3] + (raw_image.shape[3] - 3,)
+    assert out_image.get_data_dtype() == np.float32
+    assert not out_data[~mask].any()
+
+
+def test_run_fused_image_postprocessing_filter_time_axis(
+    artifact_dir, sample_raw_image, helpers, request
+):
+    """Check that the fused Butterworth filter runs along the time axis."""
+
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = ["TemporalFiltering"]
+    filter_options = postprocessing_config.processing_step_options.temporal_filtering
+    filter_options.implementation = "Butterworth"
+
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    out_path = test_path / "filtered.nii.gz"
+
+    run_fused_image_postprocessing(
+        postprocessing_config,
+        in_file=sample_raw_image,
+        export_path=out_path,
+        tr=2,
+    )
+
+    sos = calc_filter(
+        filter_options.filtering_high_pass,
+        filter_options.filtering_low_pass,
+        2,
+        filter_options.filtering_order,
+    )
+    expected = sosfilt(sos, nib.load(sample_raw_image).get_fdata(), axis=3)
+
+    assert np.allclose(nib.load(out_path).get_fdata(), expected, rtol=1e-4, atol=1e-2)
+
+
+def test_run_fused_image_postprocessing_filter_restrict_to_mask(
+    artifact_dir, sample_raw_image, sample_raw_image_mask, helpers, request
+):
+    """Check that the fused Butterworth filter leaves voxels outside the mask."""
+
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = ["TemporalFiltering"]
+    filter_options = postprocessing_config.processing_step_options.temporal_filtering
+    filter_options.implementation = "Butterworth"
+    filter_options.restrict_to_mask = True
+
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    out_path = test_path / "filtered.nii.gz"
+
+    run_fused_image_postprocessing(
+        postprocessing_config,
+        in_file=sample_raw_image,
+        export_path=out_path,
+        tr=2,
+        mask_file=sample_raw_image_mask,
+    )
+
+    raw_data = nib.load(sample_raw_image).get_fdata()
+    out_data = nib.load(out_path).get_fdata()
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+    sos = calc_filter(
+        filter_options.filtering_high_pass,
+        filter_options.filtering_low_pass,
+        2,
+        filter_options.filtering_order,
+    )
+
+    assert np.allclose(out_data[~mask], raw_data[~mask], rtol=1e-5)
+    assert np.allclose(
+        out_data[mask], sosfilt(sos, raw_data[mask], axis=-1), rtol=1e-4, atol=1e-2
+    )
+
+
+def test_run_fused_image_postprocessing_scrub_remove(
+    artifact_dir, sample_raw_image, helpers, request
+):
+    """Check that scrubbing without NA insertion drops the targeted volumes."""
+
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = ["ScrubTimepoints"]
+    postprocessing_config.processing_step_options.scrub_timepoints.insert_na = False
+
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    out_path = test_path / "scrubbed.nii.gz"
+
+    scrub_vector = [0, 1, 0, 0, 0, 0, 1, 1, 0, 0]
+    run_fused_image_postprocessing(
+        postprocessing_config,
+        in_file=sample_raw_image,
+        export_path=out_path,
+        scrub_vector=scrub_vector,
+    )
+
+    raw_data = nib.load(sample_raw_image).get_fdata()
+    out_data = nib.load(out_path).get_fdata()
+    keep = [i for i, scrub in enumerate(scrub_vector) if not scrub]
+
+    assert out_data.shape[3] == len(keep)
+    assert np.allclose(out_data, raw_data[:, :, :, keep])
+
+
+def test_is_fusable_unsupported_step():
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = ["SpatialSmoothing", "ApplyMask"]
+
+    assert not is_fusable(postprocessing_config)
+
+    postprocessing_config.processing_steps = ["TemporalFiltering", "ApplyMask"]
+    postprocessing_config.processing_step_options.temporal_filtering.implementation = (
+        "fslmaths"
+    )
+
+    assert not is_fusable(postprocessing_config)
+
+    postprocessing_config.processing_step_options.temporal_filtering.implementation = (
+        "Butterworth"
+    )
+
+    assert is_fusable(postprocessing_config)
+
+
+def test_run_fused_image_postprocessing_unsupported_step(
+    artifact_dir, sample_raw_image, helpers, request
+):
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = ["SpatialSmoothing"]
+
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+
+    with pytest.raises(ImplementationNotFoundError):
+        run_fused_image_postprocessing(
+            postprocessing_config,
+            in_file=sample_raw_image,
+            export_path=test_path / "smoothed.nii.gz",
+        )
+
+
+def test_run_fused_image_postprocessing_confound_regression(
+    artifact_dir,
+    sample_raw_image,
+    sample_raw_image_mask,
+    sample_postprocessed_confounds,
+    helpers,
+    request,
+):
+    """Check that the fused native regression matches the workflow's output."""
+
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = ["ConfoundRegression"]
+    postprocessing_config.processing_step_options.confound_regression.implementation = (
+        "native_qr"
+    )
+
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    out_path = test_path / "regressed.nii.gz"
+    wf_out_path = test_path / "regressed_wf.nii.gz"
+
+    run_fused_image_postprocessing(
+        postprocessing_config,
+        in_file=sample_raw_image,
+        export_path=out_path,
+        mask_file=sample_raw_image_mask,
+        confounds_file=sample_postprocessed_confounds,
+    )
+    build_confound_regression_native_qr_workflow(
+        in_file=sample_raw_image,
+        out_file=wf_out_path,
+        confounds_file=sample_postprocessed_confounds,
+        mask_file=sample_raw_image_mask,
+        base_dir=test_path,
+    ).run()
+
+    assert np.allclose(
+        nib.load(out_path).get_fdata(), nib.load(wf_out_path).get_fdata(), atol=1e-3
+    )
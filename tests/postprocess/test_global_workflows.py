@@ -1,5 +1,9 @@
 import pytest
+import nibabel as nib
+import numpy as np
+from scipy.signal import sosfilt
 from clpipe.config.options import ProjectOptions, ScrubColumn, ScrubTimepoints
+from clpipe.postprocutils.utils import calc_filter
 
 from clpipe.postprocutils.image_workflows import *
 from clpipe.postprocutils.global_workflows import *
@@ -488,3 +492,69 @@ def test_build_multiple_scrubbing_workflow(
         test_path, "work_dir"
     )  # specify the working directory for the workflow
     test_wf.run()
+
+
+def test_build_postprocessing_wf_filter_restrict_to_mask(
+    artifact_dir,
+    request,
+    sample_raw_image,
+    sample_raw_image_mask,
+    sample_confounds_timeseries,
+    helpers,
+):
+    """Check that only voxels inside the mask are filtered."""
+
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = ["TemporalFiltering"]
+    filter_options = postprocessing_config.processing_step_options.temporal_filtering
+    filter_options.implementation = "Butterworth"
+    filter_options.restrict_to_mask = True
+
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    out_path = test_path / "postprocessed_image.nii"
+
+    wf = build_postprocessing_wf(
+        postprocessing_config,
+        image_file=sample_raw_image,
+        image_export_path=out_path,
+        tr=2,
+        mask_file=sample_raw_image_mask,
+        confounds_file=sample_confounds_timeseries,
+        confounds_export_path=test_path / "postprocessed_confounds.tsv",
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    wf.run()
+
+    raw_data = nib.load(sample_raw_image).get_fdata()
+    out_data = nib.load(out_path).get_fdata()
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+    sos = calc_filter(
+        filter_options.filtering_high_pass,
+        filter_options.filtering_low_pass,
+        2,
+        filter_options.filtering_order,
+    )
+
+    assert np.allclose(out_data[~mask], raw_data[~mask])
+    assert np.allclose(
+        out_data[mask], sosfilt(sos, raw_data[mask], axis=-1), rtol=1e-4, atol=1e-2
+    )
+
+
+def test_build_postprocessing_wf_filter_restrict_to_mask_no_mask(
+    sample_raw_image, sample_confounds_timeseries
+):
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = ["TemporalFiltering"]
+    filter_options = postprocessing_config.processing_step_options.temporal_filtering
+    filter_options.implementation = "Butterworth"
+    filter_options.restrict_to_mask = True
+
+    with pytest.raises(ValueError):
+        build_postprocessing_wf(
+            postprocessing_config,
+            image_file=sample_raw_image,
+            tr=2,
+            confounds_file=sample_confounds_timeseries,
+        )
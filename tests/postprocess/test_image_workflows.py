@@ -1,7 +1,13 @@
 import pytest
+import nibabel as nib
+import numpy as np
+import pandas as pd
+from scipy.signal import sosfilt
 
 from clpipe.postprocutils.image_workflows import *
 from clpipe.postprocutils.confounds_workflows import build_confounds_processing_workflow
+from clpipe.postprocutils.utils import calc_filter, build_trial_design
+from clpipe.config.options import ProjectOptions
 
 
 def test_spatial_smoothing_wf(
@@ -135,6 +141,70 @@ def test_butterworth_filter_wf(
     assert True
 
 
+def test_butterworth_filter_wf_mask(
+    artifact_dir, sample_raw_image, sample_raw_image_mask, request, helpers
+):
+    """Check that filtering with a mask leaves voxels outside the mask unchanged
+    and filters along the time axis inside it."""
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+
+    filtered_path = test_path / "sample_raw_filtered.nii"
+
+    wf = build_butterworth_filter_workflow(
+        hp=0.008,
+        lp=-1,
+        tr=2,
+        order=2,
+        in_file=sample_raw_image,
+        out_file=filtered_path,
+        mask_file=sample_raw_image_mask,
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    wf.run()
+
+    raw_data = nib.load(sample_raw_image).get_fdata()
+    filtered_data = nib.load(filtered_path).get_fdata()
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+    expected = sosfilt(calc_filter(0.008, -1, 2, 2), raw_data[mask], axis=1)
+
+    assert np.array_equal(filtered_data[~mask], raw_data[~mask])
+    assert np.allclose(filtered_data[mask], expected, rtol=1e-4, atol=1e-2)
+
+
+def test_butterworth_filter_mask_shape_mismatch(sample_raw_image, tmp_path):
+    raw_image = nib.load(sample_raw_image)
+    mask_path = tmp_path / "mask.nii.gz"
+    nib.save(
+        nib.Nifti1Image(np.ones((2, 2, 2), dtype=np.uint8), raw_image.affine),
+        mask_path,
+    )
+
+    butterworth_filter = ButterworthFilter(
+        in_file=sample_raw_image,
+        hp=0.008,
+        lp=-1,
+        tr=2,
+        order=2,
+        mask_file=str(mask_path),
+        out_file=str(tmp_path / "filtered.nii"),
+    )
+
+    with pytest.raises(ValueError, match="Mask shape"):
+        butterworth_filter.run()
+
+
+def test_temporal_filter_wf_fslmaths_mask(sample_raw_image_mask):
+    with pytest.raises(ValueError):
+        build_temporal_filter_workflow(
+            IMPLEMENTATION_FSLMATHS,
+            hp=0.008,
+            lp=-1,
+            tr=2,
+            mask_file=sample_raw_image_mask,
+        )
+
+
 def test_fslmath_temporal_filter_wf(
     artifact_dir, sample_raw_image, plot_img, write_graph, request, helpers
 ):
@@ -299,6 +369,37 @@ def test_confound_regression_afni_3dTproject_wf(
         helpers.plot_4D_img_slice(regressed_path, "regressed.png")
 
 
+def test_confound_regression_native_qr_wf(
+    artifact_dir,
+    sample_raw_image,
+    sample_postprocessed_confounds,
+    sample_raw_image_mask,
+    request,
+    helpers,
+):
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+
+    regressed_path = test_path / "sample_raw_regressed.nii.gz"
+
+    wf = build_confound_regression_native_qr_workflow(
+        confounds_file=sample_postprocessed_confounds,
+        in_file=sample_raw_image,
+        out_file=regressed_path,
+        mask_file=sample_raw_image_mask,
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    wf.run()
+
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+    regressed_image = nib.load(regressed_path)
+    regressed_data = regressed_image.get_fdata()
+
+    assert regressed_image.shape == nib.load(sample_raw_image).shape
+    assert regressed_image.get_data_dtype() == np.float32
+    assert not regressed_data[~mask].any()
+
+
 def test_apply_aroma_fsl_regfilt_wf(
     artifact_dir,
     sample_raw_image,
@@ -334,6 +435,38 @@ def test_apply_aroma_fsl_regfilt_wf(
         helpers.plot_4D_img_slice(regressed_path, "aromaaplied.png")
 
 
+def test_apply_aroma_native_regfilt_wf(
+    artifact_dir,
+    sample_raw_image,
+    sample_melodic_mixing,
+    sample_aroma_noise_ics,
+    sample_raw_image_mask,
+    request,
+    helpers,
+):
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+
+    regressed_path = test_path / "sample_raw_aroma.nii.gz"
+
+    wf = build_aroma_workflow_native_regfilt(
+        mixing_file=sample_melodic_mixing,
+        noise_file=sample_aroma_noise_ics,
+        in_file=sample_raw_image,
+        out_file=regressed_path,
+        mask_file=sample_raw_image_mask,
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    wf.run()
+
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+    raw_data = nib.load(sample_raw_image).get_fdata()
+    regressed_data = nib.load(regressed_path).get_fdata()
+
+    assert regressed_data.shape == raw_data.shape
+    assert np.array_equal(regressed_data[~mask], raw_data[~mask])
+
+
 @pytest.mark.skip(reason="Need to provide reference image")
 def test_resample_wf(
     artifact_dir,
@@ -390,6 +523,36 @@ def test_scrubbing_wf(artifact_dir, sample_raw_image, plot_img, request, helpers
         helpers.plot_4D_img_slice(scrubbed_path, "scrubbed.png")
 
 
+def test_scrubbing_wf_spectral_interpolation(
+    artifact_dir, sample_raw_image, request, helpers
+):
+    """Test that spectral interpolation replaces only the scrubbed timepoints."""
+
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    interpolated_path = test_path / "interpolated.nii.gz"
+
+    scrub_vector = [0, 1, 0, 0, 0, 0, 1, 0, 0, 0]
+
+    wf = build_scrubbing_workflow(
+        scrub_vector,
+        import_path=sample_raw_image,
+        export_path=interpolated_path,
+        interpolation="spectral",
+        tr=2,
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    wf.run()
+
+    raw_data = nib.load(sample_raw_image).get_fdata()
+    interpolated_data = nib.load(interpolated_path).get_fdata()
+    keep = [i for i, scrub in enumerate(scrub_vector) if not scrub]
+
+    assert interpolated_data.shape == raw_data.shape
+    assert np.allclose(interpolated_data[..., keep], raw_data[..., keep])
+    assert not np.isnan(interpolated_data).any()
+
+
 def test_scrubbing_wf_first_timepoint(artifact_dir, sample_raw_image, plot_img, request, helpers):
     """Test that the specific case of a first timepoint being scrubbed works"""
 
@@ -528,3 +691,184 @@ def test_scrubbing_wf_aroma(artifact_dir, sample_melodic_mixing, request, helper
         crashdump_dir=test_path,
     )
     wf.run()
+
+
+def test_beta_series_native_lss_wf(
+    artifact_dir,
+    sample_raw_image,
+    sample_postprocessed_confounds,
+    sample_raw_image_mask,
+    request,
+    helpers,
+):
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+
+    events_path = test_path / "events.tsv"
+    events_path.write_text(
+        "onset\tduration\ttrial_type\n"
+        "0\t2\tgo\n"
+        "4\t2\tstop\n"
+        "8\t2\tgo\n"
+        "12\t2\tgo\n"
+    )
+    beta_series_path = test_path / "sample_raw_betaseries.nii.gz"
+
+    wf = build_beta_series_native_lss_workflow(
+        in_file=sample_raw_image,
+        out_file=beta_series_path,
+        events_file=events_path,
+        confounds_file=sample_postprocessed_confounds,
+        tr=2,
+        exclude_trial_types=["stop"],
+        mask_file=sample_raw_image_mask,
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    wf.run()
+
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+    beta_series_image = nib.load(beta_series_path)
+    used_events = pd.read_csv(
+        test_path / "sample_raw_betaseries_usedevents.tsv", sep="\t"
+    )
+
+    assert beta_series_image.shape == nib.load(sample_raw_image).shape[:3] + (3,)
+    assert beta_series_image.get_data_dtype() == np.float32
+    assert not beta_series_image.get_fdata()[~mask].any()
+    assert list(used_events.onset) == [0, 8, 12]
+
+
+def test_postprocess_100_voxel_mean(sample_raw_image):
+    """Check that every fused intensity normalization also builds under nipype."""
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = ["IntensityNormalization", "ApplyMask"]
+    postprocessing_config.processing_step_options.intensity_normalization.implementation = (
+        "100_voxelmean"
+    )
+
+    wf = build_image_postprocessing_workflow(
+        postprocessing_config, in_file=sample_raw_image, mask_file=sample_raw_image
+    )
+
+    assert "IntensityNormalization_100_voxelmean" in [
+        node.name for node in wf._graph.nodes()
+    ]
+
+
+def test_postprocess_beta_series_not_last(sample_raw_image):
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = ["BetaSeries", "ApplyMask"]
+
+    with pytest.raises(ValueError):
+        build_image_postprocessing_workflow(
+            postprocessing_config, in_file=sample_raw_image, tr=2
+        )
+
+
+def test_postprocess_beta_series_trimmed_filtered(
+    artifact_dir, sample_raw_image, request, helpers
+):
+    """Check that the trial design follows the image through trimming and
+    filtering, against a per-trial pinv on the same stream."""
+
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = [
+        "TrimTimepoints",
+        "TemporalFiltering",
+        "BetaSeries",
+    ]
+    step_options = postprocessing_config.processing_step_options
+    step_options.trim_timepoints.from_beginning = 2
+    step_options.trim_timepoints.from_end = 1
+    step_options.temporal_filtering.implementation = "Butterworth"
+
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    events_path = test_path / "events.tsv"
+    events_path.write_text(
+        "onset\tduration\ttrial_type\n" "4\t2\tgo\n" "8\t2\tgo\n" "12\t2\tgo\n"
+    )
+
+    wf = build_image_postprocessing_workflow(
+        postprocessing_config,
+        in_file=sample_raw_image,
+        tr=2,
+        events_file=events_path,
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    result = wf.run()
+    beta_series_node = [
+        node for node in result.nodes() if node.name == "beta_series_lss"
+    ][0]
+    betas = nib.load(beta_series_node.result.outputs.out_file).get_fdata()
+
+    filter_options = step_options.temporal_filtering
+    sos = calc_filter(
+        filter_options.filtering_high_pass,
+        filter_options.filtering_low_pass,
+        2,
+        filter_options.filtering_order,
+    )
+    data = nib.load(sample_raw_image).get_fdata()[..., 2:-1]
+    data = sosfilt(sos, data, axis=-1).reshape((-1, data.shape[-1]))
+    design, _ = build_trial_design(events_path, 2, 10)
+    design = sosfilt(sos, design[2:-1], axis=0)
+
+    expected = np.zeros((data.shape[0], design.shape[1]))
+    for trial in range(design.shape[1]):
+        regressors = np.column_stack(
+            (
+                design[:, trial],
+                design.sum(axis=1) - design[:, trial],
+                np.ones(design.shape[0]),
+            )
+        )
+        expected[:, trial] = (np.linalg.pinv(regressors) @ data.T)[0]
+
+    assert betas.shape[-1] == 3
+    assert np.allclose(
+        betas.reshape((-1, 3)), expected, rtol=1e-3, atol=1e-3 * np.abs(expected).max()
+    )
+
+
+def test_postprocess_beta_series_after_fslmaths_filter(sample_raw_image, tmp_path):
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = ["TemporalFiltering", "BetaSeries"]
+    postprocessing_config.processing_step_options.temporal_filtering.implementation = (
+        "fslmaths"
+    )
+    events_path = tmp_path / "events.tsv"
+    events_path.write_text("onset\tduration\n0\t2\n")
+
+    with pytest.raises(ValueError):
+        build_image_postprocessing_workflow(
+            postprocessing_config,
+            in_file=sample_raw_image,
+            tr=2,
+            events_file=events_path,
+        )
+
+
+def test_get_timeline_steps():
+    postprocessing_config = ProjectOptions().postprocessing
+    step_options = postprocessing_config.processing_step_options
+    step_options.temporal_filtering.implementation = "Butterworth"
+    step_options.scrub_timepoints.insert_na = False
+    processing_steps = ["TrimTimepoints", "ScrubTimepoints", "TemporalFiltering"]
+
+    assert get_timeline_steps(postprocessing_config, processing_steps) == [
+        "TrimTimepoints",
+        "ScrubTimepoints",
+    ]
+    assert (
+        get_timeline_steps(
+            postprocessing_config, processing_steps, include_filtering=True
+        )
+        == processing_steps
+    )
+
+    # Scrubbing which inserts NAs keeps every timepoint
+    step_options.scrub_timepoints.insert_na = True
+    assert get_timeline_steps(postprocessing_config, processing_steps) == [
+        "TrimTimepoints"
+    ]
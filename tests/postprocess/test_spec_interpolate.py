@@ -0,0 +1,30 @@
+import numpy as np
+
+from clpipe.postprocutils.spec_interpolate import spec_inter
+
+
+def test_spec_inter_bins_and_threads():
+    """Check that binning and threading do not change the interpolation."""
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(60, 250)) + 100
+    scrub_mask = np.zeros(60, dtype=int)
+    scrub_mask[[3, 4, 30, 59]] = 1
+
+    expected = spec_inter(data, 2, 8, scrub_mask, 1, 250)
+    binned = spec_inter(data, 2, 8, scrub_mask, 1, 40)
+    threaded = spec_inter(data, 2, 8, scrub_mask, 1, 40, n_threads=3)
+
+    assert np.allclose(binned, expected)
+    assert np.array_equal(threaded, binned)
+
+
+def test_spec_inter_keeps_good_timepoints():
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(60, 20))
+    scrub_mask = np.zeros(60, dtype=int)
+    scrub_mask[[10, 11]] = 1
+
+    interpolated = spec_inter(data, 2, 8, scrub_mask, 1, 5000)
+
+    assert np.array_equal(interpolated[scrub_mask == 0], data[scrub_mask == 0])
+    assert not np.allclose(interpolated[[10, 11]], data[[10, 11]])
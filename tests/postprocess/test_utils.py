@@ -1,6 +1,30 @@
-from clpipe.postprocutils.utils import nii_to_matrix, matrix_to_nii, scrub_image
+import pytest
+from clpipe.postprocutils.utils import (
+    nii_to_matrix,
+    matrix_to_nii,
+    scrub_image,
+    get_scrub_vector,
+    get_scrub_matrix,
+    get_combined_scrub_vector,
+    get_scrub_vector_node,
+    logical_or_across_lists,
+    calc_filter,
+    apply_filter_chunked,
+    regress_confounds_chunked,
+    regress_aroma_chunked,
+    construct_motion_outliers,
+    split_spike_regressors,
+    lss_beta_series,
+    build_trial_design,
+    canonical_hrf,
+    load_image_matrix,
+    load_mask_vector,
+    save_image_matrix,
+)
+from scipy.signal import sosfilt
 import nibabel as nib
 import numpy as np
+import pandas as pd
 
 
 def test_nii_to_matrix(sample_raw_image):
@@ -43,3 +67,355 @@ def test_scrub_image_no_insert_na(
 
     if plot_img:
         helpers.plot_4D_img_slice(scrubbed_path, "scrubbed.png")
+
+
+def test_scrub_image_keeps_dtype(artifact_dir, sample_raw_image, request, helpers):
+    """Check that removing timepoints keeps the input data type and values."""
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    scrubbed_path = test_path / "scrubbed.nii.gz"
+
+    scrub_vector = [0, 1, 0, 0, 0, 0, 1, 0, 0, 0]
+
+    scrub_image(
+        sample_raw_image, scrub_vector, insert_na=False, export_path=scrubbed_path
+    )
+
+    raw_image = nib.load(sample_raw_image)
+    scrubbed_image = nib.load(scrubbed_path)
+    keep = [i for i, scrub in enumerate(scrub_vector) if not scrub]
+
+    assert scrubbed_image.get_data_dtype() == raw_image.get_data_dtype()
+    assert np.array_equal(scrubbed_image.get_fdata(), raw_image.get_fdata()[..., keep])
+
+
+def test_scrub_image_insert_na(artifact_dir, sample_raw_image, request, helpers):
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    scrubbed_path = test_path / "scrubbed.nii.gz"
+
+    scrub_vector = [0, 1, 0, 0, 0, 0, 1, 0, 0, 0]
+
+    scrub_image(
+        sample_raw_image, scrub_vector, insert_na=True, export_path=scrubbed_path
+    )
+
+    scrubbed_image = nib.load(scrubbed_path)
+    scrubbed_data = scrubbed_image.get_fdata()
+
+    assert scrubbed_image.get_data_dtype() == np.float32
+    assert np.isnan(scrubbed_data[..., [1, 6]]).all()
+    assert not np.isnan(scrubbed_data[..., [0, 2, 3, 4, 5, 7, 8, 9]]).any()
+
+
+FD_TIMESERIES = [0.1, 0.5, 0.1, 0.1, 0.1, 0.1, 0.1, 0.9, 0.1, 0.1]
+
+
+def test_get_scrub_vector_behind_ahead():
+    assert get_scrub_vector(FD_TIMESERIES, 0.3, 1, 1, 0) == [
+        1,
+        1,
+        1,
+        0,
+        0,
+        0,
+        1,
+        1,
+        1,
+        0,
+    ]
+
+
+def test_get_scrub_vector_behind_2():
+    """Scrubbing 2 behind reaches 3 timepoints back, matching the original list
+    implementation."""
+    assert get_scrub_vector(FD_TIMESERIES, 0.3, 2, 0, 0) == [
+        1,
+        1,
+        0,
+        0,
+        1,
+        1,
+        1,
+        1,
+        0,
+        0,
+    ]
+
+
+def test_get_scrub_vector_contiguous():
+    assert get_scrub_vector(FD_TIMESERIES, 0.3, 0, 0, 3) == [
+        1,
+        1,
+        0,
+        0,
+        0,
+        0,
+        0,
+        1,
+        1,
+        1,
+    ]
+
+
+def test_get_scrub_vector_nan():
+    timeseries = [np.nan] + FD_TIMESERIES[1:]
+
+    assert get_scrub_vector(timeseries, 0.3, 0, 0, 0) == [0, 1, 0, 0, 0, 0, 0, 1, 0, 0]
+
+
+def test_get_scrub_matrix_matches_columns():
+    rng = np.random.default_rng(0)
+    timeseries = rng.random((50, 4))
+    settings = ([0.8, 0.9, 0.7, 0.95], [0, 1, 2, 1], [1, 0, 3, 1], [0, 3, 5, 2])
+
+    scrub_matrix = get_scrub_matrix(timeseries, *settings)
+
+    for column, (threshold, behind, ahead, contig) in enumerate(zip(*settings)):
+        assert scrub_matrix[:, column].tolist() == get_scrub_vector(
+            timeseries[:, column], threshold, behind, ahead, contig
+        )
+
+
+def test_get_combined_scrub_vector(sample_confounds_timeseries):
+    scrub_configs = [
+        {
+            "target_variable": "csf",
+            "threshold": 332.44,
+            "scrub_behind": 0,
+            "scrub_ahead": 0,
+            "scrub_contiguous": 0,
+        },
+        {
+            "target_variable": "framewise_displacement",
+            "threshold": 0.13,
+            "scrub_behind": 0,
+            "scrub_ahead": 1,
+            "scrub_contiguous": 0,
+        },
+    ]
+
+    expected = logical_or_across_lists(
+        [
+            get_scrub_vector_node(sample_confounds_timeseries, scrub_config)
+            for scrub_config in scrub_configs
+        ]
+    )
+
+    assert (
+        get_combined_scrub_vector(sample_confounds_timeseries, scrub_configs)
+        == expected
+    )
+
+
+def test_apply_filter_chunked():
+    """Check that filtering in small chunks matches filtering all at once."""
+    data = np.random.default_rng(0).random((500, 40)).astype(np.float32)
+    sos = calc_filter(0.008, 0.1, 2, 2)
+    expected = sosfilt(sos, data, axis=1)
+
+    filtered = apply_filter_chunked(sos, data.copy(), chunk_size=40 * 7)
+
+    assert filtered.dtype == np.float32
+    assert np.allclose(filtered, expected, atol=1e-5)
+
+
+def test_apply_filter_chunked_voxel_index():
+    data = np.random.default_rng(0).random((100, 40)).astype(np.float32)
+    sos = calc_filter(0.008, -1, 2, 2)
+    voxel_index = np.arange(0, 100, 3)
+
+    filtered = apply_filter_chunked(sos, data.copy(), voxel_index, chunk_size=200)
+
+    untouched = np.setdiff1d(np.arange(100), voxel_index)
+    assert np.array_equal(filtered[untouched], data[untouched])
+    assert np.allclose(
+        filtered[voxel_index], sosfilt(sos, data[voxel_index], axis=1), atol=1e-5
+    )
+
+
+def test_regress_confounds_chunked():
+    """Check that chunked QR regression matches a least squares fit."""
+    rng = np.random.default_rng(0)
+    confounds = rng.normal(size=(40, 3))
+    data = (rng.normal(size=(200, 40)) + 100).astype(np.float32)
+
+    regressed = regress_confounds_chunked(data.copy(), confounds, chunk_size=40 * 7)
+
+    design = np.column_stack((np.ones(40), confounds))
+    betas, _, _, _ = np.linalg.lstsq(design, data.T.astype(np.float64), rcond=None)
+    expected = data - (design @ betas).T + data.mean(axis=1, keepdims=True)
+
+    assert regressed.dtype == np.float32
+    assert np.allclose(regressed, expected, atol=1e-3)
+
+
+def test_regress_confounds_chunked_nan_timepoints():
+    """Check that NaN timepoints are left out of the fit and stay NaN."""
+    rng = np.random.default_rng(0)
+    confounds = rng.normal(size=(40, 3))
+    data = (rng.normal(size=(50, 40)) + 100).astype(np.float32)
+    data[:, [5, 6]] = np.nan
+    keep = np.setdiff1d(np.arange(40), [5, 6])
+
+    regressed = regress_confounds_chunked(data.copy(), confounds)
+    expected = regress_confounds_chunked(data[:, keep].copy(), confounds[keep])
+
+    assert np.isnan(regressed[:, [5, 6]]).all()
+    assert np.allclose(regressed[:, keep], expected, atol=1e-3)
+
+
+def test_regress_aroma_chunked():
+    """Check that only the fitted noise components are removed from each voxel."""
+    rng = np.random.default_rng(0)
+    mixing = rng.normal(size=(60, 8))
+    data = (rng.normal(size=(100, 60)) + 10).astype(np.float32)
+    data[3] = 5
+    noise_ics = [2, 5]
+
+    regressed = regress_aroma_chunked(data.copy(), mixing, noise_ics, chunk_size=60 * 7)
+
+    betas, _, _, _ = np.linalg.lstsq(mixing, data.T.astype(np.float64), rcond=None)
+    expected = data - (mixing[:, [1, 4]] @ betas[[1, 4]]).T
+    expected[3] = 5
+
+    assert regressed.dtype == np.float32
+    assert np.allclose(regressed, expected, atol=1e-4)
+
+
+def test_construct_motion_outliers():
+    scrub_targets = [0, 1, 0, 0, 1, 1, 0]
+
+    outliers = construct_motion_outliers(scrub_targets)
+
+    assert outliers.shape == (7, 3)
+    assert outliers.to_numpy().argmax(axis=0).tolist() == [1, 4, 5]
+    assert outliers.to_numpy().sum() == 3
+
+
+def test_regress_confounds_chunked_spike_index():
+    """Check that spike indexes match regressing dense spike columns."""
+    rng = np.random.default_rng(0)
+    confounds = rng.normal(size=(40, 3))
+    scrub_targets = np.zeros(40, dtype=int)
+    scrub_targets[[4, 9, 20]] = 1
+    dense_confounds = np.column_stack(
+        (confounds, construct_motion_outliers(scrub_targets).to_numpy())
+    )
+    data = (rng.normal(size=(30, 40)) + 100).astype(np.float32)
+
+    split_confounds, spike_index = split_spike_regressors(dense_confounds)
+    regressed = regress_confounds_chunked(
+        data.copy(), split_confounds, spike_index=spike_index
+    )
+    expected = regress_confounds_chunked(data.copy(), dense_confounds)
+
+    assert split_confounds.shape == confounds.shape
+    assert spike_index.tolist() == [4, 9, 20]
+    assert np.allclose(regressed, expected, atol=1e-3)
+
+
+def test_lss_beta_series():
+    """Check that the batched LSS betas match a per-trial pseudoinverse fit."""
+    rng = np.random.default_rng(0)
+    ev_matrix = rng.normal(size=(80, 12))
+    confounds = rng.normal(size=(80, 4))
+    data = rng.normal(size=(30, 80)).astype(np.float32)
+    data[:, 7] = np.nan
+
+    betas = lss_beta_series(
+        data, ev_matrix, confounds, chunk_size=80 * 7, spike_index=[20]
+    )
+
+    keep = np.ones(80, dtype=bool)
+    keep[[7, 20]] = False
+    expected = np.zeros((30, 12))
+    for trial in range(12):
+        design = np.column_stack(
+            (
+                ev_matrix[:, trial],
+                ev_matrix.sum(axis=1) - ev_matrix[:, trial],
+                np.ones(80),
+                confounds,
+            )
+        )
+        expected[:, trial] = (np.linalg.pinv(design[keep]) @ data[:, keep].T)[0]
+
+    assert betas.dtype == np.float32
+    assert np.allclose(betas, expected, atol=1e-5)
+
+
+def test_build_trial_design_exclude_trial_types():
+    events = pd.DataFrame(
+        {
+            "onset": [0.0, 10.0, 20.0],
+            "duration": [2.0, 2.0, 0.0],
+            "trial_type": ["go", "fixation", "go"],
+        }
+    )
+
+    design, used_events = build_trial_design(
+        events, 2, 30, exclude_trial_types=["fixation"]
+    )
+
+    assert design.shape == (30, 2)
+    assert list(used_events.onset) == [0.0, 20.0]
+    # Each response peaks about 5 seconds after its onset
+    assert np.argmax(design[:, 0]) in (2, 3)
+    assert np.argmax(design[:, 1]) in (12, 13)
+
+
+def test_build_trial_design_matches_convolution():
+    """Check the vectorized design against a per-trial upsampled convolution."""
+    rng = np.random.default_rng(0)
+    tr, n_timepoints, oversampling = 1.37, 60, 16
+    events = pd.DataFrame(
+        {
+            "onset": rng.uniform(0, tr * n_timepoints + 5, 20),
+            "duration": rng.choice([0.0, 0.5, 3.3], 20),
+        }
+    )
+
+    design, _ = build_trial_design(events, tr, n_timepoints)
+
+    dt = tr / oversampling
+    n_up = n_timepoints * oversampling
+    hrf = canonical_hrf(dt)
+    expected = np.zeros((n_timepoints, len(events)))
+    for trial, (onset, duration) in enumerate(zip(events.onset, events.duration)):
+        start = int(np.floor(onset / dt))
+        stop = max(start + 1, int(np.ceil((onset + duration) / dt)))
+        boxcar = np.zeros(n_up)
+        boxcar[start:stop] = 1
+        expected[:, trial] = np.convolve(boxcar, hrf)[:n_up:oversampling]
+
+    assert np.allclose(design, expected)
+
+
+@pytest.mark.parametrize("order", ["C", "F"])
+def test_image_matrix_round_trip(sample_raw_image, tmp_path, order):
+    data, spatial_shape, affine, header = load_image_matrix(
+        sample_raw_image, order=order
+    )
+    raw_data = nib.load(sample_raw_image).get_fdata(dtype=np.float32)
+
+    assert data.shape == (np.prod(spatial_shape), raw_data.shape[-1])
+    assert np.array_equal(data[123], raw_data.reshape(data.shape, order=order)[123])
+
+    out_path = tmp_path / "round_trip.nii"
+    save_image_matrix(data, spatial_shape, affine, header, out_path, order=order)
+
+    assert np.array_equal(nib.load(out_path).get_fdata(dtype=np.float32), raw_data)
+
+
+def test_load_mask_vector(tmp_path):
+    mask_data = np.zeros((2, 3, 4))
+    mask_data[0, 1, 2] = 1
+    mask_data[1, 2, 3] = -1
+    mask_data[1, 0, 0] = np.nan
+    mask_path = tmp_path / "mask.nii.gz"
+    nib.save(nib.Nifti1Image(mask_data, np.eye(4)), mask_path)
+
+    mask = load_mask_vector(mask_path, (2, 3, 4), order="F")
+
+    assert np.array_equal(mask, (mask_data > 0).reshape(-1, order="F"))
+    with pytest.raises(ValueError, match="Mask shape"):
+        load_mask_vector(mask_path, (3, 3, 4))
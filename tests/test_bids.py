@@ -1,9 +1,15 @@
 import pytest
 from pathlib import Path
 
-from clpipe.bids import get_bids
+from clpipe.bids import (
+    get_bids,
+    _get_subject_signatures,
+    _merge_index_database,
+)
 from bids import BIDSLayout, BIDSLayoutIndexer
+import os
 import re
+import sqlite3
 
 
 def test_get_bids(clpipe_fmriprep_dir):
@@ -47,3 +53,91 @@ def test_no_ignore_BIDS_Indexer(clpipe_fmriprep_dir):
     )
 
     assert len(layout.get(datatype="anat")) != 0
+
+
+def test_get_subject_signatures_detects_changes(tmp_path):
+    (tmp_path / "sub-01" / "func").mkdir(parents=True)
+    (tmp_path / "sub-02" / "anat").mkdir(parents=True)
+    (tmp_path / "dataset_description.json").touch()
+    for subject_dir in ("sub-01", "sub-01/func", "sub-02", "sub-02/anat"):
+        os.utime(tmp_path / subject_dir, (1000, 1000))
+
+    signatures = _get_subject_signatures(tmp_path)
+    assert signatures == {"sub-01": 1000, "sub-02": 1000}
+
+    (tmp_path / "sub-01" / "func" / "sub-01_task-rest_bold.nii.gz").touch()
+    updated_signatures = _get_subject_signatures(tmp_path)
+
+    assert updated_signatures["sub-01"] != signatures["sub-01"]
+    assert updated_signatures["sub-02"] == signatures["sub-02"]
+
+
+def _create_index_database(path, root, file_paths):
+    connection = sqlite3.connect(str(path))
+    connection.executescript("""
+        CREATE TABLE layout_info (root TEXT PRIMARY KEY);
+        CREATE TABLE files (path TEXT PRIMARY KEY);
+        CREATE TABLE tags (file_path TEXT, entity_name TEXT, _value TEXT,
+            PRIMARY KEY (file_path, entity_name));
+        CREATE TABLE associations (src TEXT, dst TEXT, kind TEXT,
+            PRIMARY KEY (src, dst, kind));
+        CREATE TABLE entities (name TEXT PRIMARY KEY);
+        """)
+    connection.execute("INSERT INTO layout_info VALUES (?)", (root,))
+    connection.execute("INSERT INTO entities VALUES ('subject')")
+    for file_path in file_paths:
+        subject = file_path.split("/")[-2]
+        connection.execute("INSERT INTO files VALUES (?)", (file_path,))
+        connection.execute(
+            "INSERT INTO tags VALUES (?, 'subject', ?)", (file_path, subject)
+        )
+    connection.commit()
+    connection.close()
+
+
+def test_merge_index_database_replaces_subjects(tmp_path):
+    root = "/data/bids"
+    database = tmp_path / "layout_index.sqlite"
+    incoming_database = tmp_path / "incoming.sqlite"
+    _create_index_database(
+        database,
+        root,
+        [f"{root}/sub-01/a.nii.gz", f"{root}/sub-02/a.nii.gz"],
+    )
+    _create_index_database(incoming_database, root, [f"{root}/sub-03/a.nii.gz"])
+
+    _merge_index_database(database, incoming_database, {"sub-02", "sub-03"})
+
+    connection = sqlite3.connect(str(database))
+    files = [row[0] for row in connection.execute("SELECT path FROM files")]
+    tags = [row[0] for row in connection.execute("SELECT file_path FROM tags")]
+    connection.close()
+
+    assert sorted(files) == [f"{root}/sub-01/a.nii.gz", f"{root}/sub-03/a.nii.gz"]
+    assert sorted(tags) == sorted(files)
+
+
+def _add_bids_subject(bids_dir, subject):
+    func_dir = bids_dir / f"sub-{subject}" / "func"
+    func_dir.mkdir(parents=True)
+    bold_path = func_dir / f"sub-{subject}_task-rest_bold.nii.gz"
+    bold_path.touch()
+    return str(bold_path)
+
+
+def test_get_bids_update_new_subject(tmp_path):
+    bids_dir = tmp_path / "data_BIDS"
+    bids_dir.mkdir()
+    with open(bids_dir / "dataset_description.json", "w") as description_file:
+        description_file.write('{"Name": "test", "BIDSVersion": "1.6.0"}')
+    sub_01_path = _add_bids_subject(bids_dir, "01")
+    database_path = tmp_path / "BIDS_index"
+
+    layout = get_bids(bids_dir, database_path=database_path)
+    assert layout.get(subject="01", return_type="filename") == [sub_01_path]
+
+    sub_02_path = _add_bids_subject(bids_dir, "02")
+    layout = get_bids(bids_dir, database_path=database_path, update=True)
+
+    assert layout.get(subject="02", return_type="filename") == [sub_02_path]
+    assert layout.get(subject="01", return_type="filename") == [sub_01_path]
@@ -1,6 +1,7 @@
 import pytest
 from pathlib import Path
-from clpipe.glm_launch import glm_launch
+from clpipe.glm_launch import glm_launch, _find_fsf_files
+from clpipe.utils import get_logger
 
 
 def test_glm_launch_controller_L1(glm_config_file: Path):
@@ -28,3 +29,45 @@ def test_glm_launch_controller_invalid_level(glm_config_file: Path):
         glm_launch(glm_config_file=glm_config_file, level="L4", model="example_L1")
 
     assert e.value.code == 1
+
+
+def test_find_fsf_files_skip_completed(artifact_dir, helpers, request):
+    """Check that fsfs with completed FEAT output are skipped unless rerun."""
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    fsf_dir = test_path / "fsfs"
+    fsf_dir.mkdir(exist_ok=True)
+    for run in ["run-1", "run-2", "run-3"]:
+        out_dir = test_path / "l1" / run
+        (fsf_dir / f"{run}.fsf").write_text(f'set fmri(outputdir) "{out_dir}"\n')
+
+    # Completed, with FEAT's .feat suffix added to the output dir
+    completed = test_path / "l1" / "run-1.feat"
+    (completed / "stats").mkdir(parents=True, exist_ok=True)
+    (completed / "report.html").write_text("")
+    (completed / "stats" / "zstat1.nii.gz").write_text("")
+    # Started, but without statistics
+    started = test_path / "l1" / "run-2.feat"
+    started.mkdir(parents=True, exist_ok=True)
+    (started / "report.html").write_text("")
+
+    logger = get_logger("test_find_fsf_files")
+    pending = _find_fsf_files(fsf_dir, "L1", logger)
+    rerun = _find_fsf_files(fsf_dir, "L1", logger, rerun_completed=True)
+
+    assert [fsf.name for fsf in pending] == ["run-2.fsf", "run-3.fsf"]
+    assert [fsf.name for fsf in rerun] == ["run-1.fsf", "run-2.fsf", "run-3.fsf"]
+
+
+def test_glm_launch_controller_array_job(glm_config_file: Path):
+    """Check running glm_launch controller in array job mode."""
+
+    with pytest.raises(SystemExit) as e:
+        glm_launch(
+            glm_config_file=glm_config_file,
+            level="L1",
+            model="example",
+            array_job=True,
+            max_concurrent=10,
+        )
+
+    assert e.value.code == 0
@@ -1,6 +1,20 @@
+import os
 import pytest
+import numpy as np
+import pandas as pd
+import nibabel as nib
 from pathlib import Path
 from clpipe import glm_prepare
+from clpipe.glm_prepare import (
+    _glm_l1_propagate,
+    _build_file_index,
+    _get_ev_confound_mat,
+    _glm_l2_propagate,
+    MUMFORD_MARKER_FILE_NAME,
+    FSFTemplate,
+)
+from clpipe.errors import EVFileNotFoundError, FSFTemplateError
+from clpipe.utils import get_logger
 
 
 def test_glm_prepare_controller_L1(glm_config_file: Path):
@@ -46,3 +60,202 @@ def _glm_l2_propagate_return(l2_block, reference_image, logger):
     assert l2_block["SubjectFile"] == "l2_sublist.csv"
     assert l2_block["ModelName"] == "example"
     assert reference_image == "SET REFERENCE"
+
+
+def _make_l1_inputs(test_path: Path, image_names):
+    """Create a small L1 prep layout with images, EVs, confounds and a prototype."""
+    target_dir = test_path / "data_postproc"
+    ev_dir = test_path / "EVs"
+    confound_dir = test_path / "confounds"
+    for image_name in image_names:
+        sub_dir = target_dir / image_name.split("_")[0] / "func"
+        sub_dir.mkdir(parents=True, exist_ok=True)
+        nib.Nifti1Image(
+            np.zeros((2, 2, 2, 7), dtype=np.float32), np.eye(4)
+        ).to_filename(sub_dir / f"{image_name}_desc-postproc_bold.nii.gz")
+        (ev_dir / image_name.split("_")[0]).mkdir(parents=True, exist_ok=True)
+        for ev in ["go.txt", "stop.txt"]:
+            (ev_dir / image_name.split("_")[0] / f"{image_name}_{ev}").write_text("")
+        confound_dir.mkdir(exist_ok=True)
+        (confound_dir / f"{image_name}_confounds.tsv").write_text("")
+
+    prototype = test_path / "prototype.fsf"
+    prototype.write_text(
+        'set fmri(outputdir) ""\n'
+        "set fmri(npts) 0\n"
+        'set feat_files(1) ""\n'
+        'set fmri(custom1) ""\n'
+        'set fmri(custom2) ""\n'
+        'set confoundev_files(1) ""\n'
+        'set fmri(regstandard) ""\n'
+    )
+
+    return {
+        "FSFPrototype": str(prototype),
+        "TargetDirectory": str(target_dir),
+        "TargetSuffix": "desc-postproc_bold.nii.gz",
+        "ImageIncludeList": "",
+        "ImageExcludeList": "",
+        "FSFDir": str(test_path / "fsfs"),
+        "EVDirectory": str(ev_dir),
+        "ConfoundDirectory": str(confound_dir),
+        "EVFileSuffices": ["go.txt", "stop.txt"],
+        "ConfoundSuffix": "confounds.tsv",
+        "OutputDir": str(test_path / "l1_feat"),
+    }
+
+
+def test_glm_l1_propagate_fsf_contents(artifact_dir, helpers, request):
+    """Check that each image's fsf picks up its timepoints, EVs and confounds."""
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    image_names = ["sub-01_task-gonogo", "sub-02_task-gonogo", "sub-03_task-rest"]
+    l1_block = _make_l1_inputs(test_path, image_names)
+
+    _glm_l1_propagate(
+        l1_block, "gonogo", "", get_logger("test_glm_l1_propagate"), max_workers=2
+    )
+
+    fsfs = sorted(os.listdir(l1_block["FSFDir"]))
+    assert fsfs == ["sub-01_task-gonogo.fsf", "sub-02_task-gonogo.fsf"]
+
+    fsf_lines = (Path(l1_block["FSFDir"]) / fsfs[1]).read_text().splitlines()
+    assert fsf_lines[1] == "set fmri(npts) 7"
+    assert fsf_lines[2].endswith('sub-02_task-gonogo_desc-postproc_bold.nii.gz"')
+    assert fsf_lines[3].endswith('sub-02_task-gonogo_go.txt"')
+    assert fsf_lines[4].endswith('sub-02_task-gonogo_stop.txt"')
+    assert fsf_lines[5].endswith('sub-02_task-gonogo_confounds.tsv"')
+    assert fsf_lines[6] == 'set fmri(regstandard) ""'
+
+
+def test_glm_l1_propagate_missing_ev(artifact_dir, helpers, request):
+    """Check that images missing an EV file are skipped."""
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    image_names = ["sub-01_task-gonogo", "sub-02_task-gonogo"]
+    l1_block = _make_l1_inputs(test_path, image_names)
+    os.remove(Path(l1_block["EVDirectory"]) / "sub-01" / "sub-01_task-gonogo_go.txt")
+
+    _glm_l1_propagate(l1_block, "gonogo", "", get_logger("test_glm_l1_propagate"))
+
+    assert os.listdir(l1_block["FSFDir"]) == ["sub-02_task-gonogo.fsf"]
+
+
+def test_build_file_index_nested(artifact_dir, helpers, request):
+    """Check that the index finds files at every depth and skips hidden ones."""
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    (test_path / "sub-01" / "func").mkdir(parents=True, exist_ok=True)
+    (test_path / "top.txt").write_text("")
+    (test_path / "sub-01" / "func" / "deep.txt").write_text("")
+    (test_path / "sub-01" / ".hidden.txt").write_text("")
+
+    index = _build_file_index(test_path)
+
+    assert sorted(index) == ["deep.txt", "top.txt"]
+    assert index["deep.txt"] == [str(test_path / "sub-01" / "func" / "deep.txt")]
+
+
+def test_get_ev_confound_mat_duplicate_ev(artifact_dir, helpers, request):
+    """Check that an EV file found in two places is not used."""
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    l1_block = _make_l1_inputs(test_path, ["sub-01_task-gonogo"])
+    (Path(l1_block["EVDirectory"]) / "sub-01_task-gonogo_go.txt").write_text("")
+    image = (
+        Path(l1_block["TargetDirectory"])
+        / "sub-01"
+        / "func"
+        / "sub-01_task-gonogo_desc-postproc_bold.nii.gz"
+    )
+
+    with pytest.raises(EVFileNotFoundError):
+        _get_ev_confound_mat(
+            str(image),
+            l1_block,
+            get_logger("test_get_ev_confound_mat"),
+            ev_index=_build_file_index(l1_block["EVDirectory"]),
+        )
+
+
+def test_glm_l2_propagate_shared_folders(artifact_dir, helpers, request, monkeypatch):
+    """Check that fsfs sharing an L1 folder get the workaround applied once, and that
+    fsfs with missing folders are reported."""
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+
+    fsl_dir = test_path / "fsl"
+    (fsl_dir / "etc" / "flirtsch").mkdir(parents=True, exist_ok=True)
+    (fsl_dir / "etc" / "flirtsch" / "ident.mat").write_text("1 0 0 0\n")
+    monkeypatch.setenv("FSLDIR", str(fsl_dir))
+
+    feat_folders = [test_path / "l1" / f"run-{run}.feat" for run in range(1, 4)]
+    for feat in feat_folders[:2]:
+        (feat / "reg_standard").mkdir(parents=True, exist_ok=True)
+        (feat / "mean_func.nii.gz").write_text("")
+    subject_file = test_path / "l2_sublist.csv"
+    pd.DataFrame(
+        {
+            "fsf_name": ["sub-01", "sub-01", "sub-02", "sub-02", "sub-03"],
+            "feat_folders": [str(feat_folders[i]) for i in [0, 1, 0, 1, 2]],
+            "L2_name": ["example"] * 5,
+        }
+    ).to_csv(subject_file, index=False)
+    prototype = test_path / "prototype.fsf"
+    prototype.write_text(
+        'set fmri(outputdir) ""\n'
+        'set feat_files(1) ""\n'
+        'set feat_files(2) ""\n'
+        'set fmri(regstandard) ""\n'
+    )
+    l2_block = {
+        "ModelName": "example",
+        "SubjectFile": str(subject_file),
+        "FSFPrototype": str(prototype),
+        "FSFDir": str(test_path / "fsfs"),
+        "OutputDir": str(test_path / "l2"),
+    }
+
+    summary = _glm_l2_propagate(l2_block, "", get_logger("test_glm_l2_propagate"))
+
+    assert list(summary.status) == ["created", "created", "missing"]
+    assert summary.missing_folders[2] == [str(feat_folders[2])]
+    assert sorted(os.listdir(l2_block["FSFDir"])) == ["sub-01.fsf", "sub-02.fsf"]
+    fsf_lines = (Path(l2_block["FSFDir"]) / "sub-02.fsf").read_text().splitlines()
+    assert fsf_lines[2] == f'set feat_files(2) "{feat_folders[1]}"'
+    for feat in feat_folders[:2]:
+        assert (feat / "reg" / MUMFORD_MARKER_FILE_NAME).exists()
+        assert not (feat / "reg_standard").exists()
+
+    # A second model over the same folders skips the workaround, but still
+    #   clears reg_standard
+    (feat_folders[0] / "reg" / "keep.mat").write_text("")
+    (feat_folders[0] / "reg_standard").mkdir()
+
+    _glm_l2_propagate(l2_block, "", get_logger("test_glm_l2_propagate"))
+
+    assert (feat_folders[0] / "reg" / "keep.mat").exists()
+    assert not (feat_folders[0] / "reg_standard").exists()
+
+
+def test_fsf_template_render():
+    """Check that settings replace their own lines, with paths quoted."""
+    fsf_template = FSFTemplate(
+        [
+            "# FEAT version number\n",
+            "set fmri(npts) 0\n",
+            'set feat_files(1) ""\n',
+            'set feat_files(2) ""\n',
+        ],
+        required_settings=["fmri(npts)", "feat_files(2)"],
+    )
+
+    new_fsf = fsf_template.render({"fmri(npts)": 120, "feat_files(2)": "/a.feat"})
+
+    assert new_fsf == [
+        "# FEAT version number\n",
+        "set fmri(npts) 120\n",
+        'set feat_files(1) ""\n',
+        'set feat_files(2) "/a.feat"\n',
+    ]
+    assert fsf_template.lines[1] == "set fmri(npts) 0\n"
+
+
+def test_fsf_template_missing_setting():
+    with pytest.raises(FSFTemplateError):
+        FSFTemplate(['set feat_files(1) ""\n'], required_settings=["feat_files(2)"])
@@ -1,5 +1,6 @@
 import pytest
 from clpipe.job_manager import *
+from clpipe.config.options import ProjectOptions
 
 SLURMUNCCONFIG: str = "tests/data/legacy_batch_configs/slurmUNCConfigSnakeCase.json"
 
@@ -76,3 +77,166 @@ def test_local_manager_instantiation(scatch_dir):
     assert process2.stdout.decode("utf-8") == "running\n"
 
     assert len(local_manager.job_queue) == 0
+
+
+def test_batch_manager_create_array_job(scatch_dir):
+    batch_config = BatchManagerConfig.from_default("unc")
+    batch_config.array_job_active = True
+    batch_config.array_throttle = 2
+    batch_manager = JobManagerFactory.get(
+        batch_config=batch_config, output_directory=scatch_dir
+    )
+
+    batch_manager.add_job(1, "echo hi")
+    batch_manager.add_job(2, "echo test")
+    batch_manager.add_job(3, "echo array")
+
+    array_job = batch_manager.create_array_job()
+    assert "--array=0-2%2" in array_job.job_string
+    assert array_job.job_string.startswith("sbatch --no-requeue --array=0-2%2 ")
+
+    manifest = scatch_dir / (array_job.job_name + ARRAY_MANIFEST_SUFFIX)
+    assert manifest.read_text() == "echo hi\necho test\necho array\n"
+
+    task_script = scatch_dir / (array_job.job_name + ".sh")
+    process = subprocess.run(
+        ["bash", str(task_script)],
+        capture_output=True,
+        env={**os.environ, "SLURM_ARRAY_TASK_ID": "1"},
+    )
+    assert process.stdout.decode("utf-8").endswith("test\n")
+
+
+def test_batch_manager_create_array_job_sge(scatch_dir):
+    batch_config = BatchManagerConfig.from_default("duke")
+    batch_config.array_throttle = 4
+    batch_manager = JobManagerFactory.get(
+        batch_config=batch_config, output_directory=scatch_dir
+    )
+
+    batch_manager.add_job(1, "echo hi")
+    batch_manager.add_job(2, "echo test")
+
+    array_job = batch_manager.create_array_job()
+    assert array_job.job_string.startswith("qsub -t 1-2 -tc 4 ")
+
+    task_script = scatch_dir / (array_job.job_name + ".sh")
+    process = subprocess.run(
+        ["bash", str(task_script)],
+        capture_output=True,
+        env={**os.environ, "SGE_TASK_ID": "1"},
+    )
+    assert process.stdout.decode("utf-8").endswith("hi\n")
+
+
+def test_local_manager_parallel_logs(scatch_dir):
+    local_manager = LocalJobManager(output_directory=scatch_dir, max_workers=2)
+
+    # Each job marks itself as started, then waits for the other job's marker.
+    #   The wait only succeeds if both jobs are running at the same time.
+    def wait_for(job_id):
+        marker = scatch_dir / f"{job_id}.started"
+        return (
+            f"for i in $(seq 300); do [ -e {marker} ] && break; sleep 0.1; done; "
+            f"[ -e {marker} ] || exit 99"
+        )
+
+    local_manager.add_job(
+        "sleeper_1",
+        f"touch {scatch_dir / 'sleeper_1.started'}; {wait_for('sleeper_2')}; "
+        "sleep 0.5; echo first",
+    )
+    local_manager.add_job(
+        "sleeper_2",
+        f"touch {scatch_dir / 'sleeper_2.started'}; {wait_for('sleeper_1')}; "
+        "sleep 0.5; echo second >&2; exit 3",
+    )
+
+    result1, result2 = local_manager.submit_jobs()
+
+    assert (scatch_dir / "sleeper_1.out").read_text() == "first\n"
+    assert (scatch_dir / "sleeper_2.err").read_text() == "second\n"
+    assert result1.returncode == 0
+    assert result2.returncode == 3
+    assert result2.duration >= 0.5
+
+
+def test_local_manager_max_workers_from_threads(scatch_dir):
+    local_manager = JobManagerFactory.get(output_directory=scatch_dir, threads=2)
+
+    assert local_manager.max_workers == max(1, (os.cpu_count() or 1) // 2)
+
+
+def test_local_manager_max_workers_from_config(scatch_dir, tmp_path):
+    config_path = tmp_path / "config.json"
+    ProjectOptions(batch_config_path="", max_workers=3).dump(config_path)
+    options = ProjectOptions.load(config_path)
+
+    local_manager = JobManagerFactory.get(
+        batch_config=options.batch_config_path,
+        output_directory=scatch_dir,
+        threads=2,
+        max_workers=options.max_workers,
+    )
+
+    assert isinstance(local_manager, LocalJobManager)
+    assert local_manager.max_workers == 3
+
+
+def test_get_dependency_levels(scatch_dir):
+    local_manager = LocalJobManager(output_directory=scatch_dir)
+
+    j1 = local_manager.add_job("j1", "echo j1")
+    j2 = local_manager.add_job("j2", "echo j2", parent_jobs=[j1])
+    j3 = local_manager.add_job("j3", "echo j3", parent_jobs=[j1])
+    j4 = local_manager.add_job("j4", "echo j4", parent_jobs=[j2, j3])
+    j5 = local_manager.add_job("j5", "echo j5")
+
+    assert local_manager.get_dependency_levels() == [[j1, j5], [j2, j3], [j4]]
+
+
+def test_get_dependency_levels_circular(scatch_dir):
+    local_manager = LocalJobManager(output_directory=scatch_dir)
+
+    j1 = local_manager.add_job("j1", "echo j1")
+    j2 = local_manager.add_job("j2", "echo j2", parent_jobs=[j1])
+    j1.parent_jobs.append(j2)
+
+    with pytest.raises(ValueError):
+        local_manager.get_dependency_levels()
+
+
+def test_local_manager_dependencies(scatch_dir):
+    local_manager = LocalJobManager(output_directory=scatch_dir, max_workers=4)
+    out_file = scatch_dir / "order.txt"
+
+    parent = local_manager.add_job("parent", f"sleep 0.3; echo parent >> {out_file}")
+    local_manager.add_job("child", f"echo child >> {out_file}", parent_jobs=[parent])
+    local_manager.submit_jobs()
+
+    assert out_file.read_text() == "parent\nchild\n"
+
+
+def test_batch_manager_dependencies(scatch_dir):
+    """Submit through a fake scheduler which records its arguments and prints
+    Slurm's submission message."""
+    fake_sbatch = scatch_dir / "fake_sbatch.sh"
+    submissions = scatch_dir / "submissions.txt"
+    fake_sbatch.write_text(
+        f'printf "%s\\n" "$*" >> {submissions}\n'
+        f"echo Submitted batch job $(wc -l < {submissions})\n"
+    )
+
+    batch_config = BatchManagerConfig.from_default("unc")
+    batch_config.submission_head = f"bash {fake_sbatch}"
+    batch_manager = JobManagerFactory.get(
+        batch_config=batch_config, output_directory=scatch_dir
+    )
+
+    j1 = batch_manager.add_job("j1", "echo j1")
+    j2 = batch_manager.add_job("j2", "echo j2")
+    j3 = batch_manager.add_job("j3", "echo j3", parent_jobs=[j1, j2])
+    batch_manager.submit_jobs()
+
+    assert (j1.scheduler_id, j2.scheduler_id, j3.scheduler_id) == ("1", "2", "3")
+    assert "--dependency=afterany:1:2" in submissions.read_text().splitlines()[2]
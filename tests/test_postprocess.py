@@ -3,6 +3,7 @@ from clpipe.config.options import ProcessingStream
 
 from clpipe.postprocutils.image_workflows import *
 from clpipe.postprocess import *
+from clpipe.postprocess import _create_image_submission_strings
 from pathlib import Path
 
 
@@ -139,3 +140,24 @@ def test_build_export_path_confounds(clpipe_fmriprep_dir: Path):
     assert str(export_path) == str(
         subject_out_dir / "func" / "sub-0_task-rest_desc-confounds_timeseries.tsv"
     )
+
+
+def test_create_image_submission_strings_inputs_file(artifact_dir, helpers, request):
+    """Test that image jobs are pointed to their resolved inputs file."""
+    from types import SimpleNamespace
+
+    test_dir = helpers.create_test_dir(artifact_dir, request.node.name)
+    image_path = test_dir / "sub-0_task-rest_desc-preproc_bold.nii.gz"
+    inputs_file = test_dir / f"{image_path.stem}{IMAGE_INPUTS_FILE_SUFFIX}"
+
+    submission_strings = _create_image_submission_strings(
+        test_dir / RUN_CONFIG_FILE_NAME,
+        [(SimpleNamespace(path=str(image_path)), inputs_file)],
+        test_dir,
+        test_dir,
+        test_dir,
+        False,
+        get_logger("test_submission_strings"),
+    )
+
+    assert f"-inputs_file {inputs_file}" in submission_strings[image_path.stem]
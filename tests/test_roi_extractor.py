@@ -1,11 +1,24 @@
 import pytest
+import json
+import sys
+import numpy as np
+import pandas as pd
 from clpipe.config.options import ProjectOptions
 from pathlib import Path
+from pkg_resources import resource_filename
 
 from clpipe.roi_extractor import (
     fmri_roi_extraction,
     fmri_roi_extract_image,
     fmriprep_mask_finder,
+    load_roi_image,
+    get_resampled_label_atlas,
+    extract_label_timeseries,
+    get_label_coverage,
+    save_roi_timeseries,
+    load_roi_timeseries,
+    consolidate_roi_timeseries,
+    check_output_format,
     STEP_NAME,
 )
 from clpipe.utils import get_logger
@@ -43,6 +56,261 @@ def test_fmri_roi_extraction_legacy(config_file_postproc_legacy_fmriprep):
     )
 
 
+def test_fmri_roi_extraction_multi_atlas(config_file_postproc):
+    """Test that multi atlas mode creates one job per subject."""
+    fmri_roi_extraction(
+        subjects=["1"],
+        single=False,
+        config_file=config_file_postproc,
+        multi_atlas=True,
+        debug=True,
+    )
+
+
+def test_fmri_roi_extract_image_preloaded(
+    sample_raw_image, artifact_dir, request, helpers
+):
+    """Test that extracting from a preloaded image matches extracting from its file."""
+    test_dir = helpers.create_test_dir(artifact_dir, request.node.name)
+    logger = get_logger(STEP_NAME, debug=True, log_dir=test_dir)
+
+    config = ProjectOptions()
+    config.roi_extraction.require_mask = False
+    config.postprocessing.target_directory = str(test_dir)
+    atlas_path = resource_filename(
+        "clpipe", "data/atlases/bigbrain/BigBrain300_MNI_coordinates.txt"
+    )
+
+    for out_dir, image in [
+        ("file", None),
+        ("preloaded", load_roi_image(sample_raw_image)),
+    ]:
+        config.roi_extraction.output_directory = test_dir / out_dir
+        Path(test_dir / out_dir / "bigbrain").mkdir(parents=True, exist_ok=True)
+        fmri_roi_extract_image(
+            str(sample_raw_image),
+            config,
+            "bigbrain",
+            atlas_path,
+            "sphere",
+            5,
+            True,
+            True,
+            logger,
+            image=image,
+        )
+
+    out_name = f"{Path(sample_raw_image).stem.split('.')[0]}_atlas-bigbrain.csv"
+    file_ts = np.loadtxt(test_dir / "file/bigbrain" / out_name, delimiter=",")
+    preloaded_ts = np.loadtxt(test_dir / "preloaded/bigbrain" / out_name, delimiter=",")
+
+    assert np.array_equal(file_ts, preloaded_ts, equal_nan=True)
+
+
+def test_extract_label_timeseries_matches_masker(
+    sample_raw_image, sample_raw_image_mask, artifact_dir, request, helpers
+):
+    """Test that the cached atlas extraction matches nilearn's labels masker."""
+    from nilearn.maskers import NiftiLabelsMasker
+
+    test_dir = helpers.create_test_dir(artifact_dir, request.node.name)
+    atlas_path = resource_filename(
+        "clpipe",
+        "data/atlases/harvard_oxford/HarvardOxford-cort-maxprob-thr25-2mm.nii.gz",
+    )
+    image = load_roi_image(sample_raw_image)
+
+    resampled_atlas = get_resampled_label_atlas(
+        atlas_path, image.affine, image.shape[:3], test_dir / "atlas_cache"
+    )
+    timeseries = extract_label_timeseries(
+        image, resampled_atlas, mask=sample_raw_image_mask
+    )
+
+    expected = NiftiLabelsMasker(
+        atlas_path, mask_img=sample_raw_image_mask
+    ).fit_transform(sample_raw_image)
+
+    assert timeseries.shape == expected.shape
+    assert np.allclose(timeseries, expected)
+
+
+def test_get_resampled_label_atlas_cached(
+    sample_raw_image, artifact_dir, request, helpers
+):
+    """Test that a resampled atlas is saved and reused for the same image grid."""
+    test_dir = helpers.create_test_dir(artifact_dir, request.node.name)
+    cache_dir = test_dir / "atlas_cache"
+    atlas_path = resource_filename(
+        "clpipe", "data/atlases/craddock/cc200_roi_atlas.nii.gz"
+    )
+    image = load_roi_image(sample_raw_image)
+
+    resampled_atlas = get_resampled_label_atlas(
+        atlas_path, image.affine, image.shape[:3], cache_dir
+    )
+    cache_files = list(cache_dir.glob("*.npz"))
+    cached_atlas = get_resampled_label_atlas(
+        atlas_path, image.affine, image.shape[:3], cache_dir
+    )
+
+    assert len(cache_files) == 1
+    assert list(cache_dir.glob("*.npz")) == cache_files
+    for key in resampled_atlas:
+        assert np.array_equal(resampled_atlas[key], cached_atlas[key])
+
+
+def test_get_label_coverage_matches_masker(
+    sample_raw_image_mask, artifact_dir, request, helpers
+):
+    """Test that ROI mask coverage matches averaging the mask with nilearn."""
+    from nilearn.image import concat_imgs
+    from nilearn.maskers import NiftiLabelsMasker
+
+    test_dir = helpers.create_test_dir(artifact_dir, request.node.name)
+    atlas_path = resource_filename(
+        "clpipe", "data/atlases/craddock/cc200_roi_atlas.nii.gz"
+    )
+
+    coverage = get_label_coverage(
+        atlas_path, sample_raw_image_mask, test_dir / "atlas_cache"
+    )
+
+    expected = NiftiLabelsMasker(atlas_path).fit_transform(
+        concat_imgs([sample_raw_image_mask, sample_raw_image_mask])
+    )[0]
+
+    assert np.allclose(coverage, expected)
+
+
+def test_save_roi_timeseries_npz(artifact_dir, request, helpers):
+    """Test that NPZ output keeps the ROI labels and image entities."""
+    test_dir = helpers.create_test_dir(artifact_dir, request.node.name)
+    timeseries = np.random.default_rng(0).random((10, 3))
+
+    out_file = save_roi_timeseries(
+        timeseries,
+        np.array([1, 4, 7]),
+        test_dir / "sub-1_task-rest_atlas-test",
+        "npz",
+        entities={"sub": "1", "task": "rest"},
+    )
+
+    roi_table = load_roi_timeseries(out_file)
+    with np.load(out_file) as roi_data:
+        entities = json.loads(str(roi_data["entities"]))
+
+    assert list(roi_table.columns) == ["1", "4", "7"]
+    assert np.array_equal(roi_table.to_numpy(), timeseries)
+    assert entities == {"sub": "1", "task": "rest"}
+
+
+def test_consolidate_roi_timeseries(artifact_dir, request, helpers):
+    """Test that runs are combined into one dataset per subject."""
+    test_dir = helpers.create_test_dir(artifact_dir, request.node.name)
+    config = ProjectOptions()
+    config.project_directory = str(test_dir)
+    config.roi_extraction.output_directory = str(test_dir)
+    config.roi_extraction.atlases = ["test"]
+    config.roi_extraction.output_format = "npz"
+
+    atlas_dir = test_dir / "test"
+    atlas_dir.mkdir(exist_ok=True)
+    for run_name, n_timepoints in [
+        ("sub-1_task-rest_run-1", 5),
+        ("sub-1_task-rest_run-2", 4),
+        ("sub-2_task-rest_run-1", 6),
+    ]:
+        save_roi_timeseries(
+            np.ones((n_timepoints, 2)),
+            [1, 2],
+            atlas_dir / f"{run_name}_atlas-test",
+            "npz",
+        )
+
+    consolidate_roi_timeseries(config_file=config, output_format="csv")
+
+    consolidated_dir = test_dir / "consolidated" / "atlas-test"
+    sub_1 = pd.read_csv(consolidated_dir / "sub-1.csv")
+
+    assert sorted(path.name for path in consolidated_dir.iterdir()) == [
+        "sub-1.csv",
+        "sub-2.csv",
+    ]
+    assert list(sub_1.columns) == ["sub", "task", "run", "timepoint", "1", "2"]
+    assert list(sub_1["run"]) == [1] * 5 + [2] * 4
+    assert list(sub_1["timepoint"]) == list(range(5)) + list(range(4))
+
+
+def test_consolidate_roi_timeseries_parquet(artifact_dir, request, helpers):
+    """Test the parquet write, read and consolidate round trip."""
+    pytest.importorskip("pyarrow")
+
+    test_dir = helpers.create_test_dir(artifact_dir, request.node.name)
+    config = ProjectOptions()
+    config.project_directory = str(test_dir)
+    config.roi_extraction.output_directory = str(test_dir)
+    config.roi_extraction.atlases = ["test"]
+    config.roi_extraction.output_format = "parquet"
+
+    atlas_dir = test_dir / "test"
+    atlas_dir.mkdir(exist_ok=True)
+    timeseries = np.random.default_rng(0).random((5, 2))
+    out_file = save_roi_timeseries(
+        timeseries,
+        [3, 8],
+        atlas_dir / "sub-1_task-rest_atlas-test",
+        "parquet",
+        entities={"sub": "1", "task": "rest"},
+    )
+
+    roi_table = load_roi_timeseries(out_file)
+
+    assert list(roi_table.columns) == ["3", "8"]
+    assert np.allclose(roi_table.to_numpy(), timeseries)
+
+    consolidate_roi_timeseries(config_file=config)
+
+    sub_1 = pd.read_parquet(test_dir / "consolidated" / "atlas-test" / "sub-1.parquet")
+
+    assert list(sub_1.columns) == ["sub", "task", "timepoint", "3", "8"]
+    assert np.allclose(sub_1[["3", "8"]].to_numpy(), timeseries)
+
+
+def test_check_output_format_parquet_missing_pyarrow(monkeypatch):
+    """Test that parquet output fails before extraction when pyarrow is missing."""
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+
+    with pytest.raises(ImportError):
+        check_output_format("parquet")
+    with pytest.raises(ValueError):
+        check_output_format("xlsx")
+
+
+def test_consolidate_roi_timeseries_no_subject(artifact_dir, request, helpers):
+    """Test that runs without a subject entity are skipped."""
+    test_dir = helpers.create_test_dir(artifact_dir, request.node.name)
+    config = ProjectOptions()
+    config.project_directory = str(test_dir)
+    config.roi_extraction.output_directory = str(test_dir)
+    config.roi_extraction.atlases = ["test"]
+    config.roi_extraction.output_format = "csv"
+
+    atlas_dir = test_dir / "test"
+    atlas_dir.mkdir(exist_ok=True)
+    for run_name in ["sub-1_task-rest", "task-rest"]:
+        save_roi_timeseries(
+            np.ones((3, 2)), [1, 2], atlas_dir / f"{run_name}_atlas-test"
+        )
+
+    consolidate_roi_timeseries(config_file=config)
+
+    consolidated_dir = test_dir / "consolidated" / "atlas-test"
+
+    assert [path.name for path in consolidated_dir.iterdir()] == ["sub-1.csv"]
+    assert len(pd.read_csv(consolidated_dir / "sub-1.csv")) == 3
+
+
 def test_fmri_roi_extract_image(clpipe_postproc_dir, artifact_dir, request, helpers):
     """Given an fmriprep target image, test ROI extraction on a single subject - show output."""
     artifact_dir = helpers.create_test_dir(artifact_dir, request.node.name)
@@ -70,6 +338,7 @@ def test_fmri_roi_extract_image(clpipe_postproc_dir, artifact_dir, request, help
         logger,
     )
 
+
 def test_fmriprep_mask_finder(clpipe_postproc_dir):
     """Ensure that this function finds the correct fMRIPrep mask given
     a specific postprocessing image."""